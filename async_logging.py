@@ -0,0 +1,180 @@
+import json
+import time
+import queue
+import logging
+import threading
+from logging.handlers import QueueHandler
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _message_key(record: logging.LogRecord) -> Tuple[int, str, str]:
+    """重复日志的分组键：级别、logger名称和消息中第一个冒号之前的部分"""
+    message = record.getMessage()
+    for sep in (':', '：'):
+        idx = message.find(sep)
+        if idx > 0:
+            message = message[:idx]
+    return record.levelno, record.name, message.strip()
+
+
+class RepeatAggregator:
+    """合并重复日志
+
+    同一分组键（见_message_key）的WARNING及以上日志，在一个时间窗口内只输出第一条，
+    其余只计数，窗口结束后输出一条汇总，如 "LLM调用失败 ×3421（最近10秒内重复，已合并）"。
+
+    Args:
+        window: 时间窗口（秒），小于等于0时不合并
+        min_level: 参与合并的最低日志级别
+        clock: 时钟函数，用于测试
+    """
+
+    def __init__(self, window: float = 10.0, min_level: int = logging.WARNING,
+                 clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.min_level = min_level
+        self.clock = clock
+        # 分组键 -> [窗口开始时间, 被合并的条数, 最后一条日志]
+        self._windows: Dict[Tuple[int, str, str], list] = {}
+
+    def process(self, record: logging.LogRecord) -> List[logging.LogRecord]:
+        """处理一条日志，返回需要输出的日志（可能为空，也可能包含上一个窗口的汇总）"""
+        if self.window <= 0 or record.levelno < self.min_level:
+            return [record]
+        key = _message_key(record)
+        now = self.clock()
+        state = self._windows.get(key)
+        if state is not None and now - state[0] < self.window:
+            state[1] += 1
+            state[2] = record
+            return []
+        emitted = []
+        if state is not None and state[1]:
+            emitted.append(self._summary(key, state))
+        self._windows[key] = [now, 0, record]
+        emitted.append(record)
+        return emitted
+
+    def expired(self, flush_all: bool = False) -> List[logging.LogRecord]:
+        """返回已结束窗口的汇总日志，flush_all为True时输出所有窗口的汇总"""
+        now = self.clock()
+        emitted = []
+        for key, state in list(self._windows.items()):
+            if flush_all or now - state[0] >= self.window:
+                if state[1]:
+                    emitted.append(self._summary(key, state))
+                del self._windows[key]
+        return emitted
+
+    def _summary(self, key: Tuple[int, str, str], state: list) -> logging.LogRecord:
+        record = logging.makeLogRecord(state[2].__dict__)
+        record.msg = f"{key[2]} ×{state[1]}（最近{self.window:g}秒内重复，已合并）"
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.repeat_count = state[1]
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化JSON日志，每行一个JSON对象"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "repeat_count", None):
+            entry["repeat_count"] = record.repeat_count
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class AsyncLogListener:
+    """后台日志线程：从队列取出日志，合并重复日志后交给文件、终端等handler输出
+
+    工作线程只把日志放入无界队列，不会因为日志I/O阻塞。
+
+    Args:
+        log_queue: 日志队列
+        handlers: 实际输出日志的handler
+        aggregator: 重复日志合并器，为None时不合并
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_queue: queue.SimpleQueue, handlers: List[logging.Handler],
+                 aggregator: Optional[RepeatAggregator] = None):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.aggregator = aggregator
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """输出队列中剩余的日志和所有汇总后退出"""
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+    def _emit(self, records: List[logging.LogRecord]):
+        for record in records:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                record = None
+            if record is self._STOP:
+                break
+            if self.aggregator is None:
+                if record is not None:
+                    self._emit([record])
+                continue
+            if record is not None:
+                self._emit(self.aggregator.process(record))
+            self._emit(self.aggregator.expired())
+        if self.aggregator is not None:
+            self._emit(self.aggregator.expired(flush_all=True))
+
+
+def setup_async_logging(handlers: List[logging.Handler], level: int = logging.INFO,
+                        aggregate_window: float = 10.0) -> AsyncLogListener:
+    """将根logger的输出改为经由队列异步写出
+
+    Args:
+        handlers: 实际输出日志的handler（需已设置formatter）
+        level: 根logger的日志级别
+        aggregate_window: 重复日志合并的时间窗口（秒），小于等于0时不合并
+
+    Returns:
+        已启动的日志线程，退出前调用stop()输出剩余日志
+    """
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    aggregator = RepeatAggregator(aggregate_window) if aggregate_window > 0 else None
+    listener = AsyncLogListener(log_queue, handlers, aggregator)
+    listener.start()
+    return listener
@@ -0,0 +1,150 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from http_transport import percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEVELS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+class LevelResult(NamedTuple):
+    """单个并发档位的压测结果"""
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float  # 每秒成功请求数
+    p50: float
+    p99: float
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+
+def parse_levels(value: Optional[str]) -> List[int]:
+    """解析并发档位，如 1,2,4,8；值为空时使用默认档位"""
+    if not value or not value.strip():
+        return list(DEFAULT_LEVELS)
+    levels = sorted({int(v) for v in value.split(',') if v.strip()})
+    if not levels or levels[0] < 1:
+        raise ValueError(f"并发档位必须为正整数: {value}")
+    return levels
+
+
+def benchmark_level(send: Callable[[str], bool], prompts: Sequence[str], concurrency: int,
+                    num_requests: int) -> LevelResult:
+    """以固定并发发送num_requests个请求（循环使用样本prompt），预热请求不计入统计
+
+    Args:
+        send: 发送单个prompt的函数，成功返回True
+        prompts: 样本prompt
+        concurrency: 并发数
+        num_requests: 请求总数
+    """
+    def timed(prompt: str):
+        start = time.perf_counter()
+        try:
+            ok = send(prompt)
+        except Exception as e:
+            logger.debug(f"压测请求失败: {e}")
+            ok = False
+        return ok, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # 预热：先发送一轮请求建立连接，不计入统计
+        list(executor.map(timed, (prompts[i % len(prompts)] for i in range(concurrency))))
+        start = time.perf_counter()
+        results = list(executor.map(timed, (prompts[i % len(prompts)] for i in range(num_requests))))
+        seconds = time.perf_counter() - start
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    errors = num_requests - len(latencies)
+    return LevelResult(
+        concurrency=concurrency,
+        requests=num_requests,
+        errors=errors,
+        seconds=seconds,
+        throughput=len(latencies) / seconds if seconds > 0 else 0.0,
+        p50=percentile(latencies, 50),
+        p99=percentile(latencies, 99),
+    )
+
+
+def find_knee(results: Sequence[LevelResult], min_gain: float = 0.1,
+              max_error_rate: float = 0.05) -> Optional[LevelResult]:
+    """找到吞吐曲线的拐点：再提高并发，吞吐提升不足min_gain的最小并发
+
+    错误率超过max_error_rate的档位不参与比较。
+    """
+    knee = None
+    for result in sorted(results, key=lambda r: r.concurrency):
+        if result.error_rate > max_error_rate:
+            continue
+        if knee is None or result.throughput >= knee.throughput * (1 + min_gain):
+            knee = result
+    return knee
+
+
+def recommend(knee: LevelResult) -> Dict[str, int]:
+    """根据拐点给出推荐配置
+
+    BATCH_SIZE为在途行数上限，取线程数的2倍，使线程完成一行后总有下一行可以处理。
+    """
+    return {
+        "MAX_THREAD_NUM": knee.concurrency,
+        "BATCH_SIZE": knee.concurrency * 2,
+    }
+
+
+def run_autotune(send: Callable[[str], bool], prompts: Sequence[str], levels: Sequence[int],
+                 requests_per_level: Optional[int] = None, min_gain: float = 0.1,
+                 max_error_rate: float = 0.05) -> List[LevelResult]:
+    """逐档提高并发进行压测
+
+    吞吐连续两档提升不足min_gain，或错误率超过max_error_rate时提前停止。
+
+    Args:
+        send: 发送单个prompt的函数，成功返回True
+        prompts: 样本prompt
+        levels: 并发档位
+        requests_per_level: 每档请求数，为None时取并发数的4倍（至少与样本数相同）
+        min_gain: 判定吞吐已饱和的最小提升比例
+        max_error_rate: 最大可接受错误率
+
+    Returns:
+        每档的压测结果
+    """
+    if not prompts:
+        raise ValueError("没有可用于压测的prompt，请检查INPUT_PATH和INPUT_COLUMNS")
+    results = []
+    stalled = 0
+    for concurrency in sorted(levels):
+        num_requests = requests_per_level or max(concurrency * 4, len(prompts))
+        result = benchmark_level(send, prompts, concurrency, num_requests)
+        results.append(result)
+        logger.info(f"[autotune] 并发{concurrency}: 吞吐{result.throughput:.1f}请求/秒，"
+                    f"p50 {result.p50:.3f}s，p99 {result.p99:.3f}s，错误率{result.error_rate:.1%}")
+
+        if result.error_rate > max_error_rate:
+            logger.warning(f"[autotune] 并发{concurrency}时错误率{result.error_rate:.1%}超过{max_error_rate:.0%}，停止压测")
+            break
+        knee = find_knee(results, min_gain, max_error_rate)
+        stalled = stalled + 1 if knee is not None and knee.concurrency != concurrency else 0
+        if stalled >= 2:
+            break
+    return results
+
+
+def format_env_snippet(results: Sequence[LevelResult], knee: LevelResult, settings: Dict[str, int]) -> str:
+    """生成.env片段，包含推荐配置和压测数据"""
+    lines = ["# ==============autotune推荐配置=============="]
+    lines.append("# 并发\t吞吐(请求/秒)\tp50(秒)\tp99(秒)\t错误率")
+    for r in results:
+        mark = "  <- 拐点" if r.concurrency == knee.concurrency else ""
+        lines.append(f"# {r.concurrency}\t{r.throughput:.1f}\t{r.p50:.3f}\t{r.p99:.3f}\t{r.error_rate:.1%}{mark}")
+    lines.extend(f"{key}={value}" for key, value in settings.items())
+    return "\n".join(lines) + "\n"
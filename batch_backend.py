@@ -0,0 +1,310 @@
+import io
+import json
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 批量任务的终态
+_FINISHED = ("completed", "failed", "expired", "cancelled")
+
+
+class _Pending:
+    __slots__ = ("custom_id", "body", "future", "enqueued", "deadline", "taken", "finished")
+
+    def __init__(self, custom_id: str, body: Dict, deadline: Optional[float]):
+        self.custom_id = custom_id
+        self.body = body
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.deadline = deadline
+        self.taken = False
+        self.finished = False
+
+
+class BatchApiBatcher:
+    """通过离线批量接口（/v1/files + /v1/batches）发送请求
+
+    提交的请求按custom_id写入批量输入文件，凑满max_requests个请求，
+    或最早的请求已等待max_wait秒时上传并创建批量任务，之后每隔poll_interval秒查询状态，
+    完成后下载输出文件，按custom_id把结果分发回各个请求。失败的请求以异常返回，
+    由process_entry的重试逻辑重新提交，进入下一个批量任务。
+    请求到达截止时间时以超时异常返回；批量任务中的请求全部超时，或调用close时，
+    取消在途的批量任务，不等待其完成。凑批线程和轮询线程池在close后停止，之后再提交请求时重新启动。
+
+    Args:
+        client: OpenAI客户端
+        system_prompt: 对话的system prompt
+        max_requests: 每个批量任务最多包含的请求数
+        max_wait: 凑批的最长等待时间（秒）
+        poll_interval: 查询批量任务状态的间隔（秒）
+        completion_window: 批量任务的完成时限，如24h
+        max_batches: 同时在途的批量任务数
+    """
+
+    def __init__(self, client, system_prompt: str, max_requests: int = 1000, max_wait: float = 60.0,
+                 poll_interval: float = 30.0, completion_window: str = "24h", max_batches: int = 8):
+        if max_requests < 1:
+            raise ValueError(f"BATCH_API_MAX_REQUESTS必须大于0: {max_requests}")
+        self.client = client
+        self.system_prompt = system_prompt
+        self.max_requests = max_requests
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.max_batches = max(1, max_batches)
+        self.batches = 0
+        self.requests = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._ids = itertools.count()
+        self._queue = deque()
+        # 队列中请求的截止时间堆 (截止时间, custom_id, 请求)，已取走或已结束的请求在出堆时跳过
+        self._deadlines = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop: Optional[threading.Event] = None
+
+    def _start(self):
+        """启动凑批线程和轮询线程池（调用时已持有锁）"""
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_batches, thread_name_prefix="batch-api")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._executor, self._stop),
+                                        name="batch-api-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, generate_config: Dict, timeout: Optional[float] = None) -> Future:
+        """提交一个prompt，不等待结果
+
+        Args:
+            prompt: 输入的prompt文本
+            generate_config: 请求参数
+            timeout: 等待结果的最长时间（秒），到时future以FutureTimeoutError结束，None表示不限制
+
+        Returns:
+            批量任务返回后得到响应文本的future，失败时为异常
+        """
+        body = {
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            **generate_config,
+        }
+        item = _Pending(f"req-{next(self._ids)}", body, time.monotonic() + timeout if timeout is not None else None)
+        with self._cond:
+            self._start()
+            self._queue.append(item)
+            if item.deadline is not None:
+                heapq.heappush(self._deadlines, (item.deadline, item.custom_id, item))
+            self._cond.notify()
+        return item.future
+
+    def complete(self, prompt: str, generate_config: Dict, timeout: Optional[float] = None) -> str:
+        """提交一个prompt并等待批量任务返回结果，失败或超过timeout秒时抛出异常"""
+        return self.submit(prompt, generate_config, timeout).result()
+
+    def close(self):
+        """取消队列中的请求和在途的批量任务，停止凑批线程和轮询线程池"""
+        with self._cond:
+            thread, executor, stop = self._thread, self._executor, self._stop
+            self._thread = self._executor = self._stop = None
+            queued = [item for item in self._queue if not item.taken]
+            self._queue.clear()
+            self._deadlines.clear()
+            self._cond.notify_all()
+        if thread is None:
+            return
+        stop.set()
+        for item in queued:
+            self._finish(item, error=RuntimeError("批量接口已关闭"))
+        thread.join()
+        executor.shutdown(wait=True)
+
+    def _finish(self, item: _Pending, result: Optional[str] = None, error: Optional[BaseException] = None) -> bool:
+        """结束一个请求（只生效一次），在锁外设置结果，future的回调可能重新提交请求
+
+        Returns:
+            是否由本次调用结束
+        """
+        with self._cond:
+            if item.finished:
+                return False
+            item.finished = True
+        if error is not None:
+            item.future.set_exception(error)
+        else:
+            item.future.set_result(result)
+        return True
+
+    def _expire_queued(self) -> List[_Pending]:
+        """取出队列中已到截止时间的请求（调用时已持有锁）"""
+        now = time.monotonic()
+        expired = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, item = heapq.heappop(self._deadlines)
+            if not item.taken and not item.finished:
+                item.taken = True
+                expired.append(item)
+        # 超时的请求留在队列中，凑批时跳过
+        while self._queue and self._queue[0].taken:
+            self._queue.popleft()
+        return expired
+
+    def _take_batch(self) -> Optional[List[_Pending]]:
+        """等待凑满一批或超时；已关闭且队列为空时返回None"""
+        while True:
+            with self._cond:
+                expired = self._expire_queued()
+                if not expired:
+                    batch = self._wait_batch()
+                    if batch is None or batch:
+                        return batch
+            for item in expired:
+                self._finish(item, error=FutureTimeoutError(f"请求{item.custom_id}在提交批量任务前已超时"))
+
+    def _wait_batch(self) -> Optional[List[_Pending]]:
+        """等待凑满一批（调用时已持有锁）；有请求到达截止时间时返回空列表，已关闭时返回None
+
+        close时队列中的请求已由close结束，关闭后重新启动时队列属于新的凑批线程。
+        """
+        while not self._queue:
+            if self._thread is not threading.current_thread():
+                return None
+            self._cond.wait(self._next_expiry())
+            if self._deadlines and self._deadlines[0][0] <= time.monotonic():
+                return []
+        deadline = self._queue[0].enqueued + self.max_wait
+        while self._queue and len(self._queue) < self.max_requests:
+            if self._thread is not threading.current_thread():
+                return None
+            now = time.monotonic()
+            if deadline <= now:
+                break
+            if self._deadlines and self._deadlines[0][0] <= now:
+                return []
+            self._cond.wait(min(deadline, self._deadlines[0][0]) - now if self._deadlines else deadline - now)
+        if self._thread is not threading.current_thread():
+            return None
+        batch = []
+        while self._queue and len(batch) < self.max_requests:
+            item = self._queue.popleft()
+            if not item.taken:
+                item.taken = True
+                batch.append(item)
+        return batch
+
+    def _next_expiry(self) -> Optional[float]:
+        """距离队列中最早的截止时间的秒数（调用时已持有锁）"""
+        return max(0.0, self._deadlines[0][0] - time.monotonic()) if self._deadlines else None
+
+    def _run(self, executor: ThreadPoolExecutor, stop: threading.Event):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            executor.submit(self._send, batch, stop)
+
+    def _send(self, batch: List[_Pending], stop: threading.Event):
+        try:
+            results = self._run_batch(batch, stop)
+        except Exception as e:
+            logger.error(f"批量任务失败（{len(batch)}个请求）: {e}")
+            for item in batch:
+                self._finish(item, error=e)
+            return
+
+        failed = 0
+        for item in batch:
+            result = results.get(item.custom_id)
+            if isinstance(result, str):
+                self._finish(item, result)
+            elif self._finish(item, error=RuntimeError(result or f"批量结果缺少请求{item.custom_id}")):
+                failed += 1
+        with self._cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.failed += failed
+
+    def _run_batch(self, batch: List[_Pending], stop: threading.Event) -> Dict[str, object]:
+        """上传输入文件、创建批量任务并等待完成
+
+        等待期间到达截止时间的请求以超时异常结束；所有请求都已结束或已调用close时取消批量任务。
+
+        Returns:
+            custom_id -> 响应文本（成功）或错误信息（失败）
+        """
+        lines = [json.dumps({"custom_id": item.custom_id, "method": "POST", "url": "/v1/chat/completions",
+                             "body": item.body}, ensure_ascii=False) for item in batch]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        input_file = self.client.files.create(file=("batch_input.jsonl", io.BytesIO(data)), purpose="batch")
+        job = self.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                         completion_window=self.completion_window)
+        logger.info(f"已提交批量任务{job.id}: {len(batch)}个请求")
+
+        # 按截止时间排序，每次轮询只需检查最早的几个请求
+        expiring = deque(sorted((item for item in batch if item.deadline is not None), key=lambda item: item.deadline))
+        live = len(batch)
+        while job.status not in _FINISHED:
+            now = time.monotonic()
+            while expiring and expiring[0].deadline <= now:
+                item = expiring.popleft()
+                if self._finish(item, error=FutureTimeoutError(f"请求{item.custom_id}等待批量任务{job.id}超时")):
+                    live -= 1
+            if stop.is_set() or not live:
+                self._cancel(job)
+                raise RuntimeError(f"批量任务{job.id}已取消")
+            wait = self.poll_interval
+            if expiring:
+                wait = min(wait, max(0.0, expiring[0].deadline - now))
+            if stop.wait(wait):
+                continue
+            job = self.client.batches.retrieve(job.id)
+        if job.status != "completed":
+            raise RuntimeError(f"批量任务{job.id}状态为{job.status}")
+
+        results: Dict[str, object] = {}
+        for file_id in (job.output_file_id, job.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    results[record["custom_id"]] = self._parse_result(record)
+        logger.info(f"批量任务{job.id}已完成")
+        return results
+
+    def _cancel(self, job):
+        """取消批量任务，取消失败时只记录日志"""
+        try:
+            self.client.batches.cancel(job.id)
+        except Exception as e:
+            logger.warning(f"取消批量任务{job.id}失败: {e}")
+        with self._cond:
+            self.cancelled += 1
+        logger.info(f"已取消批量任务{job.id}")
+
+    @staticmethod
+    def _parse_result(record: Dict) -> object:
+        """解析输出文件中的一行，成功时返回响应文本，失败时返回错误信息（非字符串）"""
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            return {"error": record.get("error") or response.get("body")}
+        content = response["body"]["choices"][0]["message"]["content"]
+        return content.strip() if content is not None else {"error": "响应内容为空"}
+
+    def log_summary(self):
+        """输出批量任务统计"""
+        if self.batches:
+            logger.info(f"批量接口: {self.batches}个批量任务，共{self.requests}个请求，失败{self.failed}个")
+        if self.cancelled:
+            logger.info(f"批量接口: 取消{self.cancelled}个批量任务")
@@ -1,16 +1,47 @@
 import os
 import json
+import asyncio
+import itertools
 import logging
+import time
+import threading
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from prompt import all_prompt_dict
+import contextlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm
-from typing import Dict, List, Optional, Callable, Any, Union
+from typing import Dict, List, Optional, Callable, Any, Union, Iterable, Iterator, Tuple, AsyncIterable, AsyncIterator
 from openai import OpenAI
-from dataset_config import DatasetConfig
+from dataset_config import DatasetConfig, INPUT_SUFFIXES
+from execution_plan import ExecutionPlan, PromptNode, compile_plan
+from http_transport import HttpTimingStats, build_http_client
+from memory_budget import InflightBudget
+from file_tasks import FileTask, interleave_rows
+from columnar_io import ColumnarFileTask, ColumnarWriter, count_rows, is_columnar, iter_columnar
+from raw_store import RawResponseStore, reprocess_chunk, row_key
+from dead_letter import (
+    RowStatus, DeadLetterWriter, iter_dead_letter_lines, iter_dead_letters,
+    default_resume_path, read_resume_point, write_resume_point,
+    REASON_EMPTY_RESULT, REASON_INVALID_FIELDS, REASON_LLM_FAILED, REASON_PROCESSOR_REJECTED,
+    REASON_WRONG_DATA, REASON_OVERSIZED, REASON_EXCEPTION, REASON_DEADLINE,
+)
+from preflight import CharTokenEstimator, Preflight, DryRunReport
+from scheduler import LengthAwareScheduler, ReorderBuffer
+from completion_batcher import CompletionBatcher
+from batch_backend import BatchApiBatcher
+from model_cascade import CascadeTier, ModelCascade
+from near_dup import NearDupIndex
+from autotune import find_knee, format_env_snippet, recommend, run_autotune
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "你叫理想同学，你是一个有用的助手。"
+# map/amap返回失败的行时，记录失败原因的列名
+FAILURE_REASON_COLUMN = "failure_reason"
+# 设置截止时间时重试的退避时间：从RETRY_BACKOFF_BASE秒开始逐次翻倍，最长RETRY_BACKOFF_MAX秒
+RETRY_BACKOFF_BASE = 0.1
+RETRY_BACKOFF_MAX = 30.0
+
 
 class ChatLLM:
     """聊天LLM处理类
@@ -23,6 +54,25 @@ class ChatLLM:
         api_key: LLM服务的API密钥，如果是本地部署则不需要密钥
         grouped_mode: 是否开启分组模式
         grouped_output_columns: 分组模式下的输出列分组信息
+        http_config: HTTP连接池配置，详见http_transport.build_http_client
+        preflight: 请求发送前的token预检，用于过滤超长数据并动态设置max_tokens
+        plan: 编译好的执行计划，为None时根据prompt_key、response_processor等参数编译
+        scheduler: 按预估成本调整提交顺序的调度器，为None时按输入顺序提交
+        backend: LLM接口，chat、completions（面向基座模型，多行prompt合并为一次请求）
+            或batch（离线批量接口，适合对延迟不敏感的大任务）
+        completions_batch_size: completions后端每次请求最多包含的prompt数
+        completions_batch_wait: completions后端凑批的最长等待时间（秒）
+        batch_api_config: batch后端的配置，详见batch_backend.BatchApiBatcher
+        request_timeout: 单次请求的超时时间（秒）
+        row_deadline: 单行处理（包括所有重试）的截止时间（秒）
+        run_deadline: 整体运行的截止时间（秒），到达后未处理的行写入死信文件
+        near_dup: 近似重复检测索引，相似的行只发送代表行，其余行复制代表行的结果
+        near_dup_column: 记录复制来源（代表行的行键和相似度）的列名
+        client: 共享的OpenAI客户端（如常驻服务中多个任务共用连接池），为None时按http_config创建
+        request_gate: 每次请求前进入的上下文管理器（如常驻服务的全局并发限制），为None时不限制
+        model_cascade: 模型级联，prompt_key -> 按顺序尝试的模型（模型名 或 模型名@服务地址），
+            前一级的输出被拒绝时才升级到下一级
+        confidence_check: 模型级联的置信度检查，参数为 (原始响应, {输出列: 解析结果})，返回False时升级
     """
     
     def __init__(
@@ -35,6 +85,23 @@ class ChatLLM:
         api_key: str = "test",
         grouped_mode: bool = False,
         grouped_output_columns: Optional[List[List[str]]] = None,
+        http_config: Optional[Dict] = None,
+        preflight: Optional[Preflight] = None,
+        plan: Optional[ExecutionPlan] = None,
+        scheduler: Optional[LengthAwareScheduler] = None,
+        backend: str = "chat",
+        completions_batch_size: int = 16,
+        completions_batch_wait: float = 0.02,
+        batch_api_config: Optional[Dict] = None,
+        request_timeout: Optional[float] = None,
+        row_deadline: Optional[float] = None,
+        run_deadline: Optional[float] = None,
+        near_dup: Optional[NearDupIndex] = None,
+        near_dup_column: str = "near_dup_of",
+        client: Optional[OpenAI] = None,
+        request_gate: Optional[contextlib.AbstractContextManager] = None,
+        model_cascade: Optional[Dict[str, List[str]]] = None,
+        confidence_check: Optional[Callable[[str, Dict[str, Any]], bool]] = None,
     ):
         """初始化ChatLLM实例
         
@@ -47,74 +114,299 @@ class ChatLLM:
             api_key: API密钥，默认为"test"
             grouped_mode: 是否开启分组模式
             grouped_output_columns: 分组模式下的输出列分组信息
+            http_config: HTTP连接池配置，未配置连接池大小时按max_thread_num设置
+            preflight: token预检对象，为None时不做预检
+            plan: 执行计划，由execution_plan.compile_plan编译
+            scheduler: 按预估成本调整提交顺序的调度器，为None时按输入顺序提交
+            backend: chat（/v1/chat/completions）、completions（/v1/completions，多行prompt合并请求）
+                或batch（/v1/batches，请求写入批量输入文件后提交，轮询获取结果）
+            completions_batch_size: completions后端每次请求最多包含的prompt数
+            completions_batch_wait: completions后端凑批的最长等待时间（秒）
+            batch_api_config: batch后端的配置（max_requests、max_wait、poll_interval、completion_window）
+            request_timeout: 单次请求的超时时间（秒），None表示使用HTTP读超时
+            row_deadline: 单行处理（包括所有重试）的截止时间（秒），None表示不限制
+            run_deadline: 整体运行的截止时间（秒），到达后停止提交新行，None表示不限制
+            near_dup: 近似重复检测索引，None表示不检测
+            near_dup_column: 复制结果的行中记录来源的列名
+            client: 共享的OpenAI客户端，为None时创建本实例专用的客户端
+            request_gate: 每次请求前进入的上下文管理器，可重复进入
+            model_cascade: 模型级联，None表示所有请求使用generate_config中的模型
+            confidence_check: 模型级联的置信度检查，None表示只按输出解析器判断
         """
         self.llm_url = llm_url
-        self.prompt_keys = prompt_key if isinstance(prompt_key, list) else [prompt_key]
+        self.prompt_keys = plan.prompt_keys if plan else (prompt_key if isinstance(prompt_key, list) else [prompt_key])
         self.dataset_config = dataset_config
         self.api_key = api_key
         self.generate_config = generate_config or {}
+        self.preflight = preflight
+        self.scheduler = scheduler if scheduler and scheduler.enabled else None
+        self.near_dup = near_dup
+        self.near_dup_column = near_dup_column
+        self._oversize_lock = threading.Lock()
+        # 每个工作线程当前处理行的状态，用于记录失败原因
+        self._local = threading.local()
+        self.dead_letter_writer: Optional[DeadLetterWriter] = None
+        # 当前运行的进度条，供常驻服务查询任务进度
+        self.progress: Optional[tqdm] = None
+        self.raw_store: Optional[RawResponseStore] = None
+        # 进行中的map调用数：并发调用共享原始响应存储和凑批线程，最后一个调用结束时才关闭
+        self._active_runs = 0
+        self._runs_lock = threading.Lock()
         
         # 分组模式相关属性
         self.grouped_mode = grouped_mode
         self.grouped_output_columns = grouped_output_columns
         
-        if grouped_mode:
-            # 分组模式：response_processor应该是List[List[Callable]]
-            self.grouped_response_processors = response_processor
-            logger.info(f"初始化ChatLLM（分组模式），URL: {llm_url}")
-            logger.info(f"Prompt Keys: {self.prompt_keys}")
-            logger.info(f"分组数量: {len(self.grouped_response_processors)}")
-            for i, group in enumerate(self.grouped_response_processors):
-                logger.info(f"第{i+1}组处理器: {[proc.__name__ for proc in group]}")
+        # 编译执行计划：配置校验、模板与输出解析器的查找只在启动时做一次
+        if plan is None:
+            prompt_columns = dataset_config.output_prompt_column
+            if isinstance(prompt_columns, str):
+                prompt_columns = [prompt_columns]
+            processors = response_processor if isinstance(response_processor, list) else [response_processor]
+            plan = compile_plan(
+                self.prompt_keys,
+                processors,
+                grouped_output_columns if grouped_mode else dataset_config.output_column,
+                dataset_config.input_columns,
+                prompt_columns,
+                grouped=grouped_mode,
+            )
+        self.plan = plan
+        logger.info(f"初始化ChatLLM{'（分组模式）' if grouped_mode else ''}，URL: {llm_url}")
+        logger.info(f"Prompt Keys: {self.prompt_keys}")
+        
+        # 初始化LLM客户端，连接池大小默认与并发线程数一致，避免线程在连接池上排队
+        self.http_stats = HttpTimingStats()
+        self.http_config = http_config
+        max_retries = (http_config or {}).get("max_retries", 10)
+        if client is not None:
+            # 共享客户端的连接池和耗时统计由创建者管理
+            self.client = client.with_options(max_retries=max_retries)
         else:
-            # 原有模式
-            self.response_processors = response_processor if isinstance(response_processor, list) else [response_processor]
-            logger.info(f"初始化ChatLLM，URL: {llm_url}")
-            logger.info(f"Prompt Keys: {self.prompt_keys}")
-            logger.info(f"Response Processors: {[proc.__name__ for proc in self.response_processors]}")
+            http_client = build_http_client(http_config, dataset_config.max_thread_num, self.http_stats)
+            self.client = OpenAI(base_url=llm_url, api_key=api_key, max_retries=max_retries, http_client=http_client)
+        self.request_gate = request_gate or contextlib.nullcontext()
         
-        # 验证prompt_key
-        for pk in self.prompt_keys:
-            if pk not in all_prompt_dict:
-                raise ValueError(f"prompt_key '{pk}' 不存在于all_prompt_dict中")
+        # 超时与截止时间
+        self.request_timeout = request_timeout
+        self.row_deadline = row_deadline
+        self.run_deadline = run_deadline
+        # 设置截止时间时不使用客户端内部重试，由每行的重试循环在截止时间内重试
+        self._request_client = self.client.with_options(max_retries=0) if (row_deadline or run_deadline) else self.client
         
-        # 初始化LLM客户端
-        self.client = OpenAI(base_url=llm_url, api_key=api_key, max_retries=10)
+        if backend not in ("chat", "completions", "batch"):
+            raise ValueError(f"LLM_BACKEND必须为chat、completions或batch: {backend}")
+        self.batcher: Optional[Union[CompletionBatcher, BatchApiBatcher]] = None
+        if backend == "completions":
+            # 在途的批量请求数足以让所有工作线程的prompt同时在途
+            max_batches = -(-dataset_config.max_thread_num // completions_batch_size) + 1
+            self.batcher = CompletionBatcher(self._request_client, completions_batch_size, completions_batch_wait, max_batches)
+            logger.info(f"使用completions后端，每次请求最多{completions_batch_size}个prompt")
+        elif backend == "batch":
+            batch_api_config = dict(batch_api_config or {})
+            max_requests = batch_api_config.get("max_requests", 1000)
+            # 等待批量任务的行不占用工作线程，在途行数只受batch_size限制
+            batch_api_config.setdefault("max_batches", -(-dataset_config.batch_size // max_requests) + 1)
+            # 上传和查询批量任务使用客户端内部重试
+            self.batcher = BatchApiBatcher(self.client, SYSTEM_PROMPT, **batch_api_config)
+            if request_timeout:
+                # 批量任务的周转时间远超单次请求的超时时间，只按单行和整体运行的截止时间等待
+                logger.warning("batch后端忽略REQUEST_TIMEOUT，只使用ROW_DEADLINE和RUN_DEADLINE")
+                self.request_timeout = None
+            logger.info(f"使用batch后端，每个批量任务最多{max_requests}个请求")
+            if dataset_config.batch_size < max_requests:
+                logger.warning(f"BATCH_SIZE（{dataset_config.batch_size}）小于BATCH_API_MAX_REQUESTS，"
+                               f"批量任务凑不满，在途行数受BATCH_SIZE限制")
+
+        self.cascade: Optional[ModelCascade] = None
+        if model_cascade:
+            if self.batcher:
+                raise ValueError("MODEL_CASCADE只支持chat后端")
+
+            def client_for(url: str) -> OpenAI:
+                http_client = build_http_client(http_config, dataset_config.max_thread_num, self.http_stats)
+                tier_client = OpenAI(base_url=url, api_key=api_key, max_retries=max_retries, http_client=http_client)
+                return tier_client.with_options(max_retries=0) if (row_deadline or run_deadline) else tier_client
 
-    def _call_llm(self, prompt: str) -> Optional[str]:
+            self.cascade = ModelCascade(model_cascade, client_for, confidence_check)
+            for prompt_key in self.prompt_keys:
+                if self.cascade.tiers(prompt_key):
+                    logger.info(f"模型级联 {prompt_key}: {' -> '.join(t.model for t in self.cascade.tiers(prompt_key))}")
+
+    def _call_llm(self, prompt: str, tier: Optional[CascadeTier] = None) -> Optional[str]:
         """调用LLM生成回答
         
         Args:
             prompt: 输入的prompt文本
+            tier: 模型级联中的一级，使用该级的模型和服务地址，并记录耗时和token数
             
         Returns:
             LLM生成的响应文本，失败时返回None
         """
         try:
+            prepared = self._prepare_call(prompt)
+            if prepared is None:
+                return None
+            generate_config, status, timeout = prepared
+            if self.batcher:
+                # completions后端：原始prompt与其他行的prompt合并为一次请求，不套用对话模板；
+                # batch后端：与其他行的请求一起写入批量输入文件，等待批量任务期间不占用request_gate的名额
+                gate = contextlib.nullcontext() if isinstance(self.batcher, BatchApiBatcher) else self.request_gate
+                with gate:
+                    content = self.batcher.complete(prompt, generate_config, timeout)
+                if status:
+                    status.last_response = content
+                return content
             messages = [
-                {"role": "system", "content": "你叫理想同学，你是一个有用的助手。"},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ]
-            completion = self.client.chat.completions.create(messages=messages, **self.generate_config)
-            return completion.choices[0].message.content.strip()
+            if timeout is not None:
+                generate_config = {**generate_config, "timeout": timeout}
+            client = self._request_client
+            if tier is not None:
+                generate_config = {**generate_config, "model": tier.model}
+                client = tier.client or client
+            start = time.perf_counter()
+            with self.request_gate:
+                completion = client.chat.completions.create(messages=messages, **generate_config)
+            if tier is not None:
+                tier.record_call(time.perf_counter() - start, completion.usage)
+            if self.preflight and completion.usage:
+                self.preflight.observe(prompt, completion.usage.prompt_tokens)
+            message = completion.choices[0].message
+            content = message.content.strip()
+            if status:
+                status.last_response = content
+                status.last_reasoning = getattr(message, "reasoning_content", None)
+                status.last_usage = completion.usage.model_dump() if completion.usage else None
+            return content
         except Exception as e:
             logger.error(f"LLM调用失败: {e}")
             return None
 
-    def _generate_responses(self, prompt: str, processor: Callable[[str], Any], max_retries: int = 5) -> List[Any]:
-        """为单个prompt生成响应
+    def _prepare_call(self, prompt: str) -> Optional[Tuple[Dict, Optional[RowStatus], Optional[float]]]:
+        """调用LLM前的准备：按剩余上下文设置max_tokens，记录调用次数，计算本次请求的超时时间
+
+        Returns:
+            (请求参数, 当前行的状态, 超时时间)，已超过截止时间时返回None
+        """
+        generate_config = self.generate_config
+        if self.preflight:
+            # 按剩余上下文动态设置max_tokens
+            max_tokens = self.preflight.fit_max_tokens(prompt)
+            if max_tokens is not None:
+                generate_config = {**generate_config, "max_tokens": max_tokens}
+        status = self._row_status()
+        if status:
+            status.attempts += 1
+            if status.last_prompt != prompt:
+                status.last_prompt = prompt
+                status.last_response = status.last_reasoning = status.last_usage = None
+        timeout = self._attempt_timeout(status)
+        if timeout is not None and timeout <= 0:
+            self._mark_failed(REASON_DEADLINE)
+            return None
+        return generate_config, status, timeout
+
+    def _submit_llm(self, prompt: str) -> Optional[Future]:
+        """batch后端：把prompt提交给批量接口，不等待结果
+
+        Returns:
+            得到响应文本的future，已超过截止时间时返回None
+        """
+        prepared = self._prepare_call(prompt)
+        if prepared is None:
+            return None
+        generate_config, _, timeout = prepared
+        return self.batcher.submit(prompt, generate_config, timeout)
+
+    def _batch_response(self, done: Future) -> Optional[str]:
+        """取出批量接口返回的响应文本并记录到当前行的状态，失败时返回None"""
+        try:
+            content = done.result()
+        except Exception as e:
+            logger.error(f"LLM调用失败: {e}")
+            return None
+        status = self._row_status()
+        if status:
+            status.last_response = content
+        return content
+
+    def _attempt_timeout(self, status: Optional[RowStatus]) -> Optional[float]:
+        """本次请求的超时时间：单次请求超时与该行截止时间（包括整体运行的截止时间）前剩余时间中的较小值
+        
+        Returns:
+            超时时间（秒），小于等于0表示已超过截止时间，None表示不限制
+        """
+        limits = []
+        if self.request_timeout:
+            limits.append(self.request_timeout)
+        if status and status.deadline is not None:
+            limits.append(status.deadline - time.monotonic())
+        return min(limits) if limits else None
+
+    def _try_tier(self, node: PromptNode, prompt: str, data_row: Dict[str, Any], tier: CascadeTier,
+                  max_retries: int = 5):
+        """用级联中的一级（非最后一级）处理一个节点，调用LLM的方式同_entry_steps
+
+        任一输出解析器拒绝响应、响应为<|wrong data|>或未通过置信度检查时返回False，
+        由下一级重新处理；接受时写入所有输出列。
+
+        Returns:
+            该级的输出是否被接受
+        """
+        raw_response = None
+        # 不是最后一级时不用完该行的截止时间，留给下一级
+        for delay in self._retry_delays(max_retries, until_deadline=False):
+            raw_response = yield prompt, tier, delay
+            if raw_response is not None:
+                break
+
+        outputs = {}
+        if raw_response and raw_response != '<|wrong data|>':
+            for processor, output_column in node.outputs:
+                try:
+                    processed_response = processor(raw_response)
+                except Exception as e:
+                    logger.debug(f"级联第{tier.level + 1}级响应处理失败 (输出列{output_column}): {e}")
+                    break
+                if processed_response is None:
+                    break
+                outputs[output_column] = processed_response
+
+        accepted = len(outputs) == len(node.outputs)
+        if accepted and self.cascade.confidence_check is not None:
+            try:
+                accepted = bool(self.cascade.confidence_check(raw_response, outputs))
+            except Exception as e:
+                logger.debug(f"置信度检查失败: {e}")
+                accepted = False
+        tier.record_row(accepted)
+        if not accepted:
+            return False
+
+        data_row.update(outputs)
+        self._store_raw(data_row, node.prompt_key, prompt)
+        self._observe_output(node.prompt_key, prompt)
+        return True
+
+    def _generate_responses(self, prompt: str, processor: Callable[[str], Any], max_retries: int = 5,
+                            tier: Optional[CascadeTier] = None):
+        """为单个prompt生成响应，调用LLM的方式同_entry_steps
         
         Args:
             prompt: 输入的prompt文本
             processor: 对应的响应处理函数
-            max_retries: 每个响应的最大重试次数
+            max_retries: 每个响应的最大重试次数（设置截止时间时在截止时间内一直重试）
+            tier: 模型级联中的一级，None表示使用默认模型
             
         Returns:
             处理后的响应列表
         """
         responses = []
-        for retry in range(max_retries):
-            raw_response = self._call_llm(prompt)
+        for delay in self._retry_delays(max_retries):
+            raw_response = yield prompt, tier, delay
             if not raw_response or raw_response == '<|wrong data|>':
                 continue
                 
@@ -128,8 +420,98 @@ class ChatLLM:
                 continue
         return responses
 
+    def _retry_delays(self, max_retries: int, until_deadline: bool = True) -> Iterator[float]:
+        """重试循环中每次调用LLM前的等待时间
+
+        该行没有截止时间时最多调用max_retries次，不等待（请求失败的退避由客户端内部重试完成）；
+        有截止时间时客户端不重试，按指数退避重试直到截止时间（until_deadline为False时最多max_retries次），
+        退避不超过剩余时间的一半，剩余时间不足RETRY_BACKOFF_BASE秒时以deadline原因结束。
+        """
+        status = self._row_status()
+        if status is None or status.deadline is None:
+            yield from itertools.repeat(0.0, max_retries)
+            return
+        backoff = RETRY_BACKOFF_BASE
+        for attempt in itertools.count():
+            if not until_deadline and attempt >= max_retries:
+                return
+            remaining = status.deadline - time.monotonic()
+            if remaining <= 0 or (attempt and remaining <= RETRY_BACKOFF_BASE):
+                self._mark_failed(REASON_DEADLINE)
+                return
+            if attempt == 0:
+                yield 0.0
+                continue
+            yield min(backoff, remaining / 2)
+            backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+    def _row_status(self) -> Optional[RowStatus]:
+        """当前线程正在处理的行的状态"""
+        return getattr(self._local, 'status', None)
+
+    def _mark_failed(self, reason: str):
+        """记录当前行的失败原因（只保留第一个原因）"""
+        status = self._row_status()
+        if status and status.reason is None:
+            status.reason = reason
+
+    def _store_raw(self, data_row: Dict, prompt_key: str, prompt: str):
+        """保存该prompt最后一次的原始响应、reasoning和usage（未开启原始响应存储时不做任何事）"""
+        status = self._row_status()
+        if self.raw_store is None or status is None or status.last_prompt != prompt or status.last_response is None:
+            return
+        key = row_key(data_row, self.dataset_config.input_columns)
+        self.raw_store.put(key, prompt_key, status.last_response, status.last_reasoning, status.last_usage)
+
+    def _observe_output(self, prompt_key: str, prompt: str):
+        """记录该prompt最后一次响应的输出token数，用于调度时估计成本"""
+        status = self._row_status()
+        if self.scheduler is None or status is None or status.last_prompt != prompt or not status.last_usage:
+            return
+        self.scheduler.observe(prompt_key, status.last_usage.get("completion_tokens"))
+
+    def _render_prompts(self, data_row: Dict) -> Iterator[Tuple[str, str]]:
+        """渲染该行数据的所有prompt，字段不完整的prompt（包括依赖上游输出的下游阶段）会被跳过
+        
+        Yields:
+            (prompt_key, 渲染后的prompt)
+        """
+        for node in self.plan.nodes:
+            try:
+                yield node.prompt_key, node.template.format(*node.get_inputs(data_row))
+            except KeyError:
+                continue
+
+    def _check_oversized(self, data_row: Dict, prompts: Optional[Iterable[Tuple[str, str]]] = None) -> bool:
+        """预检该行的prompt是否超出模型上下文，超长的行被跳过或写入超长文件
+        
+        Args:
+            data_row: 单行数据字典
+            prompts: 要预检的 (prompt_key, prompt)，None表示该行所有可以渲染的prompt
+        
+        Returns:
+            该行是否超长
+        """
+        if prompts is None:
+            prompts = self._render_prompts(data_row)
+        oversized = [key for key, prompt in prompts if self.preflight.fit_max_tokens(prompt) is None]
+        if not oversized:
+            return False
+
+        oversize_path = self.dataset_config.oversize_path
+        logger.warning(f"prompt超出模型上下文，跳过该行: {oversized}")
+        self._mark_failed(REASON_OVERSIZED)
+        if oversize_path:
+            line = json.dumps({"oversized_prompt_keys": oversized, "row": data_row}, ensure_ascii=False)
+            with self._oversize_lock, open(oversize_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return True
+
     def process_entry(self, data_row: Dict) -> Dict:
-        """处理单个数据条目 - 支持分组模式
+        """处理单个数据条目：按执行计划依次处理每个prompt节点
+        
+        节点已按依赖关系排序，下游prompt在同一工作线程中读取上游刚写入的输出列，
+        不同的行在各自的线程中处于不同阶段，阶段之间没有全量屏障。
         
         Args:
             data_row: 单行数据字典
@@ -137,42 +519,83 @@ class ChatLLM:
         Returns:
             处理后的数据字典，包含生成的响应和prompt
         """
+        steps = self._entry_steps(data_row)
         try:
-            if self.grouped_mode:
-                # 分组模式处理
-                for idx, prompt_key in enumerate(self.prompt_keys):
-                    prompt_template, num_expected_vals = all_prompt_dict[prompt_key]
-                    
-                    # 提取输入字段
-                    entry = {k: data_row[k] for k in self.dataset_config.input_columns if k in data_row}
-                    
-                    # 验证字段
-                    if len(entry) != num_expected_vals or len(entry) != len(self.dataset_config.input_columns):
-                        logger.error(f"字段验证失败，需要{num_expected_vals}个字段，实际{len(entry)}个")
-                        continue
-                    
-                    # 格式化prompt
-                    ordered_values = [entry[col] for col in self.dataset_config.input_columns]
-                    prompt = prompt_template.format(*ordered_values)
-                    
-                    # 生成一次原始响应
+            prompt, tier, delay = next(steps)
+            while True:
+                if delay:
+                    time.sleep(delay)
+                prompt, tier, delay = steps.send(self._call_llm(prompt, tier))
+        except StopIteration as stop:
+            return stop.value
+
+    def _entry_steps(self, data_row: Dict):
+        """process_entry的处理步骤，需要调用LLM时产出 (prompt, 级联中的一级, 重试前的等待时间)，
+        由调用方等待、发送请求后把响应文本（失败时为None）传回，结束时返回处理后的数据字典
+
+        同步处理时调用方在工作线程中直接调用LLM；batch后端把请求提交给批量接口，
+        结果返回后再继续，等待期间不占用线程。
+        """
+        try:
+            # 预检：prompt + 输出超出模型上下文的行不发送请求
+            if self.preflight and self.preflight.context_length and self._check_oversized(data_row):
+                return data_row
+
+            for node in self.plan.nodes:
+                try:
+                    prompt = node.template.format(*node.get_inputs(data_row))
+                except KeyError as e:
+                    if e.args and e.args[0] in node.upstream_columns:
+                        # 上游阶段失败，失败原因由上游的调用状态决定
+                        logger.warning(f"上游阶段{list(node.depends_on)}未产出字段{e}，跳过{node.prompt_key}")
+                    else:
+                        logger.error(f"字段验证失败，需要字段{list(node.input_columns)}，缺少{e}")
+                        self._mark_failed(REASON_INVALID_FIELDS)
+                    continue
+
+                # 下游阶段的prompt包含上游的输出，渲染后才能预检
+                if (node.depends_on and self.preflight and self.preflight.context_length
+                        and self._check_oversized(data_row, [(node.prompt_key, prompt)])):
+                    return data_row
+
+                # 模型级联：前面各级的输出被接受时不再升级
+                tiers = self.cascade.tiers(node.prompt_key) if self.cascade else []
+                accepted = False
+                for tier in tiers[:-1]:
+                    accepted = yield from self._try_tier(node, prompt, data_row, tier)
+                    if accepted:
+                        break
+                if accepted:
+                    if node.prompt_column:
+                        data_row[node.prompt_column] = prompt
+                    continue
+                tier = tiers[-1] if tiers else None
+
+                if node.retry_on_reject:
+                    # 重试直到输出解析器接受响应
+                    processor, output_column = node.outputs[0]
+                    responses = yield from self._generate_responses(prompt, processor, tier=tier)
+                    self._store_raw(data_row, node.prompt_key, prompt)
+                    self._observe_output(node.prompt_key, prompt)
+                    if responses:
+                        data_row[output_column] = responses[0]
+                else:
+                    # 生成一次原始响应，交给该节点的所有输出解析器处理
                     raw_response = None
-                    max_retries = 5
-                    for retry in range(max_retries):
-                        raw_response = self._call_llm(prompt)
+                    for delay in self._retry_delays(5):
+                        raw_response = yield prompt, tier, delay
                         if raw_response and raw_response != '<|wrong data|>':
                             break
                     
+                    self._store_raw(data_row, node.prompt_key, prompt)
+                    self._observe_output(node.prompt_key, prompt)
                     if not raw_response:
                         logger.warning("无法生成有效响应")
+                        if tier is not None:
+                            tier.record_row(False)
                         continue
                     
-                    # 获取该prompt对应的处理器组和输出列组
-                    processor_group = self.grouped_response_processors[idx]
-                    output_column_group = self.grouped_output_columns[idx]
-                    
-                    # 对每个处理器和输出列进行处理
-                    for processor, output_column in zip(processor_group, output_column_group):
+                    for processor, output_column in node.outputs:
                         try:
                             processed_response = processor(raw_response)
                             if processed_response is not None:
@@ -180,171 +603,530 @@ class ChatLLM:
                         except Exception as e:
                             logger.debug(f"响应处理失败 (输出列{output_column}): {e}")
                             continue
-                    
-                    # 保存prompt（如果需要）
-                    if (self.dataset_config.output_prompt_column and 
-                        idx < len(self.dataset_config.output_prompt_column)):
-                        data_row[self.dataset_config.output_prompt_column[idx]] = prompt
-            
-            elif len(self.prompt_keys) == 1:
-                # 单个prompt，可能有多个输出列
-                prompt_key = self.prompt_keys[0]
-                prompt_template, num_expected_vals = all_prompt_dict[prompt_key]
-                
-                # 提取输入字段
-                entry = {k: data_row[k] for k in self.dataset_config.input_columns if k in data_row}
-                
-                # 验证字段
-                if len(entry) != num_expected_vals or len(entry) != len(self.dataset_config.input_columns):
-                    logger.error(f"字段验证失败，需要{num_expected_vals}个字段，实际{len(entry)}个")
-                    return data_row
-                
-                # 格式化prompt
-                ordered_values = [entry[col] for col in self.dataset_config.input_columns]
-                prompt = prompt_template.format(*ordered_values)
-                
-                # 生成一次原始响应
-                raw_response = None
-                max_retries = 5
-                for retry in range(max_retries):
-                    raw_response = self._call_llm(prompt)
-                    if raw_response and raw_response != '<|wrong data|>':
-                        break
-                
-                if not raw_response:
-                    logger.warning("无法生成有效响应")
-                    return data_row
-                
-                # 对每个输出列使用对应的处理器处理同一个原始响应
-                for idx, output_column in enumerate(self.dataset_config.output_column):
-                    processor = self.response_processors[idx]
-                    
-                    try:
-                        processed_response = processor(raw_response)
-                        if processed_response is not None:
-                            data_row[output_column] = processed_response
-                    except Exception as e:
-                        logger.debug(f"响应处理失败 (输出列{output_column}): {e}")
-                        continue
-                
+
+                if tier is not None:
+                    tier.record_row(all(column in data_row for _, column in node.outputs))
+
                 # 保存prompt（如果需要）
-                if self.dataset_config.output_prompt_column:
-                    # 单个prompt_key时，OUTPUT_PROMPT_COLUMN只有1个，所有输出列共享同一个prompt
-                    prompt_col = self.dataset_config.output_prompt_column[0]
-                    data_row[prompt_col] = prompt
-                            
-            else:
-                # 多个prompt，传统逻辑：每个prompt对应一个输出列
-                for idx, prompt_key in enumerate(self.prompt_keys):
-                    prompt_template, num_expected_vals = all_prompt_dict[prompt_key]
-                    
-                    # 提取输入字段
-                    entry = {k: data_row[k] for k in self.dataset_config.input_columns if k in data_row}
-                    
-                    # 验证字段
-                    if len(entry) != num_expected_vals or len(entry) != len(self.dataset_config.input_columns):
-                        logger.error(f"字段验证失败，需要{num_expected_vals}个字段，实际{len(entry)}个")
-                        continue
-                    
-                    # 格式化prompt
-                    ordered_values = [entry[col] for col in self.dataset_config.input_columns]
-                    prompt = prompt_template.format(*ordered_values)
-                    
-                    # 获取对应的输出解析器
-                    processor = self.response_processors[idx]
-                    
-                    # 生成响应
-                    responses = self._generate_responses(prompt, processor)
-                    
-                    # 保存结果
-                    output_column = self.dataset_config.output_column[idx]
-                    if responses:
-                        data_row[output_column] = responses[0] if len(responses) == 1 else responses
-                    
-                    # 保存prompt（如果需要）
-                    if (self.dataset_config.output_prompt_column and 
-                        idx < len(self.dataset_config.output_prompt_column)):
-                        data_row[self.dataset_config.output_prompt_column[idx]] = prompt
+                if node.prompt_column:
+                    data_row[node.prompt_column] = prompt
             
             return data_row
             
         except Exception as e:
             logger.error(f"处理条目失败: {e}", exc_info=True)
+            self._mark_failed(REASON_EXCEPTION)
             return data_row
 
-    def produce_data(self, data_rows: List[Dict], output_path: str, pbar: tqdm):
-        """批量处理数据并直接写入文件
+    def _new_status(self, run_deadline_at: Optional[float]) -> RowStatus:
+        """开始处理一行时创建处理状态，截止时间取该行的截止时间与整体运行截止时间中较早的一个"""
+        status = RowStatus()
+        deadlines = [deadline for deadline in
+                     (time.monotonic() + self.row_deadline if self.row_deadline else None, run_deadline_at)
+                     if deadline is not None]
+        if deadlines:
+            status.deadline = min(deadlines)
+        return status
+
+    def _process_row(self, data_row: Dict, run_deadline_at: Optional[float] = None) -> Tuple[Dict, RowStatus]:
+        """处理单行数据并返回处理状态"""
+        status = self._new_status(run_deadline_at)
+        self._local.status = status
+        try:
+            return self.process_entry(data_row), status
+        finally:
+            self._local.status = None
+
+    def _process_row_async(self, data_row: Dict, run_deadline_at: Optional[float] = None) -> Future:
+        """batch后端：不占用工作线程处理单行数据
+
+        每次调用LLM时把请求提交给批量接口，批量任务返回后在轮询线程中继续处理该行，
+        因此在途行数只受batch_size和内存预算限制，与线程数无关。
+
+        Returns:
+            得到 (处理后的数据字典, 处理状态) 的future
+        """
+        future = Future()
+        status = self._new_status(run_deadline_at)
+        steps = self._entry_steps(data_row)
+
+        def advance(response: Optional[str] = None, done: Optional[Future] = None):
+            self._local.status = status
+            try:
+                if done is not None:
+                    response = self._batch_response(done)
+                while True:
+                    try:
+                        # 批量任务的周转时间远大于重试的退避时间，重试时不再等待
+                        prompt, _, _ = steps.send(response)
+                    except StopIteration as stop:
+                        future.set_result((stop.value, status))
+                        return
+                    call = self._submit_llm(prompt)
+                    if call is not None:
+                        break
+                    # 已超过截止时间，不提交请求
+                    response = None
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            finally:
+                self._local.status = None
+            call.add_done_callback(lambda result: advance(done=result))
+
+        advance()
+        return future
+
+    def _start_row(self, executor: ThreadPoolExecutor, data_row: Dict, run_deadline_at: Optional[float]) -> Future:
+        """开始处理一行：batch后端不占用工作线程，其他后端在线程池中处理"""
+        if isinstance(self.batcher, BatchApiBatcher):
+            return self._process_row_async(data_row, run_deadline_at)
+        return executor.submit(self._process_row, data_row, run_deadline_at)
+
+    def _iter_completed(self, rows: Iterable[Tuple], budget: InflightBudget,
+                        held: Optional[Callable[[], int]] = None, on_deadline: Optional[Callable[[], None]] = None):
+        """以有界窗口并发处理数据行，按完成顺序产出结果
+
+        同时在途的行数（包括已完成、等待按序产出的行）不超过batch_size，且在途数据不超过内存预算；
+        达到上限时停止读取新行，等待已提交的行完成后再继续读取。
+        开启调度时按预估成本调整提交顺序，结果仍按输入顺序产出。
+        到达运行截止时间后不再读取输入，已读取但未提交的行以deadline原因产出，调用方据此记录断点。
+
+        Args:
+            rows: (数据字典, 原始字节数, ...) 的迭代器，按需惰性读取，其余元素原样返回
+            budget: 在途数据的内存预算
+            held: 返回调用方暂存、尚未产出的行数的函数（如按序返回时等待较早行的结果），这些行也计入窗口
+            on_deadline: 因到达运行截止时间而停止读取输入时调用
+
+        Yields:
+            (已完成的future, 对应的输入元组)
+        """
+        window = self.dataset_config.batch_size
+        pending = {}
+        stop_reading = threading.Event()
+
+        def source(rows):
+            rows = iter(rows)
+            while not stop_reading.is_set():
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                yield row
+
+        rows = source(rows)
+        if self.scheduler:
+            rows = self.scheduler.order(rows, lambda item: self.scheduler.cost(self._render_prompts(item[0])))
+            reorder = ReorderBuffer()
+        else:
+            rows = enumerate(rows)
+            reorder = None
+        exhausted = False
+        run_deadline_at = time.monotonic() + self.run_deadline if self.run_deadline else None
+
+        def held_rows():
+            return (len(reorder) if reorder is not None else 0) + (held() if held else 0)
+
+        def release(seq, future, item, cost):
+            if reorder is None:
+                budget.release(cost)
+                yield future, item
+                return
+            # 等待之前的行完成，按输入顺序产出（等待期间仍占用内存预算）
+            for ready_future, ready_item, ready_cost in reorder.push(seq, (future, item, cost)):
+                budget.release(ready_cost)
+                yield ready_future, ready_item
+
+        with ThreadPoolExecutor(max_workers=self.dataset_config.max_thread_num) as executor:
+            while True:
+                if not exhausted and run_deadline_at is not None and time.monotonic() >= run_deadline_at:
+                    # 到达运行截止时间：不再读取输入，在途的行在截止时间后的第一次请求前退出；
+                    # 调度器中已读取但未提交的行写入死信文件，未读取的行由调用方记录断点
+                    logger.warning("已到达运行截止时间，停止读取输入")
+                    stop_reading.set()
+                    for seq, item in rows:
+                        yield from release(seq, self._skipped_row(item[0], REASON_DEADLINE), item, 0)
+                    exhausted = True
+                    if on_deadline:
+                        on_deadline()
+
+                # 在窗口和内存预算允许的范围内提交新行（至少保证有一行在途）；
+                # 等待按序产出的结果也计入窗口，避免队首的慢行使已完成的结果无限堆积
+                while (not exhausted and (not pending or len(pending) + held_rows() < window)
+                       and not (pending and budget.exceeded())):
+                    try:
+                        seq, item = next(rows)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = self._submit_row(executor, item[0], run_deadline_at)
+                    pending[future] = (seq, item, budget.charge(item[1]))
+
+                if not pending:
+                    break
+
+                timeout = None
+                if run_deadline_at is not None and not exhausted:
+                    timeout = max(0.0, run_deadline_at - time.monotonic())
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    seq, item, cost = pending.pop(future)
+                    yield from release(seq, future, item, cost)
+
+    def _submit_row(self, executor: ThreadPoolExecutor, data_row: Dict, run_deadline_at: Optional[float]) -> Future:
+        """提交一行处理；开启近似重复检测时，与已提交的代表行相似的行不调用LLM，复制代表行的结果"""
+        if self.near_dup is None:
+            return self._start_row(executor, data_row, run_deadline_at)
+        text = "\x1f".join(str(data_row.get(col, "")) for col in self.plan.source_columns)
+        signature = self.near_dup.signature(text)
+        if signature is None:
+            return self._start_row(executor, data_row, run_deadline_at)
+
+        entry, similarity, band_keys = self.near_dup.find(signature)
+        if entry is not None:
+            return self._copy_from_representative(executor, entry, similarity, data_row, run_deadline_at)
+
+        future = self._start_row(executor, data_row, run_deadline_at)
+        entry = self.near_dup.add(signature, row_key(data_row, self.plan.source_columns), band_keys)
+
+        def resolve(done: Future):
+            outputs = None
+            if done.exception() is None:
+                row, status = done.result()
+                produced = {col: row[col] for col in self.plan.output_columns if row.get(col)}
+                if status.reason is None and produced and '<|wrong data|>' not in str(produced):
+                    outputs = produced
+            if outputs is None:
+                self.near_dup.discard(entry)
+            entry.resolve(outputs)
+
+        future.add_done_callback(resolve)
+        return future
+
+    def _copy_from_representative(self, executor: ThreadPoolExecutor, entry, similarity: float,
+                                  data_row: Dict, run_deadline_at: Optional[float]) -> Future:
+        """代表行完成后复制其输出列；代表行失败时单独处理该行"""
+        future = Future()
+
+        def fill(outputs: Optional[Dict]):
+            if outputs is None:
+                try:
+                    own = self._start_row(executor, data_row, run_deadline_at)
+                except RuntimeError as e:
+                    future.set_exception(e)
+                    return
+                own.add_done_callback(lambda done: future.set_exception(done.exception()) if done.exception()
+                                      else future.set_result(done.result()))
+                return
+            data_row.update(outputs)
+            for node in self.plan.nodes:
+                if node.prompt_column:
+                    try:
+                        data_row[node.prompt_column] = node.template.format(*node.get_inputs(data_row))
+                    except KeyError:
+                        pass
+            data_row[self.near_dup_column] = {"key": entry.key, "similarity": round(similarity, 3)}
+            if self.raw_store is not None:
+                # 以该行的键保存代表行的原始响应，REPROCESS_ONLY时该行按代表行的响应重新处理
+                key = row_key(data_row, self.dataset_config.input_columns)
+                for prompt_key, raw in self.raw_store.get(entry.key).items():
+                    self.raw_store.put(key, prompt_key, raw["response"], raw["reasoning"], raw["usage"])
+            future.set_result((data_row, RowStatus()))
+
+        entry.when_done(fill)
+        return future
+
+    @staticmethod
+    def _skipped_row(data_row: Dict, reason: str) -> Future:
+        """未提交处理的行：返回已完成的future，结果按该失败原因写入死信文件"""
+        status = RowStatus()
+        status.reason = reason
+        future = Future()
+        future.set_result((data_row, status))
+        return future
+
+    def _failure_reason(self, data_row: Optional[Dict], status: Optional[RowStatus]) -> Optional[str]:
+        """检查单行处理结果，返回失败原因，成功时返回None"""
+        if not data_row:
+            logger.warning('[ERR] 处理结果为空')
+            return REASON_EMPTY_RESULT
+
+        # 下游阶段超长的行已跳过或写入超长文件，即使上游已有输出也不写入输出文件
+        if status and status.reason == REASON_OVERSIZED:
+            return REASON_OVERSIZED
+
+        # 检查是否有生成的结果
+        has_results = False
+        for output_col in self.dataset_config.output_column:
+            if data_row.get(output_col):
+                has_results = True
+                break
+
+        if not has_results:
+            if status and status.reason:
+                return status.reason
+            logger.warning('[ERR] 未生成有效结果')
+            if status and status.last_response is not None:
+                return REASON_PROCESSOR_REJECTED
+            return REASON_LLM_FAILED
+
+        # 检查是否包含错误标记
+        if '<|wrong data|>' in str(data_row):
+            logger.warning('[ERR] 结果包含错误标记')
+            return REASON_WRONG_DATA
+
+        return None
+
+    def _write_result(self, f, data_row: Optional[Dict], status: Optional[RowStatus] = None,
+                      output_path: Optional[str] = None, prior_attempts: int = 0, index: Optional[int] = None) -> int:
+        """校验单行处理结果并写入文件，失败的行写入死信文件
         
         Args:
-            data_rows: 一批数据字典列表
+            f: 输出文件句柄，或Parquet/Arrow文件的ColumnarWriter
+            data_row: 处理后的数据行
+            status: 该行的处理状态
+            output_path: 该行所属的输出文件路径，记录在死信中
+            prior_attempts: 之前运行中已累计的LLM调用次数
+            index: 该行在输入文件中的行号，写入ColumnarWriter时使用
+        
+        Returns:
+            写入的字节数，未写入时返回0
+        """
+        reason = self._failure_reason(data_row, status)
+        if reason:
+            # 已写入超长文件的行不再写入死信
+            routed = reason == REASON_OVERSIZED and self.dataset_config.oversize_path
+            if self.dead_letter_writer and data_row and not routed:
+                self.dead_letter_writer.write(data_row, reason, status, output_path, prior_attempts)
+            if isinstance(f, ColumnarWriter):
+                f.skip(index)
+            return 0
+
+        if isinstance(f, ColumnarWriter):
+            return f.write_row(index, data_row)
+        line = json.dumps(data_row, ensure_ascii=False) + "\n"
+        f.write(line)
+        return len(line.encode('utf-8'))
+
+    def produce_data(self, data_rows: Iterable[Union[Dict, Tuple[Dict, int]]], output_path: str, pbar: tqdm,
+                     budget: Optional[InflightBudget] = None, final_output_path: Optional[str] = None,
+                     on_deadline: Optional[Callable[[], None]] = None):
+        """并发处理数据并直接写入文件
+        
+        Args:
+            data_rows: 数据字典的迭代器，也可以是 (数据字典, 原始字节数) 的迭代器
             output_path: 输出文件路径
             pbar: 进度条对象
+            budget: 在途数据的内存预算，None表示只按batch_size限制在途行数
+            final_output_path: 写入临时文件时，死信中记录的最终输出路径，默认为output_path
+            on_deadline: 因到达运行截止时间而停止读取输入时调用
         """
-        with ThreadPoolExecutor(max_workers=self.dataset_config.max_thread_num) as executor:
-            futures = [executor.submit(self.process_entry, data_row) for data_row in data_rows]
-            
-            with open(output_path, "a", encoding="utf-8") as f:
-                for future in as_completed(futures):
+        budget = budget or InflightBudget()
+        rows = (row if isinstance(row, tuple) else (row, 0) for row in data_rows)
+
+        with open(output_path, "a", encoding="utf-8") as f:
+            for future, (_, num_bytes) in self._iter_completed(rows, budget, on_deadline=on_deadline):
+                try:
+                    pbar.update(1)
+                    data_row, status = future.result()
+                    out_bytes = self._write_result(f, data_row, status, final_output_path or output_path)
+                    if out_bytes:
+                        budget.observe(num_bytes, out_bytes)
+                except Exception as ex:
+                    logger.error(f'[ERR] 处理批次失败: {ex}')
+                    continue
+
+    def map(self, rows: Iterable[Dict], ordered: bool = False, include_failed: bool = False) -> Iterator[Dict]:
+        """在进程内处理数据行，处理完成一行即返回一行，不读写数据文件
+        
+        与process_dataset使用相同的并发窗口、内存预算、调度、近似重复检测、原始响应存储和重试逻辑。
+        输入的字典不会被修改，返回的是添加了输出列的副本。可以在多个线程中并发调用，
+        每次调用有各自的并发窗口和运行截止时间，共享原始响应存储和客户端连接池。
+        
+        Args:
+            rows: 数据字典的可迭代对象，按需惰性读取
+            ordered: 是否按输入顺序返回（等待较早的行完成期间，已完成的行暂存在内存中，暂存的行计入batch_size）
+            include_failed: 是否返回处理失败的行（失败原因记录在FAILURE_REASON_COLUMN列），
+                否则失败的行只记录日志
+        
+        Yields:
+            处理后的数据字典
+        """
+        config = self.dataset_config
+        budget = InflightBudget(config.max_inflight_bytes)
+        self._begin_run()
+
+        def items():
+            for seq, data_row in enumerate(rows):
+                # 只有设置了内存预算时才需要计算行的大小
+                num_bytes = len(json.dumps(data_row, ensure_ascii=False)) if budget.max_bytes else 0
+                yield dict(data_row), num_bytes, seq
+
+        # 开启调度时_iter_completed已按输入顺序产出
+        reorder = ReorderBuffer() if ordered and self.scheduler is None else None
+        try:
+            held = (lambda: len(reorder)) if reorder is not None else None
+            for future, (_, num_bytes, seq) in self._iter_completed(items(), budget, held):
+                try:
+                    data_row, status = future.result()
+                    reason = self._failure_reason(data_row, status)
+                except Exception as ex:
+                    logger.error(f'[ERR] 处理数据行失败: {ex}')
+                    data_row, reason = None, REASON_EXCEPTION
+                if reason is None:
+                    result = data_row
+                    budget.observe(num_bytes, len(json.dumps(data_row, ensure_ascii=False)) if budget.max_bytes else 0)
+                elif include_failed and data_row is not None:
+                    result = dict(data_row, **{FAILURE_REASON_COLUMN: reason})
+                else:
+                    result = None
+                ready = reorder.push(seq, result) if reorder is not None else [result]
+                yield from (row for row in ready if row is not None)
+        finally:
+            self._end_run()
+
+    async def amap(self, rows: Union[Iterable[Dict], AsyncIterable[Dict]], ordered: bool = False,
+                   include_failed: bool = False) -> AsyncIterator[Dict]:
+        """map的异步版本：在后台线程中处理，不阻塞事件循环
+        
+        rows可以是普通的可迭代对象或异步可迭代对象；尚未被取走的结果最多batch_size行，
+        消费变慢时暂停读取新行。提前停止迭代时，不再提交新行，在途的行在后台处理完成后丢弃。
+        
+        Args:
+            rows: 数据字典的可迭代对象或异步可迭代对象
+            ordered: 是否按输入顺序返回
+            include_failed: 是否返回处理失败的行
+        
+        Yields:
+            处理后的数据字典
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        slots = threading.Semaphore(self.dataset_config.batch_size)
+        finished = object()
+
+        if hasattr(rows, "__aiter__"):
+            iterator = rows.__aiter__()
+
+            def source():
+                while not stop.is_set():
                     try:
-                        pbar.update(1)
-                        data_row = future.result()
-                        if not data_row:
-                            logger.warning('[ERR] 处理结果为空')
-                            continue
-                        
-                        # 检查是否有生成的结果
-                        has_results = False
-                        for output_col in self.dataset_config.output_column:
-                            if data_row.get(output_col):
-                                has_results = True
-                                break
-                        
-                        if not has_results:
-                            logger.warning('[ERR] 未生成有效结果')
-                            continue
-                        
-                        # 检查是否包含错误标记
-                        if '<|wrong data|>' in str(data_row):
-                            logger.warning('[ERR] 结果包含错误标记')
-                            continue
-                            
-                        f.write(json.dumps(data_row, ensure_ascii=False) + "\n")
-                        
-                    except Exception as ex:
-                        logger.error(f'[ERR] 处理批次失败: {ex}')
-                        continue
+                        yield asyncio.run_coroutine_threadsafe(iterator.__anext__(), loop).result()
+                    except StopAsyncIteration:
+                        return
+        else:
+            def source():
+                for row in rows:
+                    if stop.is_set():
+                        return
+                    yield row
 
-    def load_jsonl(self, file_path: str, batch_size: int = 1000, max_rows: Optional[int] = None):
-        """批次加载JSONL文件数据
+        def put(item) -> bool:
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return False
+            if stop.is_set():
+                return False
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # 事件循环已关闭
+                stop.set()
+                return False
+            return True
+
+        def run():
+            try:
+                for row in self.map(source(), ordered, include_failed):
+                    if not put((row, None)):
+                        return
+            except BaseException as e:
+                put((finished, e))
+            else:
+                put((finished, None))
+
+        worker = threading.Thread(target=run, name="chat-llm-amap", daemon=True)
+        worker.start()
+        try:
+            while True:
+                row, error = await queue.get()
+                slots.release()
+                if row is finished:
+                    if error is not None:
+                        raise error
+                    return
+                yield row
+        finally:
+            stop.set()
+
+    def iter_jsonl(self, file_path: str, max_rows: Optional[int] = None) -> Iterator[Tuple[Dict, int]]:
+        """逐行惰性读取JSONL文件
         
         Args:
             file_path: JSONL文件路径
-            batch_size: 每批次大小
             max_rows: 最大处理行数，None表示处理所有行
             
         Yields:
-            每批次的数据字典列表
+            (数据字典, 该行的原始字节数)
         """
-        batch = []
         processed_rows = 0
         
-        with open(file_path, 'r', encoding='utf-8') as f:
+        with open(file_path, 'rb') as f:
             for line in f:
                 # 如果设置了max_rows且已达到限制，停止处理
                 if max_rows is not None and processed_rows >= max_rows:
                     break
                     
                 try:
-                    data = json.loads(line.strip())
-                    batch.append(data)
-                    processed_rows += 1
-                    
-                    if len(batch) == batch_size:
-                        yield batch
-                        batch = []
-                        
-                except json.JSONDecodeError as e:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
                     continue
+                processed_rows += 1
+                yield data, len(line)
+
+    def read_rows(self, file_path: str, max_rows: Optional[int] = None) -> Iterator[Tuple[Dict, int]]:
+        """按文件格式惰性读取数据行：JSONL逐行读取，Parquet/Arrow按行组读取且只读取输入列
+        
+        Args:
+            file_path: 输入文件路径
+            max_rows: 最大处理行数，None表示处理所有行
+            
+        Yields:
+            (数据字典, 该行的原始字节数)
+        """
+        if is_columnar(file_path):
+            return iter_columnar(file_path, self.dataset_config.input_columns, max_rows)
+        return self.iter_jsonl(file_path, max_rows)
+
+    def _file_task(self, input_path: str, output_path: str) -> FileTask:
+        """创建文件任务，输出为Parquet/Arrow文件时按行组写出输出列"""
+        if not is_columnar(output_path):
+            return FileTask(input_path, output_path)
+        output_columns = list(self.plan.output_columns)
+        output_columns += [node.prompt_column for node in self.plan.nodes if node.prompt_column]
+        if self.near_dup:
+            output_columns.append(self.near_dup_column)
+        return ColumnarFileTask(input_path, output_path, self.dataset_config.input_columns, output_columns,
+                                self.dataset_config.join_original_columns)
+
+    def load_jsonl(self, file_path: str, batch_size: int = 1000, max_rows: Optional[int] = None):
+        """批次加载JSONL文件数据
+        
+        Args:
+            file_path: JSONL文件路径
+            batch_size: 每批次大小
+            max_rows: 最大处理行数，None表示处理所有行
+            
+        Yields:
+            每批次的数据字典列表
+        """
+        batch = []
+        for data, _ in self.iter_jsonl(file_path, max_rows):
+            batch.append(data)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
                     
         if batch:  # 处理最后一批剩余数据
             yield batch
@@ -359,6 +1141,9 @@ class ChatLLM:
         Returns:
             文件行数（考虑max_rows限制）
         """
+        if is_columnar(file_path):
+            all_nums = count_rows(file_path)
+            return min(all_nums, max_rows) if max_rows is not None else all_nums
         try:
             out = subprocess.getoutput("wc -l {}".format(file_path))
             all_nums = int(out.split()[0])
@@ -373,69 +1158,388 @@ class ChatLLM:
         
         return all_nums
 
-    def process_dataset(self):
+    def dry_run(self, avg_latency: float = 20.0) -> Dict:
+        """只渲染prompt并统计token数、重复数与预计运行时间，不调用LLM
+        
+        Args:
+            avg_latency: 单个请求的平均耗时（秒），用于估计运行时间
+            
+        Returns:
+            统计结果字典
+        """
+        config = self.dataset_config
+        preflight = self.preflight or Preflight(CharTokenEstimator(), None, self.generate_config.get("max_tokens", 4096),
+                                                system_prompt=SYSTEM_PROMPT)
+        report = DryRunReport(preflight, config.max_thread_num, avg_latency)
+        rows = (row for input_file, _ in config.resolve_input_files() for row, _ in self.read_rows(input_file))
+        for data_row in itertools.islice(rows, config.max_rows):
+            report.rows += 1
+            for _, prompt in self._render_prompts(data_row):
+                report.add(prompt)
+        report.log_summary()
+        return report.summary()
+
+    def autotune(self, levels: List[int], samples: int = 200, requests_per_level: Optional[int] = None,
+                 output_path: str = "autotune.env", min_gain: float = 0.1) -> Dict[str, int]:
+        """用输入数据渲染出的prompt逐档压测LLM服务，推荐MAX_THREAD_NUM和BATCH_SIZE
+        
+        Args:
+            levels: 并发档位
+            samples: 样本prompt数
+            requests_per_level: 每档请求数，None表示按并发数自动确定
+            output_path: 推荐配置（.env片段）的输出路径
+            min_gain: 判定吞吐已饱和的最小提升比例
+            
+        Returns:
+            推荐配置
+        """
+        rows = (row for input_file, _ in self.dataset_config.resolve_input_files() for row, _ in self.read_rows(input_file))
+        prompts = list(itertools.islice((prompt for row in rows for _, prompt in self._render_prompts(row)), samples))
+        logger.info(f"[autotune] 样本prompt数: {len(prompts)}，并发档位: {levels}")
+        
+        # 压测使用单独的客户端：连接池按最高并发档位设置，避免高档位在按MAX_THREAD_NUM设置的连接池上排队；
+        # 压测时不重试，如实统计错误率
+        pool_size = max(levels)
+        http_client = build_http_client(
+            {**(self.http_config or {}), "max_connections": pool_size, "max_keepalive_connections": pool_size},
+            pool_size,
+        )
+        client = OpenAI(base_url=self.client.base_url, api_key=self.client.api_key, max_retries=0,
+                        http_client=http_client)
+        
+        def send(prompt: str) -> bool:
+            generate_config = self.generate_config
+            if self.preflight:
+                max_tokens = self.preflight.fit_max_tokens(prompt)
+                if max_tokens is not None:
+                    generate_config = {**generate_config, "max_tokens": max_tokens}
+            completion = client.chat.completions.create(
+                messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+                **generate_config
+            )
+            return bool(completion.choices[0].message.content)
+        
+        try:
+            results = run_autotune(send, prompts, levels, requests_per_level, min_gain)
+        finally:
+            client.close()
+        knee = find_knee(results, min_gain)
+        if knee is None:
+            raise RuntimeError("所有并发档位的错误率都过高，无法给出推荐配置")
+        settings = recommend(knee)
+        snippet = format_env_snippet(results, knee, settings)
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(snippet)
+        logger.info(f"[autotune] 吞吐拐点: 并发{knee.concurrency}（{knee.throughput:.1f}请求/秒），"
+                    f"推荐配置已写入: {output_path}\n{snippet}")
+        return settings
+
+    def process_dataset(self, resume: bool = False):
         """处理整个数据集
         
         主要流程：
-        1. 批次读取JSONL文件
-        2. 批次处理并立即写入结果
-        3. 使用追加模式写入
-        4. 支持max_rows限制
+        1. 解析输入路径，支持单个文件、目录或glob模式
+        2. 轮流从多个文件惰性读取数据行，所有文件共享同一个线程池，在途行数受batch_size和内存预算限制
+        3. 每行处理完成后立即写入对应的输出文件
+        4. 支持max_rows限制（多个文件时为合计行数）
+        5. 到达运行截止时间后停止读取输入，在死信文件旁记录每个输入文件的断点
+        
+        Args:
+            resume: 是否从上次运行记录的断点继续：跳过已读取的行，输出和死信追加到已有文件
         """
         config = self.dataset_config
         input_path = config.input_path
         output_path = config.output_path
+        if not input_path or not output_path:
+            raise ValueError("输入文件路径和输出文件路径不能为空")
         max_rows = getattr(config, 'max_rows', None)
+        file_pairs = config.resolve_input_files()
         
         # 检查输入输出文件相同且设置了max_rows的情况
-        if input_path == output_path and max_rows is not None:
+        if max_rows is not None and any(os.path.abspath(i) == os.path.abspath(o) for i, o in file_pairs):
             raise ValueError(
                 "当输入输出文件相同时，不能设置max_rows限制，因为这会导致原文件中未处理的数据丢失。"
                 "请使用不同的输出文件路径，或者将max_rows设置为None。"
             )
         
-        # 只处理单个文件        
-        if os.path.isfile(input_path) and input_path.lower().endswith('.jsonl'):
-            # 创建输出目录
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            # 获取文件总行数（考虑max_rows限制）
-            in_all_nums = self.get_file_line_nums(input_path, max_rows)
-            
-            if max_rows is not None:
-                logger.info(f'开始处理文件：{input_path}，限制处理行数：{max_rows}')
-            else:
-                logger.info(f'开始处理文件：{input_path}')
-            
-            # 如果输入输出是同一文件，使用临时文件
-            if input_path == output_path:
-                temp_output = output_path + '.tmp'
-                actual_output = temp_output
-            else:
-                actual_output = output_path
-                # 如果输出文件已存在，删除以避免重复追加
-                if os.path.isfile(output_path):
-                    os.remove(output_path)
-            
-            # 创建进度条
-            pbar = tqdm(desc=f"proc->{os.path.basename(input_path)}", 
-                       total=in_all_nums, ncols=150)
+        if self.run_deadline and any(os.path.abspath(i) == os.path.abspath(o) for i, o in file_pairs):
+            raise ValueError("当输入输出文件相同时，不能设置RUN_DEADLINE，到达截止时间时原文件中未读取的数据会丢失")
+        
+        if not file_pairs or not all(os.path.isfile(i) and i.lower().endswith(INPUT_SUFFIXES) for i, _ in file_pairs):
+            raise ValueError("输入路径需要为jsonl/parquet/arrow文件、包含这些文件的目录或glob模式")
+        
+        tasks = [self._file_task(i, o) for i, o in file_pairs]
+        resume_path = default_resume_path(config.dead_letter_path)
+        skip_rows = {}
+        if resume:
+            if not os.path.isfile(resume_path):
+                raise ValueError(f"断点文件不存在: {resume_path}")
+            if any(isinstance(task, ColumnarFileTask) for task in tasks):
+                raise ValueError("RESUME不支持追加到Parquet/Arrow输出文件")
+            points = read_resume_point(resume_path)
+            tasks = [task for task in tasks if not points.get(task.input_path, {}).get("complete")]
+            for task in tasks:
+                skip_rows[task.input_path] = task.rows_read = points.get(task.input_path, {}).get("rows_done", 0)
+                task.append = True
+            logger.info(f"从断点继续: {resume_path}，剩余{len(tasks)}个文件")
+        
+        # 获取总行数（考虑max_rows限制）
+        in_all_nums = sum(max(0, self.get_file_line_nums(task.input_path) - skip_rows.get(task.input_path, 0))
+                          for task in tasks)
+        if max_rows is not None:
+            in_all_nums = min(in_all_nums, max_rows)
+            logger.info(f'开始处理：{input_path}（{len(tasks)}个文件），限制处理行数：{max_rows}')
+        else:
+            logger.info(f'开始处理：{input_path}（{len(tasks)}个文件）')
+        
+        if config.oversize_path and os.path.isfile(config.oversize_path):
+            os.remove(config.oversize_path)
+        
+        # 创建进度条（多个文件共用一个）
+        desc = os.path.basename(input_path) if len(tasks) == 1 else f"{len(tasks)} files"
+        pbar = tqdm(desc=f"proc->{desc}", total=in_all_nums, ncols=150)
+        self.progress = pbar
+        
+        self.dead_letter_writer = DeadLetterWriter(config.dead_letter_path, append=resume)
+        if os.path.isfile(config.dead_letter_path) and not resume:
+            os.remove(config.dead_letter_path)
+        if os.path.isfile(resume_path):
+            os.remove(resume_path)
+        if config.raw_store_path:
+            self.raw_store = RawResponseStore(config.raw_store_path)
+        
+        def read_rows(path: str):
+            return itertools.islice(self.read_rows(path), skip_rows.get(path, 0), None)
+        
+        budget = InflightBudget(config.max_inflight_bytes)
+        # 记录每行在所属文件中的行号，Parquet/Arrow输出按行号拼接回原文件的行组
+        rows = ((data_row, num_bytes, task, task.rows_read - 1) for data_row, num_bytes, task
+                in interleave_rows(tasks, read_rows, config.max_open_files, max_rows))
+        held = None
+        if any(isinstance(task, ColumnarFileTask) for task in tasks):
+            # Parquet/Arrow输出中等待较早行组完成而暂存的结果也计入窗口，避免慢行阻塞时后续行组无限堆积
+            def held():
+                return sum(task.handle.held for task in tasks if isinstance(task.handle, ColumnarWriter))
+        stopped = []
+        try:
+            for future, (_, num_bytes, task, index) in self._iter_completed(rows, budget, held,
+                                                                             on_deadline=lambda: stopped.append(True)):
+                pbar.update(1)
+                task.pending -= 1
+                try:
+                    data_row, status = future.result()
+                    out_bytes = self._write_result(task.handle, data_row, status, task.output_path, index=index)
+                    if out_bytes:
+                        budget.observe(num_bytes, out_bytes)
+                except Exception as ex:
+                    logger.error(f'[ERR] 处理批次失败: {ex}')
+                task.finish_if_done()
             
-            try:
-                # 批次处理文件（传递max_rows参数）
-                for data_rows in self.load_jsonl(input_path, batch_size=config.batch_size, max_rows=max_rows):
-                    if len(data_rows) == 0:
-                        logger.warning('[ERR] JSON加载错误')
-                        continue
-                    self.produce_data(data_rows, actual_output, pbar)
-            finally:
-                pbar.close()
+            for task in tasks:
+                if task.handle and not task.finished:
+                    task.finish()
+            if stopped:
+                write_resume_point(resume_path, [
+                    {"input_path": task.input_path, "output_path": task.output_path,
+                     "rows_done": task.rows_read, "complete": task.exhausted} for task in tasks
+                ])
+                logger.warning(f"未读取的输入行的断点已写入: {resume_path}，设置RESUME=true从断点继续处理")
+        finally:
+            for task in tasks:
+                task.abort()
+            pbar.close()
+            self.dead_letter_writer.close()
+            self.dead_letter_writer = None
+            self._close_raw_store()
+            self.close()
+            self.http_stats.log_summary()
+            if self.batcher:
+                self.batcher.log_summary()
+            if self.near_dup:
+                self.near_dup.log_summary()
+            if self.cascade:
+                self.cascade.log_summary()
+            budget.log_summary()
+        
+        logger.info(f"处理完成: {output_path}")
+
+    def retry_dead_letter(self):
+        """只重跑死信文件中的失败行
+        
+        重跑成功的行追加到其原本所属的输出文件，仍然失败的行写回死信文件（累计调用次数）。
+        """
+        config = self.dataset_config
+        dead_letter_path = config.dead_letter_path
+        if not os.path.isfile(dead_letter_path):
+            raise ValueError(f"死信文件不存在: {dead_letter_path}")
+        output_paths = [o for _, o in config.resolve_input_files()] if config.input_path else [config.output_path or '']
+        if any(is_columnar(o) for o in output_paths):
+            raise ValueError("RETRY_DEAD_LETTER不支持追加到Parquet/Arrow输出文件")
+
+        total = self.get_file_line_nums(dead_letter_path, config.max_rows)
+        logger.info(f'开始重跑失败行：{dead_letter_path}，共{total}行')
+        pbar = tqdm(desc=f"retry->{os.path.basename(dead_letter_path)}", total=total, ncols=150)
+        self.progress = pbar
+        
+        temp_dead_letter = dead_letter_path + '.tmp'
+        self.dead_letter_writer = DeadLetterWriter(temp_dead_letter)
+        if config.raw_store_path:
+            self.raw_store = RawResponseStore(config.raw_store_path)
+        budget = InflightBudget(config.max_inflight_bytes)
+        outputs = {}
+        recovered = 0
+        
+        records = itertools.islice(iter_dead_letters(dead_letter_path), config.max_rows)
+        consumed = [0]
+        
+        def rows():
+            for record, num_bytes in records:
+                consumed[0] += 1
+                yield record["row"], num_bytes, record
+        
+        stopped = []
+        try:
+            for future, (_, num_bytes, record) in self._iter_completed(rows(), budget,
+                                                                       on_deadline=lambda: stopped.append(True)):
+                pbar.update(1)
+                output_path = record.get("output_path") or config.output_path
+                if output_path not in outputs:
+                    outputs[output_path] = open(output_path, "a", encoding="utf-8")
+                try:
+                    data_row, status = future.result()
+                    out_bytes = self._write_result(outputs[output_path], data_row, status, output_path,
+                                                   prior_attempts=record.get("attempts", 0))
+                    if out_bytes:
+                        recovered += 1
+                        budget.observe(num_bytes, out_bytes)
+                except Exception as ex:
+                    logger.error(f'[ERR] 处理批次失败: {ex}')
             
-            # 如果使用了临时文件，最后替换原文件
-            if input_path == output_path:
-                os.replace(temp_output, output_path)
-                
+            # 未重跑的行（max_rows限制或到达运行截止时间后未读取的行）原样保留在死信文件中
+            if config.max_rows is not None or stopped:
+                for record, line in itertools.islice(iter_dead_letter_lines(dead_letter_path), consumed[0], None):
+                    self.dead_letter_writer.write_line(line.decode("utf-8"), record["reason"])
+        finally:
+            for f in outputs.values():
+                f.close()
+            pbar.close()
+            self.dead_letter_writer.close()
+            self.dead_letter_writer = None
+            self._close_raw_store()
+            self.close()
+            self.http_stats.log_summary()
+            if self.batcher:
+                self.batcher.log_summary()
+            if self.cascade:
+                self.cascade.log_summary()
+        
+        # 用剩余的失败行替换死信文件
+        if os.path.isfile(temp_dead_letter):
+            os.replace(temp_dead_letter, dead_letter_path)
         else:
-            raise ValueError("输入路径需要为jsonl文件")
+            os.remove(dead_letter_path)
+        logger.info(f"重跑完成，恢复{recovered}行，剩余失败行见: {dead_letter_path}")
+
+    def _begin_run(self):
+        """开始一次map调用，第一个调用打开原始响应存储"""
+        with self._runs_lock:
+            self._active_runs += 1
+            if self.dataset_config.raw_store_path and self.raw_store is None:
+                self.raw_store = RawResponseStore(self.dataset_config.raw_store_path)
+
+    def _end_run(self):
+        """结束一次map调用，最后一个调用结束时关闭原始响应存储和凑批线程"""
+        with self._runs_lock:
+            self._active_runs -= 1
+            if self._active_runs == 0:
+                self._close_raw_store()
+                self.close()
+
+    def _close_raw_store(self):
+        """关闭原始响应存储"""
+        if self.raw_store is not None:
+            self.raw_store.close()
+            self.raw_store = None
+
+    def close(self):
+        """停止completions/batch后端的凑批线程和发送线程池（batch后端取消在途的批量任务），之后再处理数据时自动重新启动"""
+        if self.batcher:
+            self.batcher.close()
+
+    def reprocess_dataset(self, num_workers: Optional[int] = None, chunk_size: int = 256):
+        """用保存的原始响应重新运行输出解析器，不调用LLM
+        
+        数据行按块分发到多个进程并行处理，输出文件与process_dataset相同，
+        缺少原始响应或处理失败的行写入死信文件。
+        
+        Args:
+            num_workers: 并行进程数，None表示使用CPU核数
+            chunk_size: 每个进程任务处理的行数
+        """
+        config = self.dataset_config
+        if not config.raw_store_path or not os.path.isfile(config.raw_store_path):
+            raise ValueError(f"原始响应存储不存在: {config.raw_store_path}")
+        
+        if any(is_columnar(i) or is_columnar(o) for i, o in config.resolve_input_files()):
+            raise ValueError("REPROCESS_ONLY只支持jsonl输入输出文件")
+        tasks = [FileTask(i, o) for i, o in config.resolve_input_files()]
+        total = sum(self.get_file_line_nums(task.input_path) for task in tasks)
+        if config.max_rows is not None:
+            total = min(total, config.max_rows)
+        logger.info(f'开始重新处理：{config.input_path}（{len(tasks)}个文件），原始响应: {config.raw_store_path}')
+        pbar = tqdm(desc=f"reprocess->{os.path.basename(config.input_path)}", total=total, ncols=150)
+        self.progress = pbar
+        
+        store = RawResponseStore(config.raw_store_path)
+        self.dead_letter_writer = DeadLetterWriter(config.dead_letter_path)
+        if os.path.isfile(config.dead_letter_path):
+            os.remove(config.dead_letter_path)
+        input_columns = self.dataset_config.input_columns
+        num_workers = num_workers or os.cpu_count() or 1
+        
+        def chunks():
+            chunk = []
+            for data_row, _, task in interleave_rows(tasks, self.iter_jsonl, 1, config.max_rows):
+                chunk.append((data_row, store.get(row_key(data_row, input_columns)), task))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        def write(future, chunk):
+            for (data_row, reason), (_, _, task) in zip(future.result(), chunk):
+                status = RowStatus()
+                status.reason = reason
+                self._write_result(task.handle, data_row, status, task.output_path)
+                task.pending -= 1
+                task.finish_if_done()
+            pbar.update(len(chunk))
+        
+        try:
+            # 按提交顺序写出结果，保持输出行序与输入一致
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                pending = deque()
+                for chunk in chunks():
+                    items = [(data_row, raws) for data_row, raws, _ in chunk]
+                    pending.append((pool.submit(reprocess_chunk, items, self.plan.nodes), chunk))
+                    if len(pending) >= num_workers * 2:
+                        write(*pending.popleft())
+                while pending:
+                    write(*pending.popleft())
+            
+            for task in tasks:
+                if task.handle and not task.finished:
+                    task.finish()
+        finally:
+            for task in tasks:
+                task.abort()
+            pbar.close()
+            store.close()
+            self.dead_letter_writer.close()
+            self.dead_letter_writer = None
         
-        logger.info(f"处理完成: {output_path}")
\ No newline at end of file
+        logger.info(f"重新处理完成: {config.output_path}")
@@ -0,0 +1,292 @@
+import os
+import json
+import bisect
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from file_tasks import FileTask
+
+logger = logging.getLogger(__name__)
+
+# 按列式格式读写的文件后缀：Parquet，以及Arrow IPC文件格式（.arrow/.feather/.ipc）
+COLUMNAR_SUFFIXES = ('.parquet', '.arrow', '.feather', '.ipc')
+
+
+def is_columnar(path: str) -> bool:
+    """是否为Parquet或Arrow IPC文件"""
+    return path.lower().endswith(COLUMNAR_SUFFIXES)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("读写Parquet/Arrow文件需要先安装pyarrow：pip install pyarrow")
+    return pyarrow
+
+
+class ColumnarSource:
+    """按行组读取Parquet文件或Arrow IPC文件（IPC文件的每个record batch视为一个行组）
+
+    Args:
+        path: 文件路径
+    """
+
+    def __init__(self, path: str):
+        pa = _import_pyarrow()
+        self.path = path
+        self._parquet = None
+        self._ipc = None
+        self._mmap = None
+        if path.lower().endswith('.parquet'):
+            self._parquet = pa.parquet.ParquetFile(path)
+            self.schema = self._parquet.schema_arrow
+            metadata = self._parquet.metadata
+            self.group_sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+        else:
+            # 内存映射读取，按列选择时不复制数据
+            self._mmap = pa.memory_map(path, 'r')
+            self._ipc = pa.ipc.open_file(self._mmap)
+            self.schema = self._ipc.schema
+            self.group_sizes = [self._ipc.get_batch(i).num_rows for i in range(self._ipc.num_record_batches)]
+
+    @property
+    def num_rows(self) -> int:
+        return sum(self.group_sizes)
+
+    def read_group(self, index: int, columns: Optional[Sequence[str]] = None):
+        """读取一个行组，columns为None时读取所有列
+
+        Returns:
+            pyarrow.Table
+        """
+        pa = _import_pyarrow()
+        if self._parquet is not None:
+            return self._parquet.read_row_group(index, columns=list(columns) if columns is not None else None)
+        table = pa.Table.from_batches([self._ipc.get_batch(index)])
+        return table.select(list(columns)) if columns is not None else table
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+def _project(schema, columns: Sequence[str], path: str) -> List[str]:
+    """输入列中文件里存在的列；不存在的列（如多阶段中上游的输出列）不读取"""
+    missing = [c for c in columns if c not in schema.names]
+    if missing:
+        logger.warning(f"输入文件中没有以下列，不读取: {missing} ({path})")
+    return [c for c in columns if c in schema.names]
+
+
+def count_rows(path: str) -> int:
+    """从文件元数据中读取总行数"""
+    source = ColumnarSource(path)
+    try:
+        return source.num_rows
+    finally:
+        source.close()
+
+
+def iter_columnar(path: str, columns: Sequence[str], max_rows: Optional[int] = None) -> Iterator[Tuple[Dict, int]]:
+    """逐行组惰性读取Parquet/Arrow文件，只读取columns中的列
+
+    同一时间只有一个行组在内存中。
+
+    Args:
+        path: 文件路径
+        columns: 要读取的列
+        max_rows: 最大处理行数，None表示处理所有行
+
+    Yields:
+        (数据字典, 该行在Arrow中的估计字节数)
+    """
+    source = ColumnarSource(path)
+    try:
+        columns = _project(source.schema, columns, path)
+        emitted = 0
+        for index in range(len(source.group_sizes)):
+            table = source.read_group(index, columns)
+            row_bytes = table.nbytes // max(table.num_rows, 1)
+            for data in table.to_pylist():
+                if max_rows is not None and emitted >= max_rows:
+                    return
+                emitted += 1
+                yield data, row_bytes
+    finally:
+        source.close()
+
+
+def _encode(value: Any) -> Optional[str]:
+    """输出列统一保存为字符串，非字符串的结果（如JSON解析结果）保存为JSON，保证各行组的schema一致"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+class ColumnarWriter:
+    """按输入文件的行组写出Parquet或Arrow IPC文件
+
+    每个输入行组的所有行都有结果（成功或失败）后，把该行组的输出列作为一个行组写出，
+    行序与输入一致，失败的行不写出。较早行组未完成时，之后行组的结果暂存在内存中（见held）。join_original为True时，输出列拼接到原文件的所有列上，
+    原始列直接从输入文件按行组读取，不转换为Python对象；否则只保留读取的输入列。
+
+    Args:
+        output_path: 输出文件路径
+        input_path: 输入文件路径
+        input_columns: 读取的输入列
+        output_columns: 写出的输出列（包括prompt列等），值以字符串保存
+        join_original: 是否拼接原文件的所有列
+        parquet: 是否写出Parquet格式，否则写出Arrow IPC文件格式；None表示按输出路径的后缀决定
+    """
+
+    def __init__(self, output_path: str, input_path: str, input_columns: Sequence[str],
+                 output_columns: Sequence[str], join_original: bool = True, parquet: Optional[bool] = None):
+        self._pa = _import_pyarrow()
+        self.output_path = output_path
+        self.parquet = output_path.lower().endswith('.parquet') if parquet is None else parquet
+        self._source = ColumnarSource(input_path)
+        self._columns = None if join_original else _project(self._source.schema, input_columns, input_path)
+        self._output_columns = list(dict.fromkeys(output_columns))
+        self._starts = [0]
+        for size in self._source.group_sizes:
+            self._starts.append(self._starts[-1] + size)
+        self._results: Dict[int, Optional[Dict]] = {}
+        self._resolved = [0] * len(self._source.group_sizes)
+        self._next_group = 0
+        self._writer = None
+        self.rows_written = 0
+
+    @property
+    def held(self) -> int:
+        """已有结果、但要等待更早的行组完成才能写出的行数
+
+        第一个未完成行组内的结果本身要等整个行组完成才写出，不计入；
+        其后行组的结果因更早的行较慢而堆积，调用方应把这些行计入在途窗口。
+        """
+        if self._next_group >= len(self._resolved):
+            return 0
+        return len(self._results) - self._resolved[self._next_group]
+
+    def write_row(self, index: int, data_row: Dict) -> int:
+        """记录第index行的结果
+
+        Returns:
+            输出列的估计字节数
+        """
+        outputs = {column: _encode(data_row.get(column)) for column in self._output_columns}
+        self._resolve(index, outputs)
+        return len(json.dumps(outputs, ensure_ascii=False).encode('utf-8')) or 1
+
+    def skip(self, index: int):
+        """第index行处理失败，不写出"""
+        self._resolve(index, None)
+
+    def _resolve(self, index: int, outputs: Optional[Dict]):
+        self._results[index] = outputs
+        self._resolved[bisect.bisect_right(self._starts, index) - 1] += 1
+        while (self._next_group < len(self._resolved)
+               and self._resolved[self._next_group] == self._source.group_sizes[self._next_group]):
+            self._write_group(self._next_group)
+            self._next_group += 1
+
+    def _write_group(self, group: int):
+        pa = self._pa
+        start = self._starts[group]
+        results = [self._results.pop(i, None) for i in range(start, self._starts[group + 1])]
+        keep = [offset for offset, outputs in enumerate(results) if outputs is not None]
+        if not keep:
+            return
+        table = self._source.read_group(group, self._columns).take(pa.array(keep, type=pa.int64()))
+        self._write_table(self._with_outputs(table, [results[offset] for offset in keep]))
+
+    def _with_outputs(self, table, outputs: List[Dict]):
+        """把输出列追加到表上，与原有列同名时替换原有列"""
+        for column in self._output_columns:
+            array = self._pa.array([row[column] for row in outputs], type=self._pa.string())
+            if column in table.column_names:
+                table = table.set_column(table.column_names.index(column), column, array)
+            else:
+                table = table.append_column(column, array)
+        return table
+
+    def _write_table(self, table):
+        pa = self._pa
+        if self._writer is None:
+            output_dir = os.path.dirname(self.output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            if self.parquet:
+                self._writer = pa.parquet.ParquetWriter(self.output_path, table.schema)
+            else:
+                self._writer = pa.ipc.new_file(self.output_path, table.schema)
+        if self.parquet:
+            self._writer.write_table(table, row_group_size=max(table.num_rows, 1))
+        else:
+            self._writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+        self.rows_written += table.num_rows
+
+    def close(self):
+        """写出剩余行组（如受max_rows限制只处理了部分行）并关闭文件"""
+        if self._source is None:
+            return
+        for group in range(self._next_group, len(self._resolved)):
+            self._write_group(group)
+        self._next_group = len(self._resolved)
+        if self._writer is None:
+            # 没有成功的行时写出只有schema的空文件
+            schema = self._source.schema
+            if self._columns is not None:
+                schema = self._pa.schema([schema.field(c) for c in self._columns])
+            self._write_table(self._with_outputs(schema.empty_table(), []))
+        self._writer.close()
+        self._source.close()
+        self._source = None
+
+    def discard(self):
+        """异常退出时丢弃暂存的结果，关闭并删除已写出一部分的输出文件"""
+        if self._source is None:
+            return
+        self._results.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if os.path.isfile(self.output_path):
+                os.remove(self.output_path)
+        self._source.close()
+        self._source = None
+
+
+class ColumnarFileTask(FileTask):
+    """输出为Parquet/Arrow文件的处理任务，handle为ColumnarWriter
+
+    Args:
+        input_path: 输入文件路径（Parquet/Arrow）
+        output_path: 输出文件路径（Parquet/Arrow）
+        input_columns: 读取的输入列
+        output_columns: 写出的输出列
+        join_original: 是否拼接原文件的所有列
+    """
+
+    def __init__(self, input_path: str, output_path: str, input_columns: Sequence[str],
+                 output_columns: Sequence[str], join_original: bool = True):
+        super().__init__(input_path, output_path)
+        self.input_columns = input_columns
+        self.output_columns = output_columns
+        self.join_original = join_original
+
+    def open(self):
+        """创建输出文件的写入器（第一个行组写出时才创建文件）"""
+        if os.path.isfile(self.actual_output):
+            os.remove(self.actual_output)
+        self.handle = ColumnarWriter(self.actual_output, self.input_path, self.input_columns, self.output_columns,
+                                     self.join_original, parquet=self.output_path.lower().endswith('.parquet'))
+
+    def abort(self):
+        """异常退出时丢弃未写出的行组并删除不完整的输出文件，不替换原文件"""
+        if self.handle:
+            self.handle.discard()
+            self.handle = None
@@ -0,0 +1,137 @@
+import json
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("key", "prompt", "future", "enqueued")
+
+    def __init__(self, key: str, prompt: str):
+        self.key = key
+        self.prompt = prompt
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class CompletionBatcher:
+    """将多个工作线程的prompt合并为一次 /v1/completions 请求
+
+    OpenAI兼容服务的completions接口接受prompt列表，按choices的index将结果分发回各个请求。
+    凑满batch_size个prompt，或最早的prompt已等待max_wait秒时发送一批。
+    生成参数（包括预检后调整的max_tokens）不同的prompt不会合并，避免一行的限制截断同一批中的其他行。
+    凑批线程和发送线程池在close后停止，之后再提交prompt时重新启动。
+
+    Args:
+        client: OpenAI客户端
+        batch_size: 每次请求最多包含的prompt数
+        max_wait: 凑批的最长等待时间（秒）
+        max_concurrency: 同时在途的批量请求数
+    """
+
+    def __init__(self, client, batch_size: int = 16, max_wait: float = 0.02, max_concurrency: int = 32):
+        if batch_size < 1:
+            raise ValueError(f"COMPLETIONS_BATCH_SIZE必须大于0: {batch_size}")
+        self.client = client
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max(1, max_concurrency)
+        self.batches = 0
+        self.prompts = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _start(self):
+        """启动凑批线程和发送线程池（调用时已持有锁）"""
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="completions")
+        self._thread = threading.Thread(target=self._run, args=(self._executor,), name="completion-batcher",
+                                        daemon=True)
+        self._thread.start()
+
+    def complete(self, prompt: str, generate_config: Dict, timeout: Optional[float] = None) -> str:
+        """提交一个prompt并等待结果，请求失败或超过timeout秒时抛出异常"""
+        key = json.dumps(generate_config, sort_keys=True, ensure_ascii=False)
+        item = _Pending(key, prompt)
+        with self._cond:
+            self._start()
+            self._queue.append(item)
+            self._cond.notify()
+        return item.future.result(timeout)
+
+    def close(self):
+        """发送完队列中剩余的prompt后停止凑批线程和发送线程池"""
+        with self._cond:
+            thread, executor = self._thread, self._executor
+            self._thread = self._executor = None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+            executor.shutdown(wait=True)
+
+    def _take_batch(self) -> Optional[List[_Pending]]:
+        """等待凑满一批或超时，取出与队首生成参数相同的prompt；已关闭且队列为空时返回None"""
+        with self._cond:
+            while True:
+                while not self._queue:
+                    if self._thread is not threading.current_thread():
+                        return None
+                    self._cond.wait()
+                deadline = self._queue[0].enqueued + self.max_wait
+                while self._queue and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # 关闭后重新启动时，队列可能已被新的凑批线程取空
+                if self._queue:
+                    break
+            key = self._queue[0].key
+            batch, rest = [], deque()
+            while self._queue and len(batch) < self.batch_size:
+                item = self._queue.popleft()
+                (batch if item.key == key else rest).append(item)
+            rest.extend(self._queue)
+            self._queue = rest
+            return batch
+
+    def _run(self, executor: ThreadPoolExecutor):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            executor.submit(self._send, batch)
+
+    def _send(self, batch: List[_Pending]):
+        config = json.loads(batch[0].key)
+        try:
+            completion = self.client.completions.create(prompt=[item.prompt for item in batch], **config)
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        with self._cond:
+            self.batches += 1
+            self.prompts += len(batch)
+        texts: Dict[int, str] = {choice.index: choice.text for choice in completion.choices}
+        for idx, item in enumerate(batch):
+            text = texts.get(idx)
+            if text is None:
+                item.future.set_exception(RuntimeError(f"批量补全结果缺少第{idx}个prompt"))
+            else:
+                item.future.set_result(text.strip())
+
+    def log_summary(self):
+        """输出合并请求统计"""
+        if self.batches:
+            logger.info(f"completions批量请求: {self.batches}次，共{self.prompts}个prompt，"
+                        f"平均每次{self.prompts / self.batches:.1f}个")
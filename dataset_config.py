@@ -1,14 +1,23 @@
 import os
+import glob
 import logging
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
+from dead_letter import default_dead_letter_path
+from columnar_io import COLUMNAR_SUFFIXES, is_columnar
 
 logger = logging.getLogger(__name__)
 
+# 支持的输入文件后缀
+INPUT_SUFFIXES = ('.jsonl',) + COLUMNAR_SUFFIXES
+
 class DatasetConfig:
     """数据集配置类
         Args:
-            input_path: 输入数据集文件的路径，支持JSONL格式。
-            output_path: 输出结果文件的保存路径。
+            input_path: 输入数据集的路径，支持单个JSONL文件、包含JSONL文件的目录或glob模式（如 data/*/part-*.jsonl）。
+                也可以是Parquet或Arrow IPC文件（.parquet/.arrow/.feather/.ipc，需要安装pyarrow），只读取input_columns中的列。
+                为None时只能通过ChatLLM.map/amap在进程内处理数据。
+            output_path: 输出结果的保存路径。输入为目录或glob时为输出目录，按输入文件的相对路径保存结果。
+                输入为Parquet/Arrow文件时，输出格式由输出路径的后缀决定（.jsonl或Parquet/Arrow）。
             input_columns: 用作输入的数据列名列表，这些列的内容将传递给LLM。
             output_column: 输出结果保存的列名，支持单个或多个。
             output_prompt_column: 可选的输出prompt列名，用于保存该行数据的prompt。
@@ -16,18 +25,35 @@ class DatasetConfig:
             batch_size: 批处理大小，默认为1000。控制每次处理的数据行数。
             max_rows: 最大处理行数限制。如果为None，则处理所有数据行。
             max_thread_num: 最大线程数，默认为512。控制并发处理的线程数量。
+            max_inflight_bytes: 在途数据（待处理的行及尚未写出的结果）的内存上限（字节）。
+                如果为None，则只按batch_size限制在途行数。
+            oversize_path: 可选的超长数据输出路径，prompt超出模型上下文的行会写入该文件。
+                如果为None，则直接跳过超长的行。
+            max_open_files: 输入为多个文件时，同时读取的文件数，默认为8。
+            dead_letter_path: 死信文件路径，处理失败的行连同失败原因写入该文件。
+                如果为None，则保存在输出路径旁的 <输出名>.dead_letter.jsonl。
+            raw_store_path: 可选的原始响应存储路径，保存每行每个prompt的LLM原始响应、reasoning和usage，
+                用于修改输出解析器后不调用LLM直接重新处理。如果为None，则不保存。
+            join_original_columns: 输出为Parquet/Arrow文件时，是否把输出列拼接到原文件的所有列上，默认为True。
+                如果为False，则只保留input_columns和输出列。
     """
     
     def __init__(
         self,
-        input_path: str,
-        output_path: str,
+        input_path: Optional[str],
+        output_path: Optional[str],
         input_columns: List[str],
         output_column: Union[str, List[str]],
         output_prompt_column: Optional[Union[str, List[str]]] = None,
         batch_size: int = 1000,
         max_rows: Optional[int] = None,
-        max_thread_num: int = 512
+        max_thread_num: int = 512,
+        max_inflight_bytes: Optional[int] = None,
+        oversize_path: Optional[str] = None,
+        max_open_files: int = 8,
+        dead_letter_path: Optional[str] = None,
+        raw_store_path: Optional[str] = None,
+        join_original_columns: bool = True
     ):
 
         self.input_path = input_path
@@ -38,6 +64,12 @@ class DatasetConfig:
         self.batch_size = batch_size
         self.max_rows = max_rows  # None表示处理全部文件，否则只处理前max_rows行
         self.max_thread_num = max_thread_num
+        self.max_inflight_bytes = max_inflight_bytes
+        self.oversize_path = oversize_path
+        self.max_open_files = max_open_files
+        self.dead_letter_path = dead_letter_path or (default_dead_letter_path(output_path) if output_path else None)
+        self.raw_store_path = raw_store_path
+        self.join_original_columns = join_original_columns
         
         # 简化日志输出，只记录关键配置信息
         logger.info(f"数据集配置: {self.input_columns} -> {self.output_column}")
@@ -50,21 +82,22 @@ class DatasetConfig:
         """验证配置参数"""
         logger.debug("开始验证配置参数")
         
-        if not self.input_path:
-            raise ValueError("输入文件路径不能为空")
+        # 未设置输入路径时只能通过ChatLLM.map/amap在进程内处理数据
+        if self.input_path:
+            self._validate_paths()
             
-        if not os.path.exists(self.input_path):
-            logger.error(f"输入文件不存在: {self.input_path}")
-            raise ValueError(f"输入文件不存在: {self.input_path}")
-            
-        if not self.input_path.lower().endswith('.jsonl'):
-            logger.error(f"输入文件必须是.jsonl格式: {self.input_path}")
-            raise ValueError(f"输入文件必须是.jsonl格式: {self.input_path}")
+        if self.max_open_files <= 0:
+            logger.error(f"max_open_files必须大于0，当前值: {self.max_open_files}")
+            raise ValueError("max_open_files必须大于0")
             
         if self.batch_size <= 0:
             logger.error(f"batch_size必须大于0，当前值: {self.batch_size}")
             raise ValueError("batch_size必须大于0")
             
+        if self.max_inflight_bytes is not None and self.max_inflight_bytes <= 0:
+            logger.error(f"max_inflight_bytes必须大于0，当前值: {self.max_inflight_bytes}")
+            raise ValueError("max_inflight_bytes必须大于0")
+            
         if not self.input_columns:
             logger.error("input_columns不能为空")
             raise ValueError("input_columns不能为空")
@@ -79,6 +112,58 @@ class DatasetConfig:
             
         logger.debug("配置参数验证通过")
     
+    def _validate_paths(self):
+        """验证输入输出路径"""
+        if not self.is_multi_file and not os.path.exists(self.input_path):
+            logger.error(f"输入文件不存在: {self.input_path}")
+            raise ValueError(f"输入文件不存在: {self.input_path}")
+            
+        if not self.is_multi_file and not self.input_path.lower().endswith(INPUT_SUFFIXES):
+            logger.error(f"输入文件必须是.jsonl、.parquet或Arrow IPC格式: {self.input_path}")
+            raise ValueError(f"输入文件必须是.jsonl、.parquet或Arrow IPC格式: {self.input_path}")
+            
+        if self.is_multi_file and not self.resolve_input_files():
+            logger.error(f"输入路径下没有找到.jsonl、.parquet或Arrow IPC文件: {self.input_path}")
+            raise ValueError(f"输入路径下没有找到.jsonl、.parquet或Arrow IPC文件: {self.input_path}")
+            
+        for input_file, output_file in self.resolve_input_files():
+            if output_file and is_columnar(output_file) and not is_columnar(input_file):
+                logger.error(f"输出为Parquet/Arrow文件时，输入也必须是Parquet/Arrow文件: {input_file}")
+                raise ValueError(f"输出为Parquet/Arrow文件时，输入也必须是Parquet/Arrow文件: {input_file}")
+            
+        if self.is_multi_file and self.output_path and os.path.isfile(self.output_path):
+            logger.error(f"输入为多个文件时，输出路径必须是目录: {self.output_path}")
+            raise ValueError(f"输入为多个文件时，输出路径必须是目录: {self.output_path}")
+    
+    @property
+    def is_multi_file(self) -> bool:
+        """输入路径是否为目录或glob模式"""
+        return os.path.isdir(self.input_path) or any(c in self.input_path for c in '*?[')
+
+    def resolve_input_files(self) -> List[Tuple[str, str]]:
+        """解析输入路径，得到 (输入文件, 输出文件) 列表
+        
+        输入为目录时递归查找其中的.jsonl、.parquet和Arrow IPC文件；输入为glob模式时以第一个通配符之前的目录为根目录。
+        输出文件按输入文件相对根目录的路径保存到输出目录下。
+        """
+        if not self.is_multi_file:
+            return [(self.input_path, self.output_path)]
+
+        if os.path.isdir(self.input_path):
+            root = self.input_path
+            files = glob.glob(os.path.join(root, '**', '*'), recursive=True)
+        else:
+            root_parts = []
+            for part in self.input_path.split(os.sep):
+                if any(c in part for c in '*?['):
+                    break
+                root_parts.append(part)
+            root = os.sep.join(root_parts) or '.'
+            files = glob.glob(self.input_path, recursive=True)
+
+        files = sorted(f for f in files if os.path.isfile(f) and f.lower().endswith(INPUT_SUFFIXES))
+        return [(f, os.path.join(self.output_path, os.path.relpath(f, root))) for f in files]
+
     def __str__(self):
         """配置信息的字符串表示，用于调试"""
         return f"""DatasetConfig:
@@ -87,6 +172,8 @@ class DatasetConfig:
                 输入列: {self.input_columns}
                 输出列: {self.output_column}
                 Prompt列: {self.output_prompt_column}
+                死信文件: {self.dead_letter_path}
                 批次大小: {self.batch_size}
                 最大行数: {self.max_rows if self.max_rows else '无限制'}
-                最大线程数: {self.max_thread_num}"""
\ No newline at end of file
+                最大线程数: {self.max_thread_num}
+                在途内存上限: {self.max_inflight_bytes if self.max_inflight_bytes else '无限制'}"""
\ No newline at end of file
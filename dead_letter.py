@@ -0,0 +1,173 @@
+import os
+import json
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 失败原因
+REASON_EMPTY_RESULT = "empty_result"          # 处理结果为空
+REASON_INVALID_FIELDS = "invalid_fields"      # 输入字段不完整
+REASON_LLM_FAILED = "llm_failed"              # 多次重试后LLM仍未返回有效响应
+REASON_PROCESSOR_REJECTED = "processor_rejected"  # 输出解析器拒绝了LLM响应
+REASON_WRONG_DATA = "wrong_data"              # 结果包含错误标记
+REASON_OVERSIZED = "oversized"                # prompt超出模型上下文
+REASON_EXCEPTION = "exception"                # 处理过程中发生异常
+REASON_DEADLINE = "deadline"                  # 超过单行或整体运行的截止时间
+
+
+class RowStatus:
+    """单行数据的处理状态，用于记录失败原因
+
+    Attributes:
+        attempts: LLM调用次数
+        last_prompt: 最后一次调用LLM的prompt
+        last_response: 最后一次LLM原始响应
+        last_reasoning: 最后一次LLM响应的reasoning内容（如果服务端返回）
+        last_usage: 最后一次LLM响应的token用量
+        reason: 处理过程中确定的失败原因，None表示未确定
+        deadline: 该行的截止时间（time.monotonic），None表示不限制
+    """
+
+    __slots__ = ("attempts", "last_prompt", "last_response", "last_reasoning", "last_usage", "reason", "deadline")
+
+    def __init__(self):
+        self.attempts = 0
+        self.last_prompt = None
+        self.last_response = None
+        self.last_reasoning = None
+        self.last_usage = None
+        self.reason = None
+        self.deadline = None
+
+
+def default_dead_letter_path(output_path: str) -> str:
+    """默认死信文件路径：输出文件（或输出目录）旁的 <名称>.dead_letter.jsonl"""
+    base = output_path.rstrip(os.sep)
+    if base.lower().endswith('.jsonl'):
+        base = base[:-len('.jsonl')]
+    return base + '.dead_letter.jsonl'
+
+
+class DeadLetterWriter:
+    """死信文件写入器，线程安全
+
+    每条记录包含失败原因、LLM调用次数、最后一次原始响应、所属输出文件以及数据行本身，
+    用于之后只重跑失败的行。
+
+    Args:
+        path: 死信文件路径
+        append: 是否追加到已有的死信文件（从断点继续时保留之前运行的失败行）
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self._mode = "a" if append else "w"
+        self.reasons = Counter()
+        self._lock = threading.Lock()
+        self._handle = None
+
+    def write(self, data_row: Dict, reason: str, status: Optional[RowStatus], output_path: str,
+              prior_attempts: int = 0):
+        """写入一条失败记录
+
+        Args:
+            data_row: 失败的数据行
+            reason: 失败原因
+            status: 该行的处理状态
+            output_path: 该行所属的输出文件，重跑成功后合并回该文件
+            prior_attempts: 之前运行中已累计的LLM调用次数
+        """
+        record = {
+            "reason": reason,
+            "attempts": prior_attempts + (status.attempts if status else 0),
+            "last_response": status.last_response if status else None,
+            "output_path": output_path,
+            "row": data_row,
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._handle is None:
+                output_dir = os.path.dirname(self.path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                self._handle = open(self.path, self._mode, encoding="utf-8")
+            self._handle.write(line)
+            self.reasons[reason] += 1
+
+    def write_line(self, line: str, reason: str):
+        """原样写入一条已有的死信记录（保留其中所有字段）"""
+        if not line.endswith("\n"):
+            line += "\n"
+        with self._lock:
+            if self._handle is None:
+                output_dir = os.path.dirname(self.path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                self._handle = open(self.path, self._mode, encoding="utf-8")
+            self._handle.write(line)
+            self.reasons[reason] += 1
+
+    def close(self):
+        """关闭文件并输出失败统计"""
+        with self._lock:
+            if self._handle:
+                self._handle.close()
+                self._handle = None
+        if self.reasons:
+            logger.warning(f"失败行数: {sum(self.reasons.values())}，已写入死信文件: {self.path}，"
+                           f"原因分布: {dict(self.reasons)}")
+
+
+def default_resume_path(dead_letter_path: str) -> str:
+    """断点文件路径：死信文件旁的 <名称>.resume.json"""
+    base = dead_letter_path[:-len('.jsonl')] if dead_letter_path.lower().endswith('.jsonl') else dead_letter_path
+    return base + '.resume.json'
+
+
+def write_resume_point(path: str, files: List[Dict]):
+    """记录因到达运行截止时间而未读完的输入的断点
+
+    Args:
+        path: 断点文件路径
+        files: 每个输入文件的 {"input_path", "output_path", "rows_done", "complete"}，
+            rows_done为已读取的行数（这些行已写入输出文件或死信文件），complete表示该文件已读完
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"reason": REASON_DEADLINE, "files": files}, f, ensure_ascii=False, indent=2)
+
+
+def read_resume_point(path: str) -> Dict[str, Dict]:
+    """读取断点文件
+
+    Returns:
+        输入文件路径 -> 该文件的断点记录
+    """
+    with open(path, encoding="utf-8") as f:
+        return {entry["input_path"]: entry for entry in json.load(f)["files"]}
+
+
+def iter_dead_letter_lines(path: str) -> Iterator[Tuple[Dict, bytes]]:
+    """读取死信文件，跳过无法解析的行
+
+    Yields:
+        (死信记录, 该行的原始内容)
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                yield json.loads(line), line
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_dead_letters(path: str) -> Iterator[Tuple[Dict, int]]:
+    """读取死信文件
+
+    Yields:
+        (死信记录, 该行的原始字节数)
+    """
+    for record, line in iter_dead_letter_lines(path):
+        yield record, len(line)
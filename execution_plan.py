@@ -0,0 +1,221 @@
+import logging
+from operator import itemgetter
+from string import Formatter
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from prompt import all_prompt_dict
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnGetter:
+    """按顺序取出一行数据中的若干列，总是返回元组（可被pickle，用于多进程）"""
+
+    __slots__ = ("columns", "_get")
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = tuple(columns)
+        self._get = itemgetter(*self.columns) if self.columns else None
+
+    def __call__(self, data_row: Dict) -> tuple:
+        if self._get is None:
+            return ()
+        values = self._get(data_row)
+        return values if len(self.columns) > 1 else (values,)
+
+    def __reduce__(self):
+        return ColumnGetter, (self.columns,)
+
+
+class PromptNode(NamedTuple):
+    """执行计划中的一个prompt节点
+
+    Attributes:
+        prompt_key: prompt模板键名
+        template: prompt模板
+        input_columns: 按模板占位符顺序排列的输入列
+        get_inputs: 从数据行中取出输入列值的函数
+        outputs: (输出解析器, 输出列) 元组
+        prompt_column: 保存渲染后prompt的列，None表示不保存
+        retry_on_reject: 为True时输出解析器返回None也会重试（多prompt一一对应模式）；
+            否则只在LLM未返回有效响应时重试，同一响应交给所有输出解析器处理
+        depends_on: 上游prompt节点，其输出列是本节点的输入列
+        upstream_columns: 由上游节点产出的输入列
+    """
+    prompt_key: str
+    template: str
+    input_columns: Tuple[str, ...]
+    get_inputs: ColumnGetter
+    outputs: Tuple[Tuple[Callable[[str], Any], str], ...]
+    prompt_column: Optional[str]
+    retry_on_reject: bool
+    depends_on: Tuple[str, ...] = ()
+    upstream_columns: FrozenSet[str] = frozenset()
+
+
+class ExecutionPlan(NamedTuple):
+    """一次运行的执行计划：按依赖关系拓扑排序的prompt节点"""
+    nodes: Tuple[PromptNode, ...]
+
+    @property
+    def prompt_keys(self) -> List[str]:
+        return [node.prompt_key for node in self.nodes]
+
+    @property
+    def output_columns(self) -> List[str]:
+        return [column for node in self.nodes for _, column in node.outputs]
+
+    @property
+    def source_columns(self) -> List[str]:
+        """需要从输入数据中读取的列（不由任何节点产出的输入列）"""
+        columns = []
+        for node in self.nodes:
+            for column in node.input_columns:
+                if column not in node.upstream_columns and column not in columns:
+                    columns.append(column)
+        return columns
+
+
+def count_placeholders(prompt_key: str, template: str) -> int:
+    """校验模板占位符并返回位置参数个数
+
+    模板只能使用 {0}、{1} 这样的位置占位符（或 {}），其余大括号必须用 {{ }} 转义。
+    """
+    indexes = set()
+    auto = 0
+    try:
+        fields = [field for _, field, _, _ in Formatter().parse(template) if field is not None]
+    except ValueError as e:
+        raise ValueError(f"prompt模板'{prompt_key}'格式错误（大括号需要用{{{{ }}}}转义）: {e}")
+    for field in fields:
+        name = field.split('.')[0].split('[')[0]
+        if name == '':
+            indexes.add(auto)
+            auto += 1
+        elif name.isdigit():
+            indexes.add(int(name))
+        else:
+            raise ValueError(f"prompt模板'{prompt_key}'包含未转义的大括号 {{{field}}}，请使用{{{{ }}}}转义")
+    if indexes and indexes != set(range(max(indexes) + 1)):
+        raise ValueError(f"prompt模板'{prompt_key}'的占位符不连续: {sorted(indexes)}")
+    return len(indexes)
+
+
+def compile_plan(
+    prompt_keys: List[str],
+    response_processors: Union[List[Callable[[str], Any]], List[List[Callable[[str], Any]]]],
+    output_columns: Union[List[str], List[List[str]]],
+    input_columns: List[str],
+    output_prompt_columns: Optional[List[str]] = None,
+    grouped: bool = False,
+    prompt_input_columns: Optional[List[List[str]]] = None,
+) -> ExecutionPlan:
+    """将四种工作模式的配置编译为执行计划，并在启动时完成所有配置校验
+
+    Args:
+        prompt_keys: prompt模板键名列表
+        response_processors: 输出解析器列表；分组模式下为每个prompt一组
+        output_columns: 输出列列表；分组模式下为每个prompt一组
+        input_columns: 输入列名列表，按模板占位符顺序填充
+        output_prompt_columns: 保存渲染后prompt的列，可选
+        grouped: 是否为分组模式
+        prompt_input_columns: 每个prompt各自的输入列，为None时所有prompt都使用input_columns。
+            某个prompt的输入列是其他prompt的输出列时，该prompt作为下游阶段在上游完成后执行
+
+    Returns:
+        不可变的执行计划
+    """
+    output_prompt_columns = output_prompt_columns or []
+
+    for pk in prompt_keys:
+        if pk not in all_prompt_dict:
+            raise ValueError(f"prompt_key '{pk}' 不存在于all_prompt_dict中")
+
+    if grouped:
+        # 模式四：每个prompt一组输出解析器和输出列
+        if len(response_processors) != len(prompt_keys):
+            raise ValueError(f"分组模式下，RESPONSE_PROCESSOR分组数量({len(response_processors)})必须与PROMPT_KEY数量({len(prompt_keys)})相同")
+        if len(output_columns) != len(prompt_keys):
+            raise ValueError(f"分组模式下，OUTPUT_COLUMN分组数量({len(output_columns)})必须与PROMPT_KEY数量({len(prompt_keys)})相同")
+        for i, (proc_group, col_group) in enumerate(zip(response_processors, output_columns)):
+            if len(proc_group) != len(col_group):
+                raise ValueError(f"第{i+1}组中，RESPONSE_PROCESSOR数量({len(proc_group)})与OUTPUT_COLUMN数量({len(col_group)})必须相同")
+        groups = [list(zip(procs, cols)) for procs, cols in zip(response_processors, output_columns)]
+        retry_on_reject = False
+    elif len(prompt_keys) == 1:
+        # 模式一、二：单个prompt，同一响应交给多个输出解析器
+        if len(output_prompt_columns) > 1:
+            raise ValueError(f"单个PROMPT_KEY时，OUTPUT_PROMPT_COLUMN数量({len(output_prompt_columns)})必须为None或1个")
+        if len(response_processors) != len(output_columns):
+            raise ValueError(f"单个PROMPT_KEY时，RESPONSE_PROCESSOR数量({len(response_processors)})必须与OUTPUT_COLUMN数量({len(output_columns)})相同")
+        groups = [list(zip(response_processors, output_columns))]
+        retry_on_reject = False
+    else:
+        # 模式三：多个prompt与输出解析器、输出列一一对应
+        if len(prompt_keys) != len(output_columns):
+            raise ValueError(f"多个PROMPT_KEY时，PROMPT_KEY数量({len(prompt_keys)})与OUTPUT_COLUMN数量({len(output_columns)})必须一致")
+        if output_prompt_columns and len(prompt_keys) != len(output_prompt_columns):
+            raise ValueError(f"多个PROMPT_KEY时，PROMPT_KEY数量({len(prompt_keys)})与OUTPUT_PROMPT_COLUMN数量({len(output_prompt_columns)})必须一致")
+        if len(response_processors) != 1 and len(response_processors) != len(prompt_keys):
+            raise ValueError(f"多个PROMPT_KEY时，RESPONSE_PROCESSOR数量({len(response_processors)})必须为1个或与PROMPT_KEY数量({len(prompt_keys)})相同")
+        if len(response_processors) == 1:
+            # 单个处理器，复制到所有prompt
+            response_processors = list(response_processors) * len(prompt_keys)
+        groups = [[(proc, col)] for proc, col in zip(response_processors, output_columns)]
+        retry_on_reject = True
+
+    if prompt_input_columns is None:
+        prompt_input_columns = [input_columns] * len(prompt_keys)
+    elif len(prompt_input_columns) != len(prompt_keys):
+        raise ValueError(f"PROMPT_INPUT_COLUMNS分组数量({len(prompt_input_columns)})必须与PROMPT_KEY数量({len(prompt_keys)})相同")
+
+    # 每个输出列由哪个prompt产出
+    producers = {}
+    for idx, outputs in enumerate(groups):
+        for _, column in outputs:
+            producers.setdefault(column, idx)
+
+    nodes = []
+    for idx, (prompt_key, outputs, columns) in enumerate(zip(prompt_keys, groups, prompt_input_columns)):
+        template, num_expected_vals = all_prompt_dict[prompt_key]
+        num_placeholders = count_placeholders(prompt_key, template)
+        if num_placeholders != num_expected_vals:
+            raise ValueError(f"prompt模板'{prompt_key}'有{num_placeholders}个占位符，但all_prompt_dict中声明需要{num_expected_vals}个字段")
+        if num_expected_vals != len(columns):
+            raise ValueError(f"prompt模板'{prompt_key}'需要{num_expected_vals}个字段，但输入列有{len(columns)}个: {columns}")
+
+        upstream = sorted({producers[col] for col in columns if col in producers})
+        nodes.append(PromptNode(
+            prompt_key=prompt_key,
+            template=template,
+            input_columns=tuple(columns),
+            get_inputs=ColumnGetter(columns),
+            outputs=tuple(outputs),
+            prompt_column=output_prompt_columns[idx] if idx < len(output_prompt_columns) else None,
+            retry_on_reject=retry_on_reject,
+            depends_on=tuple(prompt_keys[i] for i in upstream),
+            upstream_columns=frozenset(col for col in columns if col in producers),
+        ))
+
+    plan = ExecutionPlan(_topological_sort(nodes))
+    for node in plan.nodes:
+        logger.info(f"执行计划: {node.prompt_key}{list(node.input_columns)} -> "
+                    f"{[(proc.__name__, col) for proc, col in node.outputs]}"
+                    + (f"，依赖: {list(node.depends_on)}" if node.depends_on else ""))
+    return plan
+
+
+def _topological_sort(nodes: List[PromptNode]) -> Tuple[PromptNode, ...]:
+    """按依赖关系排序，没有依赖关系的节点保持配置中的顺序；存在循环依赖时报错"""
+    remaining = list(nodes)
+    done = set()
+    ordered = []
+    while remaining:
+        ready = [node for node in remaining if all(dep in done for dep in node.depends_on)]
+        if not ready:
+            raise ValueError(f"prompt之间存在循环依赖: {[node.prompt_key for node in remaining]}")
+        for node in ready:
+            ordered.append(node)
+            done.add(node.prompt_key)
+            remaining.remove(node)
+    return tuple(ordered)
@@ -0,0 +1,108 @@
+import os
+import logging
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class FileTask:
+    """单个输入文件的处理任务，负责对应输出文件的打开、写入与收尾
+
+    输入输出为同一文件时先写入临时文件，全部完成后再替换原文件。
+
+    Args:
+        input_path: 输入文件路径
+        output_path: 输出文件路径
+    """
+
+    def __init__(self, input_path: str, output_path: str):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.in_place = os.path.abspath(input_path) == os.path.abspath(output_path)
+        self.actual_output = output_path + '.tmp' if self.in_place else output_path
+        self.handle = None
+        self.pending = 0
+        self.rows_read = 0
+        # 从断点继续时追加到已有的输出文件
+        self.append = False
+        self.exhausted = False
+        self.finished = False
+
+    def open(self):
+        """打开输出文件（已存在的输出文件会被覆盖，避免重复追加；从断点继续时追加）"""
+        output_dir = os.path.dirname(self.actual_output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.handle = open(self.actual_output, "a" if self.append else "w", encoding="utf-8")
+
+    def finish_if_done(self):
+        """输入已读完且没有在途行时，关闭输出文件并完成替换"""
+        if self.exhausted and self.pending == 0 and not self.finished:
+            self.finish()
+
+    def finish(self):
+        """关闭输出文件，输入输出为同一文件时替换原文件"""
+        self.finished = True
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+        if self.in_place and os.path.isfile(self.actual_output):
+            os.replace(self.actual_output, self.output_path)
+        logger.info(f"文件处理完成: {self.output_path}")
+
+    def abort(self):
+        """异常退出时关闭输出文件，不替换原文件"""
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+
+def interleave_rows(
+    tasks: List[FileTask],
+    read_rows: Callable[[str], Iterable[Tuple[dict, int]]],
+    max_open_files: int = 8,
+    max_rows: Optional[int] = None,
+) -> Iterator[Tuple[dict, int, FileTask]]:
+    """轮流从多个文件中读取数据行，使多个文件的数据共享同一个线程池
+
+    同时打开的输入文件不超过max_open_files个，某个文件读完后再打开下一个。
+
+    Args:
+        tasks: 文件任务列表
+        read_rows: 读取单个文件的函数，返回 (数据字典, 原始字节数) 的迭代器
+        max_open_files: 同时读取的文件数
+        max_rows: 所有文件合计的最大处理行数，None表示处理所有行
+
+    Yields:
+        (数据字典, 原始字节数, 所属文件任务)
+    """
+    waiting = deque(tasks)
+    active = deque()
+    emitted = 0
+
+    while waiting or active:
+        if max_rows is not None and emitted >= max_rows:
+            # 达到行数限制，剩余文件不再读取
+            for task, _ in active:
+                task.exhausted = True
+                task.finish_if_done()
+            return
+
+        while waiting and len(active) < max_open_files:
+            task = waiting.popleft()
+            task.open()
+            active.append((task, iter(read_rows(task.input_path))))
+
+        task, rows = active.popleft()
+        item = next(rows, None)
+        if item is None:
+            task.exhausted = True
+            task.finish_if_done()
+            continue
+
+        task.pending += 1
+        task.rows_read += 1
+        emitted += 1
+        yield item[0], item[1], task
+        active.append((task, rows))
@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import httpx
+from openai import DefaultHttpxClient, Timeout
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: list, pct: float) -> float:
+    """计算百分位数（values需已排序）"""
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+class HttpTimingStats:
+    """HTTP请求耗时统计
+
+    利用httpcore的trace扩展，将一次请求的耗时拆分为：
+        pool_wait: 从发起请求到拿到连接的等待时间（连接池排队）
+        connect: 新建连接耗时（TCP/TLS握手，复用连接时为0）
+        server: 从发送请求头到收到响应头的时间（服务端处理耗时）
+
+    Args:
+        max_samples: 每项指标最多保留的样本数，用于计算百分位数
+    """
+
+    def __init__(self, max_samples: int = 100000):
+        self._lock = threading.Lock()
+        self._samples = {name: deque(maxlen=max_samples) for name in ("pool_wait", "connect", "server")}
+        self.new_connections = 0
+        self.requests = 0
+
+    def on_request(self, request: httpx.Request):
+        """httpx请求钩子：为每个请求挂载trace回调"""
+        start = time.perf_counter()
+        marks = {}
+
+        def trace(event_name: str, info: Dict):
+            now = time.perf_counter()
+            # 拿到连接后的第一个事件（新建连接或直接发送请求头）即为池等待结束
+            if "acquired" not in marks and event_name.endswith(".started"):
+                marks["acquired"] = now
+            if event_name == "connection.connect_tcp.started":
+                marks["connect"] = now
+            elif event_name.endswith("send_request_headers.started"):
+                marks["send"] = now
+            elif event_name.endswith("receive_response_headers.complete") and "send" in marks:
+                self._record(start, marks, now)
+
+        request.extensions = {**request.extensions, "trace": trace}
+
+    def _record(self, start: float, marks: Dict, done: float):
+        with self._lock:
+            self.requests += 1
+            self._samples["pool_wait"].append(marks["acquired"] - start)
+            if "connect" in marks:
+                self.new_connections += 1
+                self._samples["connect"].append(marks["send"] - marks["connect"])
+            else:
+                self._samples["connect"].append(0.0)
+            self._samples["server"].append(done - marks["send"])
+
+    def summary(self) -> Dict:
+        """返回各项耗时的均值/p50/p99（秒）"""
+        with self._lock:
+            result = {"requests": self.requests, "new_connections": self.new_connections}
+            for name, samples in self._samples.items():
+                values = sorted(samples)
+                result[name] = {
+                    "mean": sum(values) / len(values) if values else 0.0,
+                    "p50": percentile(values, 50),
+                    "p99": percentile(values, 99),
+                }
+            return result
+
+    def log_summary(self):
+        """将耗时统计写入日志"""
+        stats = self.summary()
+        if not stats["requests"]:
+            return
+        logger.info(f"HTTP请求数: {stats['requests']}，新建连接数: {stats['new_connections']}")
+        for name, label in (("pool_wait", "连接池等待"), ("connect", "建连耗时"), ("server", "服务端耗时")):
+            s = stats[name]
+            logger.info(f"{label}: mean={s['mean']:.3f}s p50={s['p50']:.3f}s p99={s['p99']:.3f}s")
+
+
+def build_http_client(http_config: Optional[Dict], default_pool_size: int,
+                      stats: Optional[HttpTimingStats] = None) -> DefaultHttpxClient:
+    """根据配置构建httpx客户端
+
+    Args:
+        http_config: HTTP连接配置，支持的键：
+            max_connections: 连接池大小，默认与并发数相同
+            max_keepalive_connections: 保持长连接的最大数量，默认与连接池大小相同
+            keepalive_expiry: 空闲长连接的过期时间（秒）
+            connect_timeout: 建连超时（秒）
+            read_timeout: 读超时（秒）
+            http2: 是否开启HTTP/2多路复用
+        default_pool_size: 未配置连接池大小时使用的默认值（通常为最大并发线程数）
+        stats: 可选的耗时统计对象
+
+    Returns:
+        配置好的httpx客户端
+    """
+    http_config = http_config or {}
+    max_connections = http_config.get("max_connections") or default_pool_size
+    max_keepalive = http_config.get("max_keepalive_connections") or max_connections
+    read_timeout = http_config.get("read_timeout", 600.0)
+
+    http2 = bool(http_config.get("http2", False))
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("未安装h2库，无法开启HTTP/2，回退到HTTP/1.1（pip install httpx[http2]）")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=http_config.get("keepalive_expiry", 60.0),
+    )
+    timeout = Timeout(read_timeout, connect=http_config.get("connect_timeout", 10.0))
+
+    logger.info(f"HTTP连接池: max_connections={max_connections}, keepalive={max_keepalive}, "
+                f"keepalive_expiry={limits.keepalive_expiry}s, http2={http2}")
+
+    event_hooks = {"request": [stats.on_request]} if stats else None
+    return DefaultHttpxClient(limits=limits, timeout=timeout, http2=http2, event_hooks=event_hooks)
@@ -0,0 +1,352 @@
+import json
+import time
+import logging
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from openai import OpenAI
+
+from http_transport import HttpTimingStats, build_http_client
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class _Share:
+    """单个任务在全局限流器中的份额"""
+
+    __slots__ = ("weight", "priority", "seq", "vtime", "waiting", "tickets", "in_flight", "granted", "cond")
+
+    def __init__(self, weight: float, priority: int, seq: int, cond: threading.Condition):
+        self.weight = weight
+        self.priority = priority
+        self.seq = seq
+        self.vtime = 0.0
+        self.waiting = 0      # 等待分配的请求数
+        self.tickets = 0      # 已分配但等待线程尚未取走的名额
+        self.in_flight = 0
+        self.granted = 0
+        self.cond = cond
+
+
+class _Gate:
+    """单个任务的请求入口，用作ChatLLM的request_gate"""
+
+    def __init__(self, limiter: "FairShareLimiter", job_id: str):
+        self._limiter = limiter
+        self._job_id = job_id
+
+    def __enter__(self):
+        self._limiter.acquire(self._job_id)
+        return self
+
+    def __exit__(self, *exc):
+        self._limiter.release(self._job_id)
+        return False
+
+
+class FairShareLimiter:
+    """所有任务共享的请求并发限制
+
+    同时在途的请求不超过max_concurrency。有空闲名额时，先在优先级最高的任务之间分配，
+    同一优先级内按加权公平排队（WFQ）：每个任务有一个虚拟时间，每获得一个名额增加1/weight，
+    总是分配给虚拟时间最小的任务，因此长期来看各任务获得的请求数与weight成正比。
+    空闲后重新开始排队的任务，虚拟时间从当前的虚拟时钟开始，不会因空闲积累额度。
+
+    Args:
+        max_concurrency: 全局同时在途的请求数
+    """
+
+    def __init__(self, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError(f"SERVE_MAX_CONCURRENCY必须大于0: {max_concurrency}")
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._shares: Dict[str, _Share] = {}
+        self._seq = itertools.count()
+        self._vclock = 0.0
+
+    def register(self, job_id: str, weight: float = 1.0, priority: int = 0):
+        """登记任务，weight越大获得的请求份额越多，priority高的任务优先"""
+        if weight <= 0:
+            raise ValueError(f"weight必须大于0: {weight}")
+        with self._lock:
+            self._shares[job_id] = _Share(weight, priority, next(self._seq), threading.Condition(self._lock))
+
+    def unregister(self, job_id: str):
+        with self._lock:
+            self._shares.pop(job_id, None)
+
+    def gate(self, job_id: str) -> _Gate:
+        """该任务的请求入口（上下文管理器）"""
+        return _Gate(self, job_id)
+
+    def acquire(self, job_id: str):
+        """等待直到该任务获得一个请求名额"""
+        with self._lock:
+            share = self._shares[job_id]
+            if share.waiting == 0 and share.in_flight == 0:
+                share.vtime = max(share.vtime, self._vclock)
+            share.waiting += 1
+            self._dispatch()
+            while share.tickets == 0:
+                share.cond.wait()
+            share.tickets -= 1
+
+    def release(self, job_id: str):
+        """请求完成，归还名额"""
+        with self._lock:
+            share = self._shares.get(job_id)
+            if share is not None:
+                share.in_flight -= 1
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """把空闲名额分配给等待中的任务（调用时已持有锁）"""
+        while self.in_flight < self.max_concurrency:
+            candidates = [s for s in self._shares.values() if s.waiting > 0]
+            if not candidates:
+                return
+            share = min(candidates, key=lambda s: (-s.priority, s.vtime, s.seq))
+            self._vclock = share.vtime
+            share.vtime += 1.0 / share.weight
+            share.waiting -= 1
+            share.tickets += 1
+            share.in_flight += 1
+            share.granted += 1
+            self.in_flight += 1
+            share.cond.notify()
+
+    def stats(self, job_id: str) -> Dict[str, int]:
+        """该任务的请求统计"""
+        with self._lock:
+            share = self._shares.get(job_id)
+            if share is None:
+                return {}
+            return {"requests": share.granted, "in_flight": share.in_flight, "waiting": share.waiting}
+
+
+class Job:
+    """常驻服务中的一个任务"""
+
+    def __init__(self, job_id: str, config: Dict[str, Any], weight: float, priority: int):
+        self.job_id = job_id
+        self.config = config
+        self.weight = weight
+        self.priority = priority
+        self.state = JOB_QUEUED
+        self.error: Optional[str] = None
+        self.chat_llm = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 任务结束时从限流器中注销前的请求统计
+        self.final_stats: Optional[Dict[str, int]] = None
+
+    def to_dict(self, limiter: FairShareLimiter) -> Dict[str, Any]:
+        progress = self.chat_llm.progress if self.chat_llm is not None else None
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "weight": self.weight,
+            "priority": self.priority,
+            "input_path": self.config.get("INPUT_PATH"),
+            "output_path": self.config.get("OUTPUT_PATH"),
+            "rows_done": progress.n if progress is not None else 0,
+            "rows_total": progress.total if progress is not None else None,
+            "elapsed": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "error": self.error,
+            **(self.final_stats if self.final_stats is not None else limiter.stats(self.job_id)),
+        }
+
+
+class JobServer:
+    """常驻的任务服务
+
+    接收与.env配置等价的任务描述，所有任务共享按 (LLM_URL, API_KEY) 复用的OpenAI客户端（连接池保持预热），
+    每次LLM请求都经过同一个FairShareLimiter，按任务的优先级和权重分配全局并发。
+
+    Args:
+        build: 根据配置映射和ChatLLM参数创建ChatLLM的函数（main.init_chat_llm）
+        run: 按配置运行任务的函数（main.run_job）
+        max_concurrency: 所有任务合计同时在途的请求数
+        http_config: 共享客户端的HTTP连接配置
+    """
+
+    def __init__(self, build: Callable[..., Any], run: Callable[[Any, Mapping[str, Any]], None],
+                 max_concurrency: int = 512, http_config: Optional[Dict] = None):
+        self.build = build
+        self.run = run
+        self.max_concurrency = max_concurrency
+        self.http_config = http_config or {}
+        self.limiter = FairShareLimiter(max_concurrency)
+        self.jobs: Dict[str, Job] = {}
+        self._clients: Dict[Tuple[str, str], Tuple[OpenAI, HttpTimingStats]] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._httpd: Optional[ThreadingHTTPServer] = None
+
+    def _client(self, llm_url: str, api_key: str) -> OpenAI:
+        """获取共享客户端，同一服务地址的任务共用连接池"""
+        with self._lock:
+            key = (llm_url, api_key)
+            if key not in self._clients:
+                stats = HttpTimingStats()
+                http_client = build_http_client(self.http_config, self.max_concurrency, stats)
+                client = OpenAI(base_url=llm_url, api_key=api_key, http_client=http_client)
+                self._clients[key] = (client, stats)
+                logger.info(f"创建共享客户端: {llm_url}")
+            return self._clients[key][0]
+
+    def submit(self, spec: Mapping[str, Any]) -> Job:
+        """提交任务
+
+        Args:
+            spec: {"config": 与.env相同键的配置, "weight": 权重, "priority": 优先级}
+
+        Returns:
+            已开始运行的任务，配置有误时抛出ValueError
+        """
+        config = dict(spec.get("config") or {})
+        if not config.get("LLM_URL"):
+            raise ValueError("任务配置缺少LLM_URL")
+        # 任务自身的线程数默认与全局并发相同，实际并发由全局限流器控制
+        config.setdefault("MAX_THREAD_NUM", self.max_concurrency)
+        weight = float(spec.get("weight", 1.0))
+        priority = int(spec.get("priority", 0))
+
+        with self._lock:
+            job_id = f"job-{next(self._ids)}"
+        job = Job(job_id, config, weight, priority)
+        self.limiter.register(job_id, weight, priority)
+        try:
+            job.chat_llm = self.build(
+                config,
+                client=self._client(config["LLM_URL"], str(config.get("API_KEY", "test"))),
+                request_gate=self.limiter.gate(job_id),
+            )
+        except Exception:
+            self.limiter.unregister(job_id)
+            raise
+        with self._lock:
+            self.jobs[job_id] = job
+        threading.Thread(target=self._run_job, args=(job,), name=job_id, daemon=True).start()
+        logger.info(f"任务已提交: {job_id}（权重{weight}，优先级{priority}）{config.get('INPUT_PATH')}")
+        return job
+
+    def _run_job(self, job: Job):
+        job.state = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            self.run(job.chat_llm, job.config)
+            job.state = JOB_DONE
+        except Exception as e:
+            logger.error(f"任务{job.job_id}失败: {e}", exc_info=True)
+            job.state = JOB_FAILED
+            job.error = str(e)
+        finally:
+            job.chat_llm.close()
+            job.final_stats = self.limiter.stats(job.job_id)
+            self.limiter.unregister(job.job_id)
+            job.finished_at = time.time()
+            logger.info(f"任务{job.job_id}结束: {job.state}，用时{job.finished_at - job.started_at:.2f}秒")
+
+    def status(self, job_id: Optional[str] = None):
+        """单个任务或全部任务的状态"""
+        if job_id is not None:
+            job = self.jobs.get(job_id)
+            return job.to_dict(self.limiter) if job else None
+        return [job.to_dict(self.limiter) for job in list(self.jobs.values())]
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """等待任务结束，返回是否已结束"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        job = self.jobs[job_id]
+        while job.finished_at is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8765, block: bool = True) -> ThreadingHTTPServer:
+        """启动HTTP接口
+
+            POST /jobs          提交任务，返回任务状态
+            GET  /jobs          全部任务的状态
+            GET  /jobs/<job_id> 单个任务的状态和进度
+        """
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        logger.info(f"任务服务已启动: http://{host}:{self._httpd.server_address[1]}，全局并发{self.max_concurrency}")
+        if block:
+            try:
+                self._httpd.serve_forever()
+            finally:
+                self.shutdown()
+        else:
+            threading.Thread(target=self._httpd.serve_forever, name="job-server", daemon=True).start()
+        return self._httpd
+
+    def shutdown(self):
+        """停止HTTP接口并输出共享连接的统计"""
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        for client, stats in self._clients.values():
+            stats.log_summary()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send(self, status: int, payload: Any):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                parts = [p for p in self.path.split("/") if p]
+                if parts == ["jobs"]:
+                    self._send(200, server.status())
+                elif len(parts) == 2 and parts[0] == "jobs":
+                    status = server.status(parts[1])
+                    self._send(200, status) if status else self._send(404, {"error": f"任务不存在: {parts[1]}"})
+                else:
+                    self._send(404, {"error": f"未知路径: {self.path}"})
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/jobs":
+                    self._send(404, {"error": f"未知路径: {self.path}"})
+                    return
+                try:
+                    spec = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    job = server.submit(spec)
+                except (ValueError, KeyError, AttributeError, TypeError) as e:
+                    # 请求体或任务配置有误
+                    self._send(400, {"error": str(e)})
+                    return
+                except Exception as e:
+                    logger.error(f"提交任务失败: {e}", exc_info=True)
+                    self._send(500, {"error": f"提交任务失败: {e}"})
+                    return
+                self._send(201, job.to_dict(server.limiter))
+
+        return Handler
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from tqdm import tqdm
+
+from columnar_io import is_columnar
+from dead_letter import DeadLetterWriter
+from memory_budget import InflightBudget
+
+logger = logging.getLogger(__name__)
+
+MERGE_TASK = "merge"
+
+
+class Lease(NamedTuple):
+    """一个租约：任务（块号或merge）、代数和租约文件路径"""
+    task: str
+    generation: int
+    path: str
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseQueue:
+    """基于共享文件系统的租约工作队列，不需要协调节点
+
+    目录结构（lease_dir下）：
+        leases/<任务>.<代数>.lease  租约文件，内容为持有者信息，mtime为最近一次心跳时间
+        done/<任务>                 任务已完成的标记
+        parts/<块号>.jsonl          每个块的输出，全部完成后合并
+
+    领取任务即以O_EXCL创建下一代的租约文件，同一代只有一个节点能创建成功。
+    持有者定期更新租约文件的mtime；mtime超过ttl秒未更新的租约视为过期（持有节点已崩溃），
+    其他节点创建下一代租约接管该任务，原持有者发现出现更新的代数后放弃该任务。
+    各节点的时钟需要同步（NTP），ttl应远大于时钟误差。
+
+    Args:
+        lease_dir: 共享目录
+        worker_id: 本节点的标识
+        ttl: 租约过期时间（秒）
+    """
+
+    def __init__(self, lease_dir: str, worker_id: Optional[str] = None, ttl: float = 60.0):
+        self.lease_dir = lease_dir
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.leases_dir = os.path.join(lease_dir, "leases")
+        self.done_dir = os.path.join(lease_dir, "done")
+        self.parts_dir = os.path.join(lease_dir, "parts")
+        for path in (self.leases_dir, self.done_dir, self.parts_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def _lease_path(self, task: str, generation: int) -> str:
+        return os.path.join(self.leases_dir, f"{task}.{generation}.lease")
+
+    def _latest_generation(self, task: str) -> Optional[int]:
+        prefix = f"{task}."
+        generations = [int(name[len(prefix):-len(".lease")]) for name in os.listdir(self.leases_dir)
+                       if name.startswith(prefix) and name.endswith(".lease")]
+        return max(generations) if generations else None
+
+    def is_done(self, task: str) -> bool:
+        return os.path.exists(os.path.join(self.done_dir, task))
+
+    def mark_done(self, task: str):
+        with open(os.path.join(self.done_dir, task), "w", encoding="utf-8") as f:
+            f.write(self.worker_id)
+
+    def try_claim(self, task: str) -> Optional[Lease]:
+        """尝试领取任务，任务已完成或被其他节点持有（租约未过期）时返回None"""
+        if self.is_done(task):
+            return None
+        generation = self._latest_generation(task)
+        if generation is None:
+            generation = 0
+        else:
+            try:
+                age = time.time() - os.stat(self._lease_path(task, generation)).st_mtime
+            except FileNotFoundError:
+                # 持有者刚完成并删除了租约
+                age = None
+            if age is not None and age < self.ttl:
+                return None
+            if age is not None:
+                logger.warning(f"租约已过期{age:.0f}秒，接管任务{task}（第{generation + 1}代）")
+            generation += 1
+
+        path = self._lease_path(task, generation)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"worker": self.worker_id, "claimed_at": time.time()}, f)
+        if self.is_done(task):
+            # 领取期间其他节点完成了该任务
+            self.release(Lease(task, generation, path))
+            return None
+        return Lease(task, generation, path)
+
+    def holds(self, lease: Lease) -> bool:
+        """本节点是否仍持有该租约（没有被更新的代数接管）"""
+        latest = self._latest_generation(lease.task)
+        return latest == lease.generation and os.path.exists(lease.path)
+
+    def renew(self, lease: Lease) -> bool:
+        """心跳：更新租约的mtime，租约已被接管时返回False"""
+        if not self.holds(lease):
+            return False
+        try:
+            os.utime(lease.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, lease: Lease):
+        """释放租约（删除本代及更早代的租约文件）"""
+        for generation in range(lease.generation + 1):
+            try:
+                os.remove(self._lease_path(lease.task, generation))
+            except FileNotFoundError:
+                pass
+
+
+class _Heartbeat:
+    """在后台线程中定期续约，发现租约被接管时设置lost"""
+
+    def __init__(self, queue: LeaseQueue, lease: Lease):
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._queue = queue
+        self._lease = lease
+        self._thread = threading.Thread(target=self._run, name=f"lease-{lease.task}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self._queue.ttl / 3):
+            if not self._queue.renew(self._lease):
+                logger.warning(f"任务{self._lease.task}的租约已被其他节点接管，放弃该任务")
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def chunk_offsets(input_path: str, chunk_rows: int, lease_dir: str, max_rows: Optional[int] = None) -> List[int]:
+    """每个块起始行的字节偏移，按chunk_rows行切分输入文件的前max_rows行
+
+    第一个节点扫描输入文件后将结果写入lease_dir/index.json，其他节点直接读取。
+    """
+    index_path = os.path.join(lease_dir, "index.json")
+    size = os.path.getsize(input_path)
+    if os.path.isfile(index_path):
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index["chunk_rows"] == chunk_rows and index["size"] == size and index.get("max_rows") == max_rows:
+            return index["offsets"]
+        raise ValueError(f"{index_path}与当前输入文件、LEASE_CHUNK_ROWS或MAX_ROWS不一致，请使用新的LEASE_DIR")
+
+    offsets = []
+    position = 0
+    with open(input_path, "rb") as f:
+        for line_no, line in enumerate(f):
+            if max_rows is not None and line_no >= max_rows:
+                break
+            if line_no % chunk_rows == 0:
+                offsets.append(position)
+            position += len(line)
+    temp_path = f"{index_path}.{default_worker_id()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"input_path": input_path, "size": size, "chunk_rows": chunk_rows, "max_rows": max_rows,
+                   "offsets": offsets}, f)
+    os.replace(temp_path, index_path)
+    return offsets
+
+
+def _iter_chunk(input_path: str, offset: int, chunk_rows: int, lost: threading.Event) -> Iterator[Tuple[Dict, int]]:
+    """从offset开始读取chunk_rows行，租约被接管时停止读取"""
+    with open(input_path, "rb") as f:
+        f.seek(offset)
+        for _ in range(chunk_rows):
+            line = f.readline()
+            if not line or lost.is_set():
+                return
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield data, len(line)
+
+
+def _part_path(queue: LeaseQueue, chunk: int) -> str:
+    return os.path.join(queue.parts_dir, f"{chunk:08d}.jsonl")
+
+
+def _process_chunk(chat_llm, queue: LeaseQueue, lease: Lease, chunk: int, offset: int, chunk_rows: int) -> bool:
+    """处理一个块，完成后原子地提交该块的输出和死信
+
+    Returns:
+        是否到达运行截止时间：此时该块未读完，丢弃已处理的部分并释放租约，由之后的运行重新领取
+    """
+    config = chat_llm.dataset_config
+    part_path = _part_path(queue, chunk)
+    temp_output = f"{part_path}.{queue.worker_id}.tmp"
+    temp_dead_letter = f"{part_path}.dead_letter.{queue.worker_id}.tmp"
+    logger.info(f"[{queue.worker_id}] 开始处理块{chunk}（第{lease.generation}代租约）")
+
+    for path in (temp_output, temp_dead_letter):
+        if os.path.exists(path):
+            os.remove(path)
+    chat_llm.dead_letter_writer = DeadLetterWriter(temp_dead_letter)
+    pbar = tqdm(desc=f"chunk-{chunk}", total=chunk_rows, ncols=150)
+    chat_llm.progress = pbar
+    stopped = []
+    try:
+        with _Heartbeat(queue, lease) as heartbeat:
+            rows = _iter_chunk(config.input_path, offset, chunk_rows, heartbeat.lost)
+            chat_llm.produce_data(rows, temp_output, pbar, InflightBudget(config.max_inflight_bytes),
+                                  final_output_path=config.output_path, on_deadline=lambda: stopped.append(True))
+        lost = heartbeat.lost.is_set()
+    finally:
+        pbar.close()
+        chat_llm.dead_letter_writer.close()
+        chat_llm.dead_letter_writer = None
+
+    if lost or stopped or not queue.holds(lease):
+        for path in (temp_output, temp_dead_letter):
+            if os.path.exists(path):
+                os.remove(path)
+        if stopped and queue.holds(lease):
+            logger.warning(f"[{queue.worker_id}] 已到达运行截止时间，块{chunk}未完成，释放租约")
+            queue.release(lease)
+        return bool(stopped)
+    if os.path.exists(temp_dead_letter):
+        os.replace(temp_dead_letter, f"{part_path}.dead_letter")
+    os.replace(temp_output, part_path)
+    queue.mark_done(str(chunk))
+    queue.release(lease)
+    return False
+
+
+def _merge_parts(queue: LeaseQueue, lease: Lease, num_chunks: int, output_path: str, dead_letter_path: str):
+    """按块号顺序合并所有块的输出和死信"""
+    logger.info(f"[{queue.worker_id}] 所有块已完成，合并{num_chunks}个块的输出: {output_path}")
+    for target, suffix in ((output_path, ""), (dead_letter_path, ".dead_letter")):
+        temp_path = f"{target}.{queue.worker_id}.tmp"
+        with open(temp_path, "wb") as out:
+            for chunk in range(num_chunks):
+                part = _part_path(queue, chunk) + suffix
+                if os.path.exists(part):
+                    with open(part, "rb") as f:
+                        while True:
+                            data = f.read(1 << 20)
+                            if not data:
+                                break
+                            out.write(data)
+                queue.renew(lease)
+        if suffix and os.path.getsize(temp_path) == 0:
+            # 没有失败的行，删除之前运行遗留的死信文件
+            os.remove(temp_path)
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        os.replace(temp_path, target)
+    queue.mark_done(MERGE_TASK)
+    queue.release(lease)
+
+
+def run_worker(chat_llm, lease_dir: str, chunk_rows: int = 10000, ttl: float = 60.0,
+               worker_id: Optional[str] = None, poll_interval: Optional[float] = None) -> int:
+    """以租约队列方式处理数据集，多个节点（或进程）可以对同一共享目录同时运行
+
+    输入文件（设置MAX_ROWS时为前MAX_ROWS行）按行号切分为chunk_rows行的块，
+    节点轮流领取未完成的块，处理完成的块写入lease_dir/parts。
+    其他节点持有的块都处理完之前，本节点定期检查并接管过期的租约。
+    全部块完成后，由一个节点按块号顺序合并为OUTPUT_PATH和死信文件。
+
+    Args:
+        chat_llm: ChatLLM实例
+        lease_dir: 共享目录
+        chunk_rows: 每块的行数
+        ttl: 租约过期时间（秒）
+        worker_id: 本节点的标识，默认为 主机名-进程号
+        poll_interval: 等待其他节点时的检查间隔（秒），默认为ttl的1/4
+
+    Returns:
+        本节点处理的块数
+    """
+    config = chat_llm.dataset_config
+    input_path = config.input_path
+    if not input_path or config.is_multi_file or not os.path.isfile(input_path) or is_columnar(input_path):
+        raise ValueError("租约队列模式只支持单个jsonl输入文件")
+    if chunk_rows <= 0:
+        raise ValueError(f"LEASE_CHUNK_ROWS必须大于0: {chunk_rows}")
+    max_rows = config.max_rows
+    if max_rows is not None and os.path.abspath(input_path) == os.path.abspath(config.output_path):
+        raise ValueError("当输入输出文件相同时，不能设置max_rows限制，因为这会导致原文件中未处理的数据丢失")
+    if config.raw_store_path:
+        logger.warning("租约队列模式不保存原始响应（SQLite不适合多个节点同时写入共享目录）")
+
+    queue = LeaseQueue(lease_dir, worker_id, ttl)
+    offsets = chunk_offsets(input_path, chunk_rows, lease_dir, max_rows)
+    num_chunks = len(offsets)
+    poll_interval = poll_interval or ttl / 4
+    # 不同节点从不同的块开始领取，减少争抢
+    start = sum(queue.worker_id.encode("utf-8")) % max(1, num_chunks)
+    processed = 0
+    stopped = False
+
+    while True:
+        claimed = False
+        waiting = False
+        for i in range(num_chunks):
+            chunk = (start + i) % num_chunks
+            if queue.is_done(str(chunk)):
+                continue
+            lease = queue.try_claim(str(chunk))
+            if lease is None:
+                waiting = waiting or not queue.is_done(str(chunk))
+                continue
+            claimed = True
+            # 设置MAX_ROWS时最后一块只处理到第MAX_ROWS行
+            rows = chunk_rows if max_rows is None else min(chunk_rows, max_rows - chunk * chunk_rows)
+            if _process_chunk(chat_llm, queue, lease, chunk, offsets[chunk], rows):
+                # 到达运行截止时间，不再领取新的块
+                stopped = True
+                break
+            processed += 1
+        if stopped or (not claimed and not waiting):
+            break
+        if not claimed:
+            time.sleep(poll_interval)
+
+    chat_llm.close()
+    logger.info(f"[{queue.worker_id}] 处理了{processed}个块，共{num_chunks}个块")
+    if stopped:
+        logger.warning(f"[{queue.worker_id}] 已到达运行截止时间，未完成的块由之后的运行继续处理")
+        return processed
+    if not queue.is_done(MERGE_TASK):
+        lease = queue.try_claim(MERGE_TASK)
+        if lease is not None:
+            _merge_parts(queue, lease, num_chunks, config.output_path, config.dead_letter_path)
+    return processed
@@ -2,28 +2,53 @@ import os
 import time
 import logging
 import re
+import atexit
+import argparse
 from dotenv import load_dotenv
+from autotune import parse_levels
+from async_logging import JsonFormatter, setup_async_logging
 from dataset_config import DatasetConfig
-from chat_llm import ChatLLM
+from execution_plan import compile_plan
+from chat_llm import ChatLLM, SYSTEM_PROMPT
+from memory_budget import parse_size
+from preflight import Preflight, build_token_estimator
+from scheduler import LengthAwareScheduler
+from near_dup import NearDupIndex
+from model_cascade import parse_cascade
+from job_server import JobServer
+from lease_queue import run_worker
 import response_processor
 import json
+from typing import Any, Mapping, Optional
 
 
 def setup_logging():
-    """设置日志配置"""
+    """设置日志配置
+    
+    默认经由队列异步写出日志，工作线程不会因为日志I/O阻塞，重复的警告和错误会被合并。
+    """
     log_file = os.getenv('LOG_FILE', 'log/log.txt')
     log_level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO)
     
     os.makedirs(os.path.dirname(log_file), exist_ok=True) if os.path.dirname(log_file) else None
     
-    logging.basicConfig(
-        level=log_level,
-        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+    if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    handlers = [
+        logging.FileHandler(log_file, encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    if os.getenv('LOG_ASYNC', 'true').lower() in ('1', 'true', 'yes'):
+        listener = setup_async_logging(handlers, log_level,
+                                       aggregate_window=float(os.getenv('LOG_AGGREGATE_WINDOW', 10)))
+        atexit.register(listener.stop)
+    else:
+        logging.basicConfig(level=log_level, handlers=handlers)
     
     logging.getLogger(__name__).info(f"日志初始化完成: {log_file}")
 
@@ -48,162 +73,265 @@ def parse_grouped_config(config_str):
     return groups if groups else None
 
 
-def init_chat_llm():
-    """初始化ChatLLM实例"""
+def load_settings(config: Optional[Mapping[str, Any]] = None) -> Mapping[str, str]:
+    """配置来源：未传入config时读取环境变量，否则只使用config中的配置
     
+    config的键与.env.example相同，值可以是字符串、数字或布尔值，按.env中的写法转换为字符串。
+    """
+    if config is None:
+        return os.environ
+    return {key: (str(value).lower() if isinstance(value, bool) else str(value))
+            for key, value in config.items() if value is not None}
+
+
+def build_http_config(config=None):
+    """从环境变量（或传入的配置）读取HTTP连接池配置，未设置的项使用默认值"""
+    env = load_settings(config)
+    http_config = {
+        "keepalive_expiry": float(env.get('HTTP_KEEPALIVE_EXPIRY', 60)),
+        "connect_timeout": float(env.get('HTTP_CONNECT_TIMEOUT', 10)),
+        "read_timeout": float(env.get('HTTP_READ_TIMEOUT', 600)),
+        "http2": env.get('HTTP2', 'false').lower() in ('1', 'true', 'yes'),
+        "max_retries": int(env.get('HTTP_MAX_RETRIES', 10)),
+    }
+    # 连接池大小未设置时，由ChatLLM按MAX_THREAD_NUM设置
+    if env.get('HTTP_MAX_CONNECTIONS'):
+        http_config["max_connections"] = int(env.get('HTTP_MAX_CONNECTIONS'))
+    if env.get('HTTP_MAX_KEEPALIVE'):
+        http_config["max_keepalive_connections"] = int(env.get('HTTP_MAX_KEEPALIVE'))
+    return http_config
+
+
+def build_batch_api_config(config=None):
+    """从环境变量（或传入的配置）读取batch后端配置"""
+    env = load_settings(config)
+    return {
+        "max_requests": int(env.get('BATCH_API_MAX_REQUESTS', 1000)),
+        "max_wait": float(env.get('BATCH_API_WAIT', 60)),
+        "poll_interval": float(env.get('BATCH_API_POLL_INTERVAL', 30)),
+        "completion_window": env.get('BATCH_API_COMPLETION_WINDOW', '24h'),
+    }
+
+
+def build_preflight(llm_config, config=None):
+    """从环境变量（或传入的配置）读取token预检配置"""
+    env = load_settings(config)
+    return Preflight(
+        estimator=build_token_estimator(env.get('TOKENIZER', 'char')),
+        context_length=int(env.get('MODEL_CONTEXT_LENGTH', 0)) or None,
+        max_tokens=llm_config["max_tokens"],
+        min_output_tokens=int(env.get('MIN_OUTPUT_TOKENS', 256)),
+        system_prompt=SYSTEM_PROMPT
+    )
+
+
+def build_scheduler(preflight, config=None):
+    """从环境变量（或传入的配置）读取调度配置，未开启时返回None"""
+    env = load_settings(config)
+    policy = env.get('SCHEDULE_POLICY', 'fifo').strip().lower()
+    if policy == 'fifo':
+        return None
+    return LengthAwareScheduler(
+        policy=policy,
+        window=int(env.get('SCHEDULE_WINDOW', 1000)),
+        estimator=preflight.estimator
+    )
+
+
+def build_near_dup(config=None):
+    """从环境变量（或传入的配置）读取近似重复检测配置，未开启时返回None"""
+    env = load_settings(config)
+    if env.get('NEAR_DUP', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    return NearDupIndex(
+        threshold=float(env.get('NEAR_DUP_THRESHOLD', 0.8)),
+        shingle_size=int(env.get('NEAR_DUP_SHINGLE', 5)),
+        max_entries=int(env.get('NEAR_DUP_MAX_ENTRIES', 100000))
+    )
+
+
+def init_chat_llm(config: Optional[Mapping[str, Any]] = None, **overrides):
+    """初始化ChatLLM实例
+
+    Args:
+        config: 配置映射，键与.env.example相同（如 {"LLM_URL": ..., "PROMPT_KEY": ...}），
+            未传入时读取环境变量；传入时不读取环境变量，未设置的项使用默认值
+        overrides: 直接传给ChatLLM的参数（如常驻服务传入的共享client和request_gate）
+    """
+    env = load_settings(config)
+
     # 解析多个PROMPT_KEY
-    prompt_keys = [key.strip() for key in os.getenv('PROMPT_KEY', '').split(',')]
-    output_columns_str = os.getenv('OUTPUT_COLUMN', '')
-    output_prompt_columns_str = os.getenv('OUTPUT_PROMPT_COLUMN', '')
+    prompt_keys = [key.strip() for key in env.get('PROMPT_KEY', '').split(',')]
+    output_columns_str = env.get('OUTPUT_COLUMN', '')
+    output_prompt_columns_str = env.get('OUTPUT_PROMPT_COLUMN', '')
     output_prompt_columns = [col.strip() for col in output_prompt_columns_str.split(',')] if output_prompt_columns_str else []
     
     # 解析响应处理器
-    response_processors_str = os.getenv('RESPONSE_PROCESSOR', '')
+    response_processors_str = env.get('RESPONSE_PROCESSOR', '')
     
     # 检测是否为分组模式
     grouped_response_processors = parse_grouped_config(response_processors_str)
     grouped_output_columns = parse_grouped_config(output_columns_str)
+    grouped_mode = bool(grouped_response_processors and grouped_output_columns)
     
-    # 分组模式处理
-    if grouped_response_processors and grouped_output_columns:
-        # 验证分组数量
-        if len(grouped_response_processors) != len(prompt_keys):
-            raise ValueError(f"分组模式下，RESPONSE_PROCESSOR分组数量({len(grouped_response_processors)})必须与PROMPT_KEY数量({len(prompt_keys)})相同")
-        
-        if len(grouped_output_columns) != len(prompt_keys):
-            raise ValueError(f"分组模式下，OUTPUT_COLUMN分组数量({len(grouped_output_columns)})必须与PROMPT_KEY数量({len(prompt_keys)})相同")
-        
-        # 验证每组内处理器与输出列数量相同
-        for i, (proc_group, col_group) in enumerate(zip(grouped_response_processors, grouped_output_columns)):
-            if len(proc_group) != len(col_group):
-                raise ValueError(f"第{i+1}组中，RESPONSE_PROCESSOR数量({len(proc_group)})与OUTPUT_COLUMN数量({len(col_group)})必须相同")
-        
-        # 展开分组为扁平列表，用于DatasetConfig
-        flat_output_columns = []
-        for group in grouped_output_columns:
-            flat_output_columns.extend(group)
-        
-        # 构建响应处理器函数列表
-        response_processors = []
-        for group in grouped_response_processors:
-            group_processors = [getattr(response_processor, name) for name in group]
-            response_processors.append(group_processors)
-        
-        # 数据集配置
-        dataset_config = DatasetConfig(
-            input_path=os.getenv('INPUT_PATH'),
-            output_path=os.getenv('OUTPUT_PATH'),
-            input_columns=os.getenv('INPUT_COLUMNS', '').split(','),
-            output_column=flat_output_columns,
-            output_prompt_column=output_prompt_columns if output_prompt_columns else None,
-            batch_size=int(os.getenv('BATCH_SIZE', 1000)),
-            max_rows=int(os.getenv('MAX_ROWS', 0)) or None,
-            max_thread_num=int(os.getenv('MAX_THREAD_NUM', 512))
-        )
-        
-        # LLM配置
-        llm_config = {
-            "model": os.getenv('MODEL_NAME', 'qwen'),
-            "temperature": float(os.getenv('TEMPERATURE', 0.6)),
-            "top_p": float(os.getenv("TOP_P", 0.95)),
-            "max_tokens": int(os.getenv('MAX_TOKENS', 4096)),
-            "stop": json.loads(os.getenv("STOP", '["<|endoftext|>"]'))
-        }
-        
-        # 创建ChatLLM实例（分组模式）
-        return ChatLLM(
-            llm_url=os.getenv('LLM_URL'),
-            prompt_key=prompt_keys,
-            response_processor=response_processors,
-            dataset_config=dataset_config,
-            api_key=os.getenv('API_KEY', 'test'),
-            generate_config=llm_config,
-            grouped_mode=True,
-            grouped_output_columns=grouped_output_columns
-        )
-    
-    # 原有逻辑（非分组模式）
+    if grouped_mode:
+        response_processors = [[getattr(response_processor, name) for name in group]
+                               for group in grouped_response_processors]
+        output_columns = grouped_output_columns
     else:
         output_columns = [col.strip() for col in output_columns_str.split(',')]
-        response_processor_names = [name.strip() for name in response_processors_str.split(',')]
-        
-        # 验证数量一致性 - 支持新功能
-        if len(prompt_keys) == 1:
-            # 单个prompt，支持多个输出列和多个处理器
-            # OUTPUT_PROMPT_COLUMN必须为None或者为1个
-            if output_prompt_columns and len(output_prompt_columns) != 1:
-                raise ValueError(f"单个PROMPT_KEY时，OUTPUT_PROMPT_COLUMN数量({len(output_prompt_columns)})必须为None或1个")
-            
-            # RESPONSE_PROCESSOR必须与OUTPUT_COLUMN数量相同
-            if len(response_processor_names) != len(output_columns):
-                raise ValueError(f"单个PROMPT_KEY时，RESPONSE_PROCESSOR数量({len(response_processor_names)})必须与OUTPUT_COLUMN数量({len(output_columns)})相同")
-                
-            # 多个处理器，按顺序对应
-            response_processors = [getattr(response_processor, name) for name in response_processor_names]
-                
-        else:
-            # 多个prompt，必须一一对应
-            if len(prompt_keys) != len(output_columns):
-                raise ValueError(f"多个PROMPT_KEY时，PROMPT_KEY数量({len(prompt_keys)})与OUTPUT_COLUMN数量({len(output_columns)})必须一致")
-            
-            if output_prompt_columns and len(prompt_keys) != len(output_prompt_columns):
-                raise ValueError(f"多个PROMPT_KEY时，PROMPT_KEY数量({len(prompt_keys)})与OUTPUT_PROMPT_COLUMN数量({len(output_prompt_columns)})必须一致")
-            
-            if len(response_processor_names) != 1 and len(response_processor_names) != len(prompt_keys):
-                raise ValueError(f"多个PROMPT_KEY时，RESPONSE_PROCESSOR数量({len(response_processor_names)})必须为1个或与PROMPT_KEY数量({len(prompt_keys)})相同")
-            
-            # 处理响应处理器
-            if len(response_processor_names) == 1:
-                # 单个处理器，复制到所有prompt
-                response_processors = [getattr(response_processor, response_processor_names[0])] * len(prompt_keys)
-            else:
-                # 多个处理器，按顺序对应
-                response_processors = [getattr(response_processor, name) for name in response_processor_names]
-        
-        # 数据集配置
-        dataset_config = DatasetConfig(
-            input_path=os.getenv('INPUT_PATH'),
-            output_path=os.getenv('OUTPUT_PATH'),
-            input_columns=os.getenv('INPUT_COLUMNS', '').split(','),
-            output_column=output_columns,
-            output_prompt_column=output_prompt_columns if output_prompt_columns else None,
-            batch_size=int(os.getenv('BATCH_SIZE', 1000)),
-            max_rows=int(os.getenv('MAX_ROWS', 0)) or None,
-            max_thread_num=int(os.getenv('MAX_THREAD_NUM', 512))
-        )
-        
-        # LLM配置
-        llm_config = {
-            "model": os.getenv('MODEL_NAME', 'qwen'),
-            "temperature": float(os.getenv('TEMPERATURE', 0.6)),
-            "top_p": float(os.getenv("TOP_P", 0.95)),
-            "max_tokens": int(os.getenv('MAX_TOKENS', 4096)),
-            "stop": json.loads(os.getenv("STOP", '["<|endoftext|>"]'))
-        }
-        
-        # 创建ChatLLM实例（原有模式）
-        return ChatLLM(
-            llm_url=os.getenv('LLM_URL'),
-            prompt_key=prompt_keys,
-            response_processor=response_processors,
-            dataset_config=dataset_config,
-            api_key=os.getenv('API_KEY', 'test'),
-            generate_config=llm_config
+        response_processors = [getattr(response_processor, name.strip()) for name in response_processors_str.split(',')]
+    
+    input_columns = [col.strip() for col in env.get('INPUT_COLUMNS', '').split(',') if col.strip()]
+    # 多阶段：每个prompt各自的输入列，可以引用其他prompt的输出列
+    prompt_input_columns = parse_grouped_config(env.get('PROMPT_INPUT_COLUMNS', ''))
+    
+    # 编译执行计划，四种模式的数量校验和阶段依赖的排序都在这里完成
+    plan = compile_plan(
+        prompt_keys,
+        response_processors,
+        output_columns,
+        input_columns,
+        output_prompt_columns,
+        grouped=grouped_mode,
+        prompt_input_columns=prompt_input_columns,
+    )
+    if not input_columns:
+        input_columns = plan.source_columns
+    
+    # 数据集配置
+    dataset_config = DatasetConfig(
+        input_path=env.get('INPUT_PATH'),
+        output_path=env.get('OUTPUT_PATH'),
+        input_columns=input_columns,
+        output_column=plan.output_columns,
+        output_prompt_column=output_prompt_columns if output_prompt_columns else None,
+        batch_size=int(env.get('BATCH_SIZE', 1000)),
+        max_rows=int(env.get('MAX_ROWS') or 0) or None,
+        max_thread_num=int(env.get('MAX_THREAD_NUM', 512)),
+        max_inflight_bytes=parse_size(env.get('MAX_INFLIGHT_BYTES')),
+        oversize_path=env.get('OVERSIZE_PATH') or None,
+        max_open_files=int(env.get('MAX_OPEN_FILES', 8)),
+        dead_letter_path=env.get('DEAD_LETTER_PATH') or None,
+        raw_store_path=env.get('RAW_STORE_PATH') or None,
+        join_original_columns=env.get('JOIN_ORIGINAL_COLUMNS', 'true').lower() in ('1', 'true', 'yes')
+    )
+    
+    # LLM配置
+    llm_config = {
+        "model": env.get('MODEL_NAME', 'qwen'),
+        "temperature": float(env.get('TEMPERATURE', 0.6)),
+        "top_p": float(env.get("TOP_P", 0.95)),
+        "max_tokens": int(env.get('MAX_TOKENS', 4096)),
+        "stop": json.loads(env.get("STOP", '["<|endoftext|>"]'))
+    }
+    
+    preflight = build_preflight(llm_config, env)
+    return ChatLLM(
+        llm_url=env.get('LLM_URL'),
+        prompt_key=prompt_keys,
+        response_processor=response_processors,
+        dataset_config=dataset_config,
+        api_key=env.get('API_KEY', 'test'),
+        generate_config=llm_config,
+        grouped_mode=grouped_mode,
+        grouped_output_columns=grouped_output_columns if grouped_mode else None,
+        http_config=build_http_config(env),
+        preflight=preflight,
+        plan=plan,
+        scheduler=build_scheduler(preflight, env),
+        backend=env.get('LLM_BACKEND', 'chat').strip().lower(),
+        completions_batch_size=int(env.get('COMPLETIONS_BATCH_SIZE', 16)),
+        completions_batch_wait=float(env.get('COMPLETIONS_BATCH_WAIT', 0.02)),
+        batch_api_config=build_batch_api_config(env),
+        request_timeout=float(env.get('REQUEST_TIMEOUT', 0)) or None,
+        row_deadline=float(env.get('ROW_DEADLINE', 0)) or None,
+        run_deadline=float(env.get('RUN_DEADLINE', 0)) or None,
+        near_dup=build_near_dup(env),
+        near_dup_column=env.get('NEAR_DUP_COLUMN', 'near_dup_of'),
+        model_cascade=parse_cascade(env.get('MODEL_CASCADE', ''), prompt_keys,
+                                    parse_grouped_config(env.get('MODEL_CASCADE', ''))),
+        confidence_check=getattr(response_processor, env['CASCADE_CONFIDENCE_CHECK'].strip())
+        if env.get('CASCADE_CONFIDENCE_CHECK') else None,
+        **overrides
+    )
+
+
+def run_job(chat_llm, config: Optional[Mapping[str, Any]] = None):
+    """按配置选择运行模式：预估、重跑死信、重新处理、多节点租约队列或处理数据集"""
+    env = load_settings(config)
+    if env.get('DRY_RUN', 'false').lower() in ('1', 'true', 'yes'):
+        chat_llm.dry_run(avg_latency=float(env.get('DRY_RUN_AVG_LATENCY', 20)))
+    elif env.get('RETRY_DEAD_LETTER', 'false').lower() in ('1', 'true', 'yes'):
+        chat_llm.retry_dead_letter()
+    elif env.get('REPROCESS_ONLY', 'false').lower() in ('1', 'true', 'yes'):
+        chat_llm.reprocess_dataset(num_workers=int(env.get('REPROCESS_WORKERS', 0)) or None)
+    elif env.get('LEASE_DIR'):
+        run_worker(
+            chat_llm,
+            env.get('LEASE_DIR'),
+            chunk_rows=int(env.get('LEASE_CHUNK_ROWS', 10000)),
+            ttl=float(env.get('LEASE_TTL', 60)),
+            worker_id=env.get('WORKER_ID') or None
         )
+    else:
+        chat_llm.process_dataset(resume=env.get('RESUME', 'false').lower() in ('1', 'true', 'yes'))
 
 
-def main():
+def parse_args(argv=None):
+    """解析命令行参数，不带子命令时按.env.example配置处理数据集"""
+    parser = argparse.ArgumentParser(description="LLM批量调用工具，配置见.env.example")
+    subparsers = parser.add_subparsers(dest="command")
     
+    autotune_parser = subparsers.add_parser("autotune", help="压测LLM服务，推荐MAX_THREAD_NUM和BATCH_SIZE")
+    autotune_parser.add_argument("--levels", default=None,
+                                 help="并发档位，逗号分隔，默认 1,2,4,...,512")
+    autotune_parser.add_argument("--samples", type=int, default=200,
+                                 help="从INPUT_PATH渲染的样本prompt数")
+    autotune_parser.add_argument("--requests-per-level", type=int, default=None,
+                                 help="每档请求数，默认取并发数的4倍（至少与样本数相同）")
+    autotune_parser.add_argument("--min-gain", type=float, default=0.1,
+                                 help="吞吐提升不足该比例时视为已饱和")
+    autotune_parser.add_argument("--output", default="autotune.env",
+                                 help="推荐配置（.env片段）的输出路径")
+    
+    serve_parser = subparsers.add_parser("serve", help="常驻服务：接收任务，所有任务共享连接池和全局并发限制")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    serve_parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    serve_parser.add_argument("--max-concurrency", type=int, default=None,
+                              help="所有任务合计同时在途的请求数，默认取SERVE_MAX_CONCURRENCY或512")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    
+    args = parse_args(argv)
     load_dotenv(dotenv_path=".env.example",override=True)
     setup_logging()
     logger = logging.getLogger(__name__)
     
     try:
+        if args.command == "serve":
+            max_concurrency = args.max_concurrency or int(os.getenv('SERVE_MAX_CONCURRENCY', 512))
+            JobServer(init_chat_llm, run_job, max_concurrency, build_http_config()).serve(args.host, args.port)
+            return
+        
         chat_llm = init_chat_llm()
+        
+        if args.command == "autotune":
+            chat_llm.autotune(
+                levels=parse_levels(args.levels),
+                samples=args.samples,
+                requests_per_level=args.requests_per_level,
+                output_path=args.output,
+                min_gain=args.min_gain
+            )
+            return
+        
         logger.info(f"开始处理: {chat_llm.dataset_config.input_path} -> {chat_llm.dataset_config.output_path}")
         
         start_time = time.time()
-        chat_llm.process_dataset()
+        run_job(chat_llm)
         logger.info(f"处理完成，用时: {time.time() - start_time:.2f}秒")
         
     except Exception as e:
@@ -212,4 +340,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
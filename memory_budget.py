@@ -0,0 +1,90 @@
+import sys
+import logging
+import resource
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(value: Optional[str]) -> Optional[int]:
+    """解析带单位的字节数，如 512M、2G、1048576
+
+    Returns:
+        字节数，值为空时返回None
+    """
+    if value is None or not str(value).strip():
+        return None
+    value = str(value).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def format_size(num_bytes: float) -> str:
+    """将字节数格式化为可读字符串"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}TB"
+
+
+def peak_rss_bytes() -> int:
+    """当前进程的峰值常驻内存（字节）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux下单位为KB，macOS下单位为字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class InflightBudget:
+    """在途数据的内存预算
+
+    每行数据提交时按 输入字节数 × 膨胀系数 计入预算，结果写出后释放。
+    膨胀系数根据已写出结果的 输出字节数 / 输入字节数 动态估计，
+    从而把尚未返回的LLM响应也计入内存占用。
+
+    Args:
+        max_bytes: 在途数据的字节上限，None表示不限制
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.inflight_bytes = 0
+        self.peak_bytes = 0
+        self._in_total = 0
+        self._out_total = 0
+
+    @property
+    def growth(self) -> float:
+        """结果相对输入的膨胀系数，至少为1"""
+        if not self._in_total:
+            return 1.0
+        return max(1.0, self._out_total / self._in_total)
+
+    def exceeded(self) -> bool:
+        """在途数据是否已达到预算上限"""
+        return self.max_bytes is not None and self.inflight_bytes >= self.max_bytes
+
+    def charge(self, num_bytes: int) -> int:
+        """登记一行在途数据，返回计入预算的字节数"""
+        cost = int(num_bytes * self.growth)
+        self.inflight_bytes += cost
+        self.peak_bytes = max(self.peak_bytes, self.inflight_bytes)
+        return cost
+
+    def release(self, cost: int):
+        """释放一行在途数据占用的预算"""
+        self.inflight_bytes -= cost
+
+    def observe(self, in_bytes: int, out_bytes: int):
+        """记录一行数据的输入输出大小，用于估计膨胀系数"""
+        self._in_total += in_bytes
+        self._out_total += out_bytes
+
+    def log_summary(self):
+        """输出内存使用情况"""
+        if self.max_bytes is not None:
+            logger.info(f"在途数据峰值: {format_size(self.peak_bytes)} / 预算 {format_size(self.max_bytes)}，"
+                        f"结果膨胀系数: {self.growth:.2f}")
+        logger.info(f"进程峰值内存(RSS): {format_size(peak_rss_bytes())}")
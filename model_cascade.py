@@ -0,0 +1,120 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CascadeTier:
+    """级联中的一级：某个prompt使用的模型（及可选的服务地址），附带该级的统计
+
+    Args:
+        prompt_key: 所属的prompt
+        level: 级别，从0开始
+        model: 模型名
+        llm_url: 服务地址，None表示使用LLM_URL
+        client: 该级使用的OpenAI客户端，None表示使用默认客户端
+    """
+
+    def __init__(self, prompt_key: str, level: int, model: str, llm_url: Optional[str] = None, client=None):
+        self.prompt_key = prompt_key
+        self.level = level
+        self.model = model
+        self.llm_url = llm_url
+        self.client = client
+        self.rows = 0
+        self.accepted = 0
+        self.calls = 0
+        self.seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record_call(self, seconds: float, usage: Optional[Any]):
+        """记录一次LLM调用的耗时和token数"""
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+
+    def record_row(self, accepted: bool):
+        """记录一行在该级的结果"""
+        with self._lock:
+            self.rows += 1
+            self.accepted += accepted
+
+    def summary(self) -> str:
+        rate = self.accepted / self.rows if self.rows else 0.0
+        latency = self.seconds / self.calls if self.calls else 0.0
+        target = f"{self.model}@{self.llm_url}" if self.llm_url else self.model
+        return (f"{self.prompt_key} 第{self.level + 1}级 {target}: 到达{self.rows}行，接受率{rate:.1%}，"
+                f"调用{self.calls}次，平均耗时{latency:.2f}秒，"
+                f"输入token {self.prompt_tokens}，输出token {self.completion_tokens}")
+
+
+def parse_tier(spec: str) -> Tuple[str, Optional[str]]:
+    """解析 模型名 或 模型名@服务地址"""
+    model, _, llm_url = spec.strip().partition("@")
+    if not model:
+        raise ValueError(f"MODEL_CASCADE中的模型名不能为空: {spec}")
+    return model, llm_url.strip() or None
+
+
+class ModelCascade:
+    """模型级联：每个prompt按顺序尝试多级模型，前一级的输出被拒绝时才升级到下一级
+
+    输出被拒绝指：输出解析器返回None或抛出异常、输出为<|wrong data|>、或confidence_check返回False。
+    最后一级沿用原有的重试逻辑。
+
+    Args:
+        tiers: prompt_key -> 按顺序排列的级联（每项为 模型名 或 模型名@服务地址）
+        client_factory: 根据服务地址创建OpenAI客户端的函数，同一地址只创建一次
+        confidence_check: 可选的置信度检查，参数为 (原始响应, {输出列: 解析结果})，返回False时升级
+    """
+
+    def __init__(self, tiers: Dict[str, Sequence[str]], client_factory: Callable[[str], Any],
+                 confidence_check: Optional[Callable[[str, Dict[str, Any]], bool]] = None):
+        self.confidence_check = confidence_check
+        self._tiers: Dict[str, List[CascadeTier]] = {}
+        clients: Dict[str, Any] = {}
+        for prompt_key, specs in tiers.items():
+            levels = []
+            for level, spec in enumerate(specs):
+                model, llm_url = parse_tier(spec)
+                if llm_url and llm_url not in clients:
+                    clients[llm_url] = client_factory(llm_url)
+                levels.append(CascadeTier(prompt_key, level, model, llm_url, clients.get(llm_url)))
+            if levels:
+                self._tiers[prompt_key] = levels
+
+    def tiers(self, prompt_key: str) -> List[CascadeTier]:
+        """该prompt的级联，未配置时为空"""
+        return self._tiers.get(prompt_key, [])
+
+    def log_summary(self):
+        """输出每一级的接受率、耗时和token数，用于调整级联"""
+        for levels in self._tiers.values():
+            for tier in levels:
+                if tier.rows:
+                    logger.info(f"[cascade] {tier.summary()}")
+
+
+def parse_cascade(value: str, prompt_keys: Sequence[str], grouped: Optional[List[List[str]]]) -> Dict[str, List[str]]:
+    """解析MODEL_CASCADE配置
+
+    Args:
+        value: 原始配置，如 small,large（所有prompt相同）
+        prompt_keys: prompt列表
+        grouped: 分组格式 [small,large],[large] 的解析结果，与prompt_keys一一对应
+
+    Returns:
+        prompt_key -> 级联
+    """
+    if grouped is not None:
+        if len(grouped) != len(prompt_keys):
+            raise ValueError(f"MODEL_CASCADE的分组数({len(grouped)})与PROMPT_KEY数量({len(prompt_keys)})不一致")
+        return dict(zip(prompt_keys, grouped))
+    specs = [spec.strip() for spec in value.split(",") if spec.strip()]
+    return {prompt_key: specs for prompt_key in prompt_keys} if specs else {}
@@ -0,0 +1,181 @@
+import re
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MASK64 = (1 << 64) - 1
+_EMPTY = _MASK64
+_NORMALIZE_PATTERN = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """归一化文本：忽略大小写、空白和标点"""
+    return _NORMALIZE_PATTERN.sub('', text.casefold())
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """选择LSH的分段数和每段行数，使候选阈值 (1/b)^(1/r) 最接近相似度阈值"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class _Entry:
+    """一个代表行：签名、标识，以及处理完成后供重复行复制的输出列"""
+
+    __slots__ = ("signature", "key", "band_keys", "done", "outputs", "_callbacks", "_lock")
+
+    def __init__(self, signature: array, key: str, band_keys: List[int]):
+        self.signature = signature
+        self.key = key
+        self.band_keys = band_keys
+        self.done = False
+        self.outputs: Optional[Dict[str, Any]] = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def resolve(self, outputs: Optional[Dict[str, Any]]):
+        """代表行处理完成，outputs为None表示代表行处理失败"""
+        with self._lock:
+            self.done = True
+            self.outputs = outputs
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(outputs)
+
+    def when_done(self, callback: Callable[[Optional[Dict[str, Any]]], None]):
+        """代表行处理完成后调用callback(outputs)，已完成时立即调用"""
+        with self._lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self.outputs)
+
+
+class NearDupIndex:
+    """基于MinHash/LSH的流式近似重复检测
+
+    对归一化后的文本取字符shingle，用one permutation hashing计算MinHash签名（每个shingle只哈希一次），
+    按LSH分段建立索引。估计的Jaccard相似度不低于threshold的行视为重复，只保留第一行作为代表。
+    索引最多保存max_entries个代表行，超出时淘汰最久未命中的代表行，内存占用有上限。
+
+    Args:
+        threshold: 相似度阈值（0-1）
+        num_perm: 签名长度
+        shingle_size: shingle的字符数
+        max_entries: 索引中最多保存的代表行数
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, shingle_size: int = 5,
+                 max_entries: int = 100000):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"NEAR_DUP_THRESHOLD必须在(0, 1]之间: {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self._buckets = [dict() for _ in range(self.bands)]
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # 查找和添加在提交线程中进行，失败的代表行在工作线程中移除
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.duplicates = 0
+
+    def signature(self, text: str) -> Optional[array]:
+        """计算文本的MinHash签名，文本为空时返回None"""
+        text = normalize(text)
+        if not text:
+            return None
+        k = self.shingle_size
+        shingles = {text} if len(text) <= k else {text[i:i + k] for i in range(len(text) - k + 1)}
+        num_perm = self.num_perm
+        sig = [_EMPTY] * num_perm
+        for shingle in shingles:
+            # 使用确定性哈希，重新运行时重复判定保持一致
+            h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+            idx = h % num_perm
+            value = h // num_perm
+            if value < sig[idx]:
+                sig[idx] = value
+        # 空桶用下一个非空桶的值填充（rotation densification），加上偏移区分来源
+        filled = [i for i in range(num_perm) if sig[i] != _EMPTY]
+        if len(filled) < num_perm:
+            for i in range(num_perm):
+                if sig[i] == _EMPTY:
+                    j = next(f for f in filled if f > i) if filled[-1] > i else filled[0]
+                    sig[i] = (sig[j] + ((j - i) % num_perm) * 0x9E3779B97F4A7C15) & _MASK64
+        return array('Q', sig)
+
+    def _band_keys(self, signature: array) -> List[int]:
+        r = self.rows
+        return [hash(tuple(signature[b * r:(b + 1) * r])) for b in range(self.bands)]
+
+    def similarity(self, a: array, b: array) -> float:
+        """估计的Jaccard相似度"""
+        return sum(1 for x, y in zip(a, b) if x == y) / self.num_perm
+
+    def find(self, signature: array) -> Tuple[Optional[_Entry], float, List[int]]:
+        """查找相似的代表行
+
+        Returns:
+            (代表行, 相似度, 该签名的分段键)，没有相似的代表行时代表行为None
+        """
+        band_keys = self._band_keys(signature)
+        best, best_sim = None, 0.0
+        with self._lock:
+            self.lookups += 1
+            checked = set()
+            for bucket, band_key in zip(self._buckets, band_keys):
+                entry = bucket.get(band_key)
+                if entry is None or id(entry) in checked:
+                    continue
+                checked.add(id(entry))
+                sim = self.similarity(signature, entry.signature)
+                if sim >= self.threshold and sim > best_sim:
+                    best, best_sim = entry, sim
+            if best is not None:
+                self.duplicates += 1
+                self._entries.move_to_end(id(best))
+        return best, best_sim, band_keys
+
+    def add(self, signature: array, key: str, band_keys: List[int]) -> _Entry:
+        """添加代表行，超出容量时淘汰最久未命中的代表行"""
+        entry = _Entry(signature, key, band_keys)
+        with self._lock:
+            for bucket, band_key in zip(self._buckets, band_keys):
+                bucket.setdefault(band_key, entry)
+            self._entries[id(entry)] = entry
+            if len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._remove(evicted)
+        return entry
+
+    def discard(self, entry: _Entry):
+        """移除代表行（如代表行处理失败），之后相似的行会成为新的代表行"""
+        with self._lock:
+            if self._entries.pop(id(entry), None) is not None:
+                self._remove(entry)
+
+    def _remove(self, entry: _Entry):
+        for bucket, band_key in zip(self._buckets, entry.band_keys):
+            if bucket.get(band_key) is entry:
+                del bucket[band_key]
+
+    def log_summary(self):
+        """输出近似重复统计"""
+        if self.lookups:
+            logger.info(f"近似重复检测: {self.lookups}行中{self.duplicates}行复用了代表行的结果"
+                        f"（阈值{self.threshold}，LSH {self.bands}段×{self.rows}行）")
+
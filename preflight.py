@@ -0,0 +1,229 @@
+import re
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符：一个字符通常对应约一个token，远多于拉丁字符
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+# 每条消息的chat模板开销（角色标记、分隔符等）
+_MESSAGE_OVERHEAD_TOKENS = 8
+
+
+class TokenEstimator(ABC):
+    """token数估计器基类
+
+    子类实现_count，基类负责根据服务端返回的真实prompt_tokens在线校准。
+    """
+
+    def __init__(self):
+        self.scale = 1.0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _count(self, text: str) -> int:
+        """未校准的token数"""
+
+    def count(self, text: str) -> int:
+        """估计文本的token数"""
+        return int(self._count(text) * self.scale)
+
+    def observe(self, estimated: int, actual: int):
+        """用真实token数校准估计值（指数滑动平均，校准系数限制在[0.25, 4]内）"""
+        if estimated <= 0 or actual <= 0:
+            return
+        with self._lock:
+            scale = 0.9 * self.scale + 0.1 * (self.scale * actual / estimated)
+            self.scale = min(4.0, max(0.25, scale))
+
+
+class CharTokenEstimator(TokenEstimator):
+    """基于字符数的token估计器，中日韩字符与其他字符分别计算
+
+    Args:
+        chars_per_token: 非中日韩字符平均每个token的字符数
+        cjk_chars_per_token: 中日韩字符平均每个token的字符数
+    """
+
+    def __init__(self, chars_per_token: float = 4.0, cjk_chars_per_token: float = 1.0):
+        super().__init__()
+        self.chars_per_token = chars_per_token
+        self.cjk_chars_per_token = cjk_chars_per_token
+
+    def _count(self, text: str) -> int:
+        cjk = len(_CJK_PATTERN.findall(text))
+        return int((len(text) - cjk) / self.chars_per_token + cjk / self.cjk_chars_per_token) + 1
+
+
+class TokenizerEstimator(TokenEstimator):
+    """基于本地分词器的token计数
+
+    Args:
+        encode: 将文本编码为token列表的函数
+    """
+
+    def __init__(self, encode: Callable[[str], List]):
+        super().__init__()
+        self._encode = lru_cache(maxsize=4096)(lambda text: len(encode(text)))
+
+    def _count(self, text: str) -> int:
+        return self._encode(text)
+
+
+def build_token_estimator(spec: Optional[str]) -> TokenEstimator:
+    """根据配置构建token估计器
+
+    Args:
+        spec: 估计器配置，支持：
+            char 或 char:<每token字符数>: 基于字符数估计（默认）
+            tiktoken:<编码名>: 使用tiktoken，如 tiktoken:cl100k_base
+            hf:<分词器路径>: 使用transformers的AutoTokenizer
+
+    Returns:
+        token估计器
+    """
+    spec = (spec or 'char').strip()
+    kind, _, arg = spec.partition(':')
+
+    if kind == 'char':
+        return CharTokenEstimator(float(arg)) if arg else CharTokenEstimator()
+
+    if kind == 'tiktoken':
+        try:
+            import tiktoken
+        except ImportError:
+            raise ValueError("使用tiktoken估计token数需要先安装tiktoken：pip install tiktoken")
+        encoding = tiktoken.get_encoding(arg or 'cl100k_base')
+        return TokenizerEstimator(lambda text: encoding.encode(text, disallowed_special=()))
+
+    if kind == 'hf':
+        try:
+            from transformers import AutoTokenizer
+        except ImportError:
+            raise ValueError("使用hf分词器估计token数需要先安装transformers：pip install transformers")
+        tokenizer = AutoTokenizer.from_pretrained(arg)
+        return TokenizerEstimator(lambda text: tokenizer.encode(text, add_special_tokens=False))
+
+    raise ValueError(f"不支持的TOKENIZER配置: {spec}")
+
+
+class Preflight:
+    """请求发送前的token预检
+
+    估计prompt的token数，判断 prompt + 输出 是否超出模型上下文，
+    并为每个请求计算不超出上下文的max_tokens。
+
+    Args:
+        estimator: token估计器
+        context_length: 模型上下文长度，None表示不做上下文检查
+        max_tokens: 配置的最大生成token数
+        min_output_tokens: 剩余上下文少于该值时视为超长
+        system_prompt: 每个请求附带的system prompt，计入prompt的token数
+    """
+
+    def __init__(
+        self,
+        estimator: TokenEstimator,
+        context_length: Optional[int],
+        max_tokens: int,
+        min_output_tokens: int = 256,
+        system_prompt: str = "",
+    ):
+        self.estimator = estimator
+        self.context_length = context_length
+        self.max_tokens = max_tokens
+        self.min_output_tokens = min_output_tokens
+        self.system_prompt = system_prompt
+
+    def prompt_tokens(self, prompt: str) -> int:
+        """估计一个请求的prompt token数（含system prompt和chat模板开销）"""
+        tokens = self.estimator.count(prompt) + _MESSAGE_OVERHEAD_TOKENS
+        if self.system_prompt:
+            tokens += self.estimator.count(self.system_prompt) + _MESSAGE_OVERHEAD_TOKENS
+        return tokens
+
+    def fit_max_tokens(self, prompt: str) -> Optional[int]:
+        """计算该prompt可用的max_tokens
+
+        Returns:
+            不超出上下文的max_tokens，剩余上下文不足min_output_tokens时返回None
+        """
+        if not self.context_length:
+            return self.max_tokens
+        remaining = self.context_length - self.prompt_tokens(prompt)
+        if remaining < min(self.min_output_tokens, self.max_tokens):
+            return None
+        return min(self.max_tokens, remaining)
+
+    def observe(self, prompt: str, actual_prompt_tokens: Optional[int]):
+        """用服务端返回的prompt_tokens校准估计器"""
+        if actual_prompt_tokens:
+            self.estimator.observe(self.prompt_tokens(prompt), actual_prompt_tokens)
+
+
+class DryRunReport:
+    """dry-run统计：只渲染prompt并估计token数，不调用LLM
+
+    Args:
+        preflight: token预检对象
+        max_thread_num: 并发线程数，用于估计运行时间
+        avg_latency: 单个请求的平均耗时（秒），用于估计运行时间
+    """
+
+    def __init__(self, preflight: Preflight, max_thread_num: int, avg_latency: float):
+        self.preflight = preflight
+        self.max_thread_num = max_thread_num
+        self.avg_latency = avg_latency
+        self.rows = 0
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.max_output_tokens = 0
+        self.oversized = 0
+        self.duplicates = 0
+        self._seen = set()
+
+    def add(self, prompt: str):
+        """统计一个渲染后的prompt"""
+        self.requests += 1
+        self.prompt_tokens += self.preflight.prompt_tokens(prompt)
+
+        digest = hashlib.blake2b(prompt.encode('utf-8'), digest_size=8).digest()
+        if digest in self._seen:
+            self.duplicates += 1
+        else:
+            self._seen.add(digest)
+
+        max_tokens = self.preflight.fit_max_tokens(prompt)
+        if max_tokens is None:
+            self.oversized += 1
+        else:
+            self.max_output_tokens += max_tokens
+
+    def summary(self) -> Dict:
+        """返回统计结果"""
+        sent = self.requests - self.oversized
+        return {
+            "rows": self.rows,
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0,
+            "max_output_tokens": self.max_output_tokens,
+            "oversized": self.oversized,
+            "duplicates": self.duplicates,
+            "projected_seconds": sent * self.avg_latency / max(1, self.max_thread_num),
+        }
+
+    def log_summary(self):
+        """输出统计结果"""
+        s = self.summary()
+        logger.info(f"[dry-run] 数据行数: {s['rows']}，请求数: {s['requests']}")
+        logger.info(f"[dry-run] prompt token总数: {s['prompt_tokens']}（平均 {s['avg_prompt_tokens']:.1f}）")
+        logger.info(f"[dry-run] 输出token上限总数: {s['max_output_tokens']}")
+        logger.info(f"[dry-run] 超出上下文的请求数: {s['oversized']}，重复prompt数: {s['duplicates']}")
+        logger.info(f"[dry-run] 预计运行时间: {s['projected_seconds']:.0f}秒 "
+                    f"（平均耗时{self.avg_latency}秒，并发{self.max_thread_num}）")
@@ -0,0 +1,120 @@
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from execution_plan import PromptNode
+
+logger = logging.getLogger(__name__)
+
+# 缺少原始响应时的失败原因
+REASON_MISSING_RAW = "missing_raw"
+
+
+def row_key(data_row: Dict, input_columns: Sequence[str]) -> str:
+    """根据输入列的值计算行的键，与行在文件中的位置无关"""
+    values = [data_row.get(col) for col in input_columns]
+    payload = json.dumps(values, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class RawResponseStore:
+    """LLM原始响应存储
+
+    以 (行键, prompt_key) 为键，将原始响应、reasoning和usage压缩后保存在SQLite文件中，
+    用于在修改输出解析器后不调用LLM直接重新处理。
+
+    Args:
+        path: 存储文件路径
+        commit_every: 每写入多少条记录提交一次
+    """
+
+    def __init__(self, path: str, commit_every: int = 1000):
+        self.path = path
+        self.commit_every = commit_every
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "row_key TEXT NOT NULL, prompt_key TEXT NOT NULL, data BLOB NOT NULL, "
+            "PRIMARY KEY (row_key, prompt_key))"
+        )
+
+    def put(self, key: str, prompt_key: str, response: str, reasoning: Optional[str] = None,
+            usage: Optional[Dict] = None):
+        """保存一条原始响应，同一行同一prompt的旧记录会被覆盖"""
+        record = {"response": response, "reasoning": reasoning, "usage": usage}
+        data = zlib.compress(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, prompt_key, data))
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def get(self, key: str) -> Dict[str, Dict]:
+        """读取一行数据的所有原始响应
+
+        Returns:
+            {prompt_key: {"response", "reasoning", "usage"}}
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT prompt_key, data FROM responses WHERE row_key = ?", (key,)
+            ).fetchall()
+        return {prompt_key: json.loads(zlib.decompress(data)) for prompt_key, data in rows}
+
+    def close(self):
+        """提交并关闭存储"""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def reprocess_chunk(
+    chunk: List[Tuple[Dict, Dict[str, Dict]]],
+    nodes: Sequence["PromptNode"],
+) -> List[Tuple[Dict, Optional[str]]]:
+    """用保存的原始响应重新运行输出解析器（在子进程中执行）
+
+    Args:
+        chunk: (数据行, 该行的原始响应) 列表
+        nodes: 执行计划中的prompt节点
+
+    Returns:
+        (处理后的数据行, 失败原因) 列表，失败原因为None表示所有prompt都有原始响应
+    """
+    results = []
+    for data_row, raws in chunk:
+        reason = None
+        for node in nodes:
+            raw = raws.get(node.prompt_key)
+            if raw is None:
+                reason = REASON_MISSING_RAW
+                continue
+            for processor, output_column in node.outputs:
+                try:
+                    processed_response = processor(raw["response"])
+                    if processed_response is not None:
+                        data_row[output_column] = processed_response
+                except Exception as e:
+                    logger.debug(f"响应处理失败 (输出列{output_column}): {e}")
+            if node.prompt_column:
+                try:
+                    data_row[node.prompt_column] = node.template.format(*node.get_inputs(data_row))
+                except KeyError:
+                    # 上游阶段重新处理后未产出该prompt需要的字段
+                    pass
+        results.append((data_row, reason))
+    return results
@@ -0,0 +1,133 @@
+import heapq
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from preflight import CharTokenEstimator, TokenEstimator
+
+logger = logging.getLogger(__name__)
+
+POLICY_FIFO = "fifo"
+POLICY_LONGEST_FIRST = "longest_first"
+POLICY_SHORTEST_FIRST = "shortest_first"
+POLICIES = (POLICY_FIFO, POLICY_LONGEST_FIRST, POLICY_SHORTEST_FIRST)
+
+
+class LengthAwareScheduler:
+    """按预估耗时调整数据行的提交顺序
+
+    向前读取最多window行，按预估成本（prompt的token数 + 该prompt历史平均输出token数）
+    优先提交最长或最短的行。长请求先提交可以避免运行末尾只剩少数长请求、其余线程空闲。
+    为避免某一行一直被插队，一行之后再读入window行时，该行会被立即提交。
+
+    Args:
+        policy: fifo、longest_first或shortest_first
+        window: 向前读取的行数
+        estimator: token估计器，为None时按字符数估计
+    """
+
+    def __init__(self, policy: str = POLICY_LONGEST_FIRST, window: int = 1000,
+                 estimator: Optional[TokenEstimator] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"SCHEDULE_POLICY必须为{'、'.join(POLICIES)}之一: {policy}")
+        if window < 1:
+            raise ValueError(f"SCHEDULE_WINDOW必须大于0: {window}")
+        self.policy = policy
+        self.window = window
+        self.estimator = estimator or CharTokenEstimator()
+        self._lock = threading.Lock()
+        # prompt_key -> 平均输出token数（指数滑动平均）
+        self._output_tokens: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != POLICY_FIFO
+
+    def observe(self, prompt_key: str, completion_tokens: Optional[int]):
+        """记录一次LLM调用的输出token数"""
+        if not completion_tokens:
+            return
+        with self._lock:
+            avg = self._output_tokens.get(prompt_key)
+            self._output_tokens[prompt_key] = completion_tokens if avg is None else 0.9 * avg + 0.1 * completion_tokens
+
+    def cost(self, prompts: Iterable[Tuple[str, str]]) -> float:
+        """估计一行数据的成本
+
+        Args:
+            prompts: 该行的 (prompt_key, 渲染后的prompt)
+        """
+        total = 0.0
+        for prompt_key, prompt in prompts:
+            total += self.estimator.count(prompt) + self._output_tokens.get(prompt_key, 0.0)
+        return total
+
+    def order(self, rows: Iterable, cost_of: Callable[[object], float]) -> Iterator[Tuple[int, object]]:
+        """按策略重新排列数据行
+
+        Args:
+            rows: 数据行迭代器，惰性读取
+            cost_of: 计算单行成本的函数
+
+        Yields:
+            (该行在输入中的序号, 数据行)
+        """
+        sign = -1 if self.policy == POLICY_LONGEST_FIRST else 1
+        heap = []
+        # 按读入顺序排列的条目，用于找出等待最久的行
+        arrivals = deque()
+        rows = iter(rows)
+        read = 0
+        buffered = 0
+        exhausted = False
+
+        while True:
+            while not exhausted and buffered < self.window:
+                try:
+                    item = next(rows)
+                except StopIteration:
+                    exhausted = True
+                    break
+                entry = [sign * cost_of(item), read, item, True]
+                heapq.heappush(heap, entry)
+                arrivals.append(entry)
+                read += 1
+                buffered += 1
+
+            while arrivals and not arrivals[0][3]:
+                arrivals.popleft()
+            if not arrivals:
+                return
+
+            oldest = arrivals[0]
+            if read - oldest[1] >= self.window and not exhausted:
+                # 等待最久的行已被window行插队，立即提交
+                entry = oldest
+            else:
+                entry = heapq.heappop(heap)
+                while not entry[3]:
+                    entry = heapq.heappop(heap)
+            entry[3] = False
+            buffered -= 1
+            yield entry[1], entry[2]
+
+
+class ReorderBuffer:
+    """将乱序完成的结果按输入序号恢复顺序"""
+
+    def __init__(self):
+        self._next = 0
+        self._held: Dict[int, object] = {}
+
+    def __len__(self) -> int:
+        return len(self._held)
+
+    def push(self, seq: int, value) -> List:
+        """放入一个结果，返回现在可以按顺序输出的结果"""
+        self._held[seq] = value
+        ready = []
+        while self._next in self._held:
+            ready.append(self._held.pop(self._next))
+            self._next += 1
+        return ready
@@ -0,0 +1,75 @@
+import sys
+import json
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import pytest
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from main import init_chat_llm
+
+
+class LLMJob:
+    """临时目录中的一次数据集处理：写入输入文件，按.env.example的键构建ChatLLM，读取输出和死信
+
+    Args:
+        tmp_path: pytest的临时目录，输入为其中的in.jsonl，输出为out.jsonl
+    """
+
+    def __init__(self, tmp_path: Path):
+        self.tmp_path = tmp_path
+        self.input_path = tmp_path / "in.jsonl"
+        self.output_path = tmp_path / "out.jsonl"
+        self.dead_letter_path = tmp_path / "out.dead_letter.jsonl"
+
+    @staticmethod
+    def rows(num_rows: int) -> List[Dict]:
+        """默认的测试数据行"""
+        return [{"id": i, "session": f"s{i}", "query": f"q{i}"} for i in range(num_rows)]
+
+    def write_rows(self, num_rows: int, make: Optional[Callable[[int], Dict]] = None,
+                   path: Optional[Path] = None) -> Path:
+        """写入num_rows行输入数据，make(i)生成第i行，默认使用rows的格式"""
+        path = path or self.input_path
+        rows = [make(i) for i in range(num_rows)] if make else self.rows(num_rows)
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return path
+
+    def config(self, url: str, **overrides) -> Dict:
+        """测试用的基础配置，overrides中值为None的项不设置"""
+        config = {
+            "LLM_URL": url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+            "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MODEL_NAME": "mock",
+            "MAX_TOKENS": 16, "MAX_THREAD_NUM": 4,
+            "INPUT_PATH": str(self.input_path), "OUTPUT_PATH": str(self.output_path),
+        }
+        config.update(overrides)
+        return config
+
+    def build(self, url: str, **overrides):
+        """按配置构建ChatLLM，不读取环境变量"""
+        return init_chat_llm(self.config(url, **overrides))
+
+    def run(self, url: str, **overrides):
+        """构建ChatLLM并处理数据集"""
+        chat_llm = self.build(url, **overrides)
+        chat_llm.process_dataset()
+        return chat_llm
+
+    def read(self, path: Optional[Path] = None) -> List[Dict]:
+        """读取jsonl文件（默认为输出文件），文件不存在时返回空列表"""
+        path = Path(path or self.output_path)
+        if not path.exists():
+            return []
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def llm_job(tmp_path) -> LLMJob:
+    return LLMJob(tmp_path)
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+class MockLLMServer:
+    """本地模拟的OpenAI兼容服务，用于测试
+
+    每个请求固定耗时delay秒；设置capacity时，服务端同时只处理capacity个请求，
+    超出的请求排队，用于模拟吞吐上限。
+    同时模拟离线批量接口（/v1/files、/v1/batches）：上传的文件保存在临时目录中，
+    批量任务在后台线程中逐行处理，完成后生成输出文件和错误文件；取消的批量任务不生成输出。
+
+    Args:
+        delay: 单个请求的处理耗时（秒）
+        capacity: 服务端并发处理能力，None表示不限制
+        fail_rate: 返回500错误的请求比例
+        answer: 生成chat回答的函数，参数为 (模型名, prompt)，None时回答 ans:+prompt前20个字符
+        batch_delay: 批量任务的处理耗时（秒），None时与delay相同
+
+    用法:
+        with MockLLMServer(delay=0.05, capacity=4) as server:
+            OpenAI(base_url=server.url, api_key="x")
+    """
+
+    def __init__(self, delay: float = 0.01, capacity: Optional[int] = None, fail_rate: float = 0.0,
+                 answer: Optional[Callable[[str, str], str]] = None, batch_delay: Optional[float] = None):
+        self.delay = delay
+        self.batch_delay = delay if batch_delay is None else batch_delay
+        self.fail_rate = fail_rate
+        self.answer = answer
+        self.requests = 0
+        # 同时在处理中的请求数及其峰值
+        self.active = 0
+        self.max_active = 0
+        self.paths = Counter()
+        self.models = Counter()
+        # chat请求中的max_tokens，按收到的顺序
+        self.max_tokens = []
+        self._slots = threading.Semaphore(capacity) if capacity else None
+        self._lock = threading.Lock()
+        self.batches = {}
+        self._files_dir = tempfile.mkdtemp(prefix="mock_llm_files_")
+        self._file_ids = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._files_dir, ignore_errors=True)
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            count = self.requests
+        # 按固定间隔失败，使结果可复现
+        return self.fail_rate > 0 and count % max(1, round(1 / self.fail_rate)) == 0
+
+    def _chat_completion(self, body: dict) -> dict:
+        prompt = body["messages"][-1]["content"]
+        model = body.get("model", "mock")
+        with self._lock:
+            self.models[model] += 1
+            self.max_tokens.append(body.get("max_tokens"))
+        content = self.answer(model, prompt) if self.answer else "ans:" + prompt[:20]
+        return {
+            "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": sum(len(m["content"]) for m in body["messages"]),
+                      "completion_tokens": len(content),
+                      "total_tokens": sum(len(m["content"]) for m in body["messages"]) + len(content)},
+        }
+
+    def _completion(self, body: dict) -> dict:
+        prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+        texts = ["ans:" + prompt for prompt in prompts]
+        return {
+            "id": "mock", "object": "text_completion", "created": int(time.time()), "model": body.get("model", "mock"),
+            "choices": [{"index": i, "finish_reason": "stop", "text": text, "logprobs": None}
+                        for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": sum(len(p) for p in prompts),
+                      "completion_tokens": sum(len(t) for t in texts),
+                      "total_tokens": sum(len(p) for p in prompts) + sum(len(t) for t in texts)},
+        }
+
+    def _save_file(self, filename: str, data: bytes, purpose: str) -> dict:
+        with self._lock:
+            self._file_ids += 1
+            file_id = f"file-{self._file_ids}"
+        with open(os.path.join(self._files_dir, file_id), "wb") as f:
+            f.write(data)
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def _read_file(self, file_id: str) -> Optional[bytes]:
+        path = os.path.join(self._files_dir, os.path.basename(file_id))
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _create_batch(self, body: dict) -> dict:
+        with self._lock:
+            batch_id = f"batch-{len(self.batches) + 1}"
+            batch = {
+                "id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                "status": "validating", "created_at": int(time.time()),
+                "output_file_id": None, "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch,), daemon=True).start()
+        return dict(batch)
+
+    def _run_batch(self, batch: dict):
+        """逐行处理批量输入文件，成功的行写入输出文件，失败的行写入错误文件"""
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        end = time.monotonic() + self.batch_delay
+        while time.monotonic() < end:
+            if batch["status"] != "in_progress":
+                batch["status"] = "cancelled"
+                return
+            time.sleep(min(0.01, self.batch_delay))
+        outputs, errors = [], []
+        for line in self._read_file(batch["input_file_id"]).decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if self._should_fail():
+                errors.append({"id": f"resp-{request['custom_id']}", "custom_id": request["custom_id"], "error": None,
+                               "response": {"status_code": 500, "body": {"error": {"message": "mock failure"}}}})
+            else:
+                outputs.append({"id": f"resp-{request['custom_id']}", "custom_id": request["custom_id"], "error": None,
+                                "response": {"status_code": 200, "body": self._chat_completion(request["body"])}})
+        for key, records in (("output_file_id", outputs), ("error_file_id", errors)):
+            if records:
+                data = "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+                batch[key] = self._save_file(f"{batch['id']}_{key}.jsonl", data, "batch_output")["id"]
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs),
+                                   "failed": len(errors)}
+        batch["status"] = "completed"
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self._send_bytes(status, data, "application/json")
+
+            def _send_bytes(self, status: int, data: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _upload(self, data: bytes):
+                """解析multipart/form-data上传的文件"""
+                header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+                message = BytesParser(policy=default_policy).parsebytes(header + data)
+                fields, file_part = {}, None
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    if name == "file":
+                        file_part = part
+                    else:
+                        fields[name] = part.get_content().strip()
+                self._send(200, mock._save_file(file_part.get_filename(), file_part.get_payload(decode=True),
+                                                fields.get("purpose", "batch")))
+
+            def do_GET(self):
+                with mock._lock:
+                    mock.paths[self.path] += 1
+                parts = [p for p in self.path.split("/") if p]
+                if len(parts) == 4 and parts[1] == "files" and parts[3] == "content":
+                    data = mock._read_file(parts[2])
+                    if data is None:
+                        self._send(404, {"error": {"message": f"unknown file {parts[2]}"}})
+                    else:
+                        self._send_bytes(200, data, "application/octet-stream")
+                elif len(parts) == 3 and parts[1] == "batches" and parts[2] in mock.batches:
+                    self._send(200, mock.batches[parts[2]])
+                else:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                with mock._lock:
+                    mock.paths[self.path] += 1
+                if self.path.endswith("/files"):
+                    self._upload(data)
+                    return
+                if self.path.endswith("/cancel"):
+                    batch = mock.batches.get(self.path.split("/")[-2])
+                    if batch is None:
+                        self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                        return
+                    if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                        batch["status"] = "cancelling"
+                    self._send(200, batch)
+                    return
+                body = json.loads(data)
+                if self.path.endswith("/batches"):
+                    self._send(200, mock._create_batch(body))
+                    return
+                with mock._lock:
+                    mock.active += 1
+                    mock.max_active = max(mock.max_active, mock.active)
+                if mock._slots:
+                    mock._slots.acquire()
+                try:
+                    time.sleep(mock.delay)
+                finally:
+                    if mock._slots:
+                        mock._slots.release()
+                    with mock._lock:
+                        mock.active -= 1
+                if mock._should_fail():
+                    self._send(500, {"error": {"message": "mock failure"}})
+                elif self.path.endswith("/chat/completions"):
+                    self._send(200, mock._chat_completion(body))
+                elif self.path.endswith("/completions"):
+                    self._send(200, mock._completion(body))
+                else:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        return Handler
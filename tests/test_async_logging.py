@@ -0,0 +1,74 @@
+import sys
+import json
+import queue
+import logging
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from async_logging import AsyncLogListener, JsonFormatter, RepeatAggregator
+
+
+def make_record(msg, level=logging.ERROR, name='chat_llm'):
+    return logging.LogRecord(name, level, __file__, 0, msg, None, None)
+
+
+class CollectHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestAsyncLogging:
+
+    def test_aggregate_repeats(self):
+        """窗口内同类错误只输出第一条，窗口结束后输出汇总"""
+        now = [0.0]
+        aggregator = RepeatAggregator(window=10, clock=lambda: now[0])
+        assert len(aggregator.process(make_record('LLM调用失败: timeout'))) == 1
+        for i in range(5):
+            assert aggregator.process(make_record(f'LLM调用失败: error {i}')) == []
+        # 不同消息和INFO日志不受影响
+        assert len(aggregator.process(make_record('处理条目失败: x'))) == 1
+        assert len(aggregator.process(make_record('LLM调用失败: y', level=logging.INFO))) == 1
+
+        now[0] = 11.0
+        summaries = aggregator.expired()
+        assert len(summaries) == 1
+        assert summaries[0].getMessage().startswith('LLM调用失败 ×5')
+        assert aggregator.expired() == []
+
+    def test_window_restart(self):
+        """窗口过期后再次出现时，先输出上个窗口的汇总再输出新日志"""
+        now = [0.0]
+        aggregator = RepeatAggregator(window=10, clock=lambda: now[0])
+        aggregator.process(make_record('LLM调用失败: a'))
+        aggregator.process(make_record('LLM调用失败: b'))
+        now[0] = 20.0
+        emitted = aggregator.process(make_record('LLM调用失败: c'))
+        assert emitted[0].getMessage().startswith('LLM调用失败 ×1')
+        assert emitted[1].getMessage() == 'LLM调用失败: c'
+
+    def test_json_formatter(self):
+        """JSON日志每行一个对象"""
+        entry = json.loads(JsonFormatter().format(make_record('你好')))
+        assert entry['message'] == '你好'
+        assert entry['level'] == 'ERROR'
+
+    def test_listener_flushes_on_stop(self):
+        """停止时输出队列中剩余日志和所有汇总"""
+        log_queue = queue.SimpleQueue()
+        handler = CollectHandler()
+        listener = AsyncLogListener(log_queue, [handler], RepeatAggregator(window=60))
+        listener.start()
+        for _ in range(3):
+            log_queue.put(make_record('LLM调用失败: timeout'))
+        listener.stop()
+        messages = [r.getMessage() for r in handler.records]
+        assert messages[0] == 'LLM调用失败: timeout'
+        assert messages[1].startswith('LLM调用失败 ×2')
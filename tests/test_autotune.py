@@ -0,0 +1,81 @@
+import sys
+import json
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from autotune import LevelResult, find_knee, parse_levels
+from chat_llm import ChatLLM
+from dataset_config import DatasetConfig
+import response_processor
+from mock_llm_server import MockLLMServer
+
+
+def level(concurrency, throughput, errors=0):
+    return LevelResult(concurrency, 100, errors, 1.0, throughput, 0.1, 0.2)
+
+
+class TestAutotune:
+
+    def test_find_knee(self):
+        """吞吐提升不足10%时取较小的并发"""
+        results = [level(1, 10), level(2, 20), level(4, 38), level(8, 40), level(16, 41)]
+        assert find_knee(results).concurrency == 4
+
+    def test_find_knee_skips_errors(self):
+        """错误率过高的档位不参与比较"""
+        results = [level(1, 10), level(2, 20), level(4, 60, errors=30)]
+        assert find_knee(results).concurrency == 2
+
+    def test_parse_levels(self):
+        assert parse_levels("8, 2,4") == [2, 4, 8]
+        assert parse_levels("")[0] == 1
+
+    def test_autotune_against_mock(self, tmp_path):
+        """对吞吐上限为4并发的模拟服务压测，拐点为4并发"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(10):
+                f.write(json.dumps({"session": f"s{i}", "query": f"q{i}"}, ensure_ascii=False) + "\n")
+        output_env = tmp_path / "autotune.env"
+
+        with MockLLMServer(delay=0.1, capacity=4) as server:
+            dataset_config = DatasetConfig(
+                input_path=str(input_path),
+                output_path=str(tmp_path / "out.jsonl"),
+                input_columns=["session", "query"],
+                output_column="answer",
+            )
+            chat_llm = ChatLLM(server.url, "test1", response_processor.simple_response_processor,
+                               {"model": "mock", "max_tokens": 16}, dataset_config)
+            settings = chat_llm.autotune(levels=[2, 4, 8, 16], samples=10, requests_per_level=32,
+                                         output_path=str(output_env), min_gain=0.25)
+
+        assert settings == {"MAX_THREAD_NUM": 4, "BATCH_SIZE": 8}
+        snippet = output_env.read_text(encoding="utf-8")
+        assert "MAX_THREAD_NUM=4" in snippet
+        assert "BATCH_SIZE=8" in snippet
+
+    def test_autotune_pool_not_limited_by_threads(self, tmp_path):
+        """压测的连接池按最高并发档位设置，不受MAX_THREAD_NUM限制"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(10):
+                f.write(json.dumps({"session": f"s{i}", "query": f"q{i}"}, ensure_ascii=False) + "\n")
+
+        with MockLLMServer(delay=0.1, capacity=8) as server:
+            dataset_config = DatasetConfig(
+                input_path=str(input_path),
+                output_path=str(tmp_path / "out.jsonl"),
+                input_columns=["session", "query"],
+                output_column="answer",
+                max_thread_num=2,
+            )
+            chat_llm = ChatLLM(server.url, "test1", response_processor.simple_response_processor,
+                               {"model": "mock", "max_tokens": 16}, dataset_config)
+            settings = chat_llm.autotune(levels=[2, 8], samples=10, requests_per_level=32,
+                                         output_path=str(tmp_path / "autotune.env"), min_gain=0.25)
+
+        assert settings["MAX_THREAD_NUM"] == 8
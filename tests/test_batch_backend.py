@@ -0,0 +1,137 @@
+import sys
+import json
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from batch_backend import BatchApiBatcher
+from main import init_chat_llm
+from mock_llm_server import MockLLMServer
+
+
+class TestBatchBackend:
+
+    def test_parse_result(self):
+        """解析批量输出文件中的成功和失败记录"""
+        ok = {"custom_id": "req-0", "response": {"status_code": 200, "body": {
+            "choices": [{"message": {"content": " hi "}}]}}}
+        failed = {"custom_id": "req-1", "response": {"status_code": 500, "body": {"error": "x"}}}
+        assert BatchApiBatcher._parse_result(ok) == "hi"
+        assert not isinstance(BatchApiBatcher._parse_result(failed), str)
+
+    def test_process_dataset(self, tmp_path):
+        """请求经批量任务处理后写入输出文件，失败的请求自动进入后续批量任务"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(30):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": "q"}) + "\n")
+
+        with MockLLMServer(delay=0.05, fail_rate=0.2) as server:
+            chat_llm = init_chat_llm({
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"),
+                "MAX_THREAD_NUM": 30, "BATCH_SIZE": 30, "LLM_BACKEND": "batch",
+                "BATCH_API_MAX_REQUESTS": 10, "BATCH_API_WAIT": 0.05, "BATCH_API_POLL_INTERVAL": 0.02,
+            })
+            chat_llm.process_dataset()
+            batches = list(server.batches.values())
+            assert not server.paths["/v1/chat/completions"]
+
+        with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        assert sorted(row["id"] for row in rows) == list(range(30))
+        assert all(row["answer"].startswith("ans:") for row in rows)
+        assert all(batch["request_counts"]["total"] <= 10 for batch in batches)
+        # 失败的请求在之后的批量任务中重新提交
+        assert sum(batch["request_counts"]["total"] for batch in batches) > 30
+
+    def test_request_timeout_ignored(self, tmp_path):
+        """batch后端忽略单次请求超时，批量任务周转期间不会重复提交"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(5):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": "q"}) + "\n")
+
+        with MockLLMServer(delay=0.01) as server:
+            init_chat_llm({
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"),
+                "LLM_BACKEND": "batch", "REQUEST_TIMEOUT": 0.5,
+                "BATCH_API_MAX_REQUESTS": 5, "BATCH_API_WAIT": 0.05, "BATCH_API_POLL_INTERVAL": 1,
+            }).process_dataset()
+            batches = list(server.batches.values())
+
+        with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+            assert len(f.readlines()) == 5
+        assert sum(batch["request_counts"]["total"] for batch in batches) == 5
+
+    def test_timeout_removes_queued_request(self):
+        """等待超时的请求从队列中移除，不会进入之后的批量任务"""
+        batcher = BatchApiBatcher(client=None, system_prompt="", max_wait=60)
+        with pytest.raises(FutureTimeoutError):
+            batcher.complete("p", {"model": "m"}, timeout=0.05)
+        assert not batcher._queue
+        batcher.close()
+
+    def test_run_deadline_cancels_batches(self, tmp_path):
+        """到达运行截止时间时取消在途的批量任务，不等待其完成，未完成的行写入死信文件"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(5):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": "q"}) + "\n")
+
+        with MockLLMServer(batch_delay=30) as server:
+            start = time.monotonic()
+            init_chat_llm({
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"),
+                "LLM_BACKEND": "batch", "RUN_DEADLINE": 1,
+                "BATCH_API_MAX_REQUESTS": 5, "BATCH_API_WAIT": 0.05, "BATCH_API_POLL_INTERVAL": 5,
+            }).process_dataset()
+            elapsed = time.monotonic() - start
+            batches = list(server.batches.values())
+
+        assert elapsed < 4
+        assert [batch["status"] for batch in batches] == ["cancelled"]
+        with open(tmp_path / "out.dead_letter.jsonl", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 5
+        assert all(record["reason"] == "deadline" for record in records)
+
+    def test_close_cancels_queued_requests(self):
+        """close时队列中的请求以异常结束"""
+        batcher = BatchApiBatcher(client=None, system_prompt="", max_wait=60)
+        future = batcher.submit("p", {"model": "m"})
+        batcher.close()
+        with pytest.raises(RuntimeError):
+            future.result(1)
+
+    def test_batch_not_limited_by_threads(self, tmp_path):
+        """等待批量任务的行不占用工作线程，一个批量任务可以包含多于MAX_THREAD_NUM的请求"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(20):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": "q"}) + "\n")
+
+        with MockLLMServer(delay=0.01) as server:
+            init_chat_llm({
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"),
+                "MAX_THREAD_NUM": 2, "BATCH_SIZE": 20, "LLM_BACKEND": "batch",
+                "BATCH_API_MAX_REQUESTS": 20, "BATCH_API_WAIT": 5, "BATCH_API_POLL_INTERVAL": 0.02,
+            }).process_dataset()
+            batches = list(server.batches.values())
+
+        assert [batch["request_counts"]["total"] for batch in batches] == [20]
+        with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+            assert len(f.readlines()) == 20
@@ -0,0 +1,146 @@
+import sys
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from columnar_io import ColumnarFileTask, ColumnarWriter, iter_columnar
+from mock_llm_server import MockLLMServer
+
+
+def make_table(rows: int):
+    return pa.table({
+        "id": list(range(rows)),
+        "session": [f"s{i}" for i in range(rows)],
+        "query": ["q"] * rows,
+        "blob": [b"x" * 100] * rows,
+    })
+
+
+class TestColumnarIO:
+
+    def test_read_projection(self, tmp_path):
+        """只读取输入列，不存在的列跳过"""
+        path = str(tmp_path / "in.parquet")
+        pq.write_table(make_table(25), path, row_group_size=10)
+        rows = list(iter_columnar(path, ["session", "query", "missing"], max_rows=12))
+        assert len(rows) == 12
+        assert rows[11][0] == {"session": "s11", "query": "q"}
+
+    def test_writer_reorders_and_drops_failed(self, tmp_path):
+        """乱序到达的结果按输入行组顺序写出，失败的行不写出"""
+        input_path = str(tmp_path / "in.parquet")
+        output_path = str(tmp_path / "out.parquet")
+        pq.write_table(make_table(25), input_path, row_group_size=10)
+        writer = ColumnarWriter(output_path, input_path, ["session", "query"], ["answer"])
+        for index in reversed(range(25)):
+            if index == 3:
+                writer.skip(index)
+            else:
+                writer.write_row(index, {"answer": {"n": index}})
+        writer.close()
+
+        result = pq.ParquetFile(output_path)
+        assert [result.metadata.row_group(i).num_rows for i in range(result.num_row_groups)] == [9, 10, 5]
+        table = result.read()
+        assert table.column_names == ["id", "session", "query", "blob", "answer"]
+        assert table["id"].to_pylist() == [i for i in range(25) if i != 3]
+        assert table["answer"][0].as_py() == '{"n": 0}'
+
+    def test_writer_held_rows(self, tmp_path):
+        """第一个未完成行组之后的结果计为暂存行，行组写出后不再计入"""
+        input_path = str(tmp_path / "in.parquet")
+        pq.write_table(make_table(25), input_path, row_group_size=10)
+        writer = ColumnarWriter(str(tmp_path / "out.parquet"), input_path, ["session", "query"], ["answer"])
+        for index in range(1, 15):
+            writer.write_row(index, {"answer": "a"})
+        assert writer.held == 5
+        writer.write_row(0, {"answer": "a"})
+        assert writer.held == 0
+        writer.close()
+
+    def test_task_abort_removes_partial_file(self, tmp_path):
+        """异常退出时不写出暂存的行组，删除已写出一部分行组的输出文件"""
+        input_path = str(tmp_path / "in.parquet")
+        output_path = tmp_path / "out.parquet"
+        pq.write_table(make_table(25), input_path, row_group_size=10)
+        task = ColumnarFileTask(input_path, str(output_path), ["session", "query"], ["answer"])
+        task.open()
+        for index in range(15):
+            task.handle.write_row(index, {"answer": "a"})
+        assert output_path.exists()
+        task.abort()
+        assert task.handle is None
+        assert not output_path.exists()
+
+
+class TestColumnarDataset:
+
+    def test_parquet_join_original(self, llm_job, tmp_path):
+        """Parquet输入输出：按输入行组写出，输出列拼接到原文件的所有列上"""
+        pq.write_table(make_table(25), str(tmp_path / "in.parquet"), row_group_size=10)
+        with MockLLMServer() as server:
+            llm_job.run(server.url, INPUT_PATH=str(tmp_path / "in.parquet"), OUTPUT_PATH=str(tmp_path / "out.parquet"))
+
+        result = pq.ParquetFile(str(tmp_path / "out.parquet"))
+        assert result.num_row_groups == 3
+        table = result.read()
+        assert table["id"].to_pylist() == list(range(25))
+        assert table["blob"].to_pylist() == [b"x" * 100] * 25
+        assert all(answer.startswith("ans:") for answer in table["answer"].to_pylist())
+
+    def test_arrow_projection_only(self, llm_job, tmp_path):
+        """Arrow IPC输入输出：不拼接原始列时只保留输入列和输出列，max_rows之后的行不写出"""
+        table = make_table(25)
+        with pa.ipc.new_file(str(tmp_path / "in.arrow"), table.schema) as writer:
+            writer.write_table(table, max_chunksize=10)
+        with MockLLMServer() as server:
+            llm_job.run(server.url, INPUT_PATH=str(tmp_path / "in.arrow"), OUTPUT_PATH=str(tmp_path / "out.arrow"),
+                        JOIN_ORIGINAL_COLUMNS=False, MAX_ROWS=15)
+
+        table = pa.ipc.open_file(str(tmp_path / "out.arrow")).read_all()
+        assert table.column_names == ["session", "query", "answer"]
+        assert table["session"].to_pylist() == [f"s{i}" for i in range(15)]
+
+    def test_parquet_to_jsonl(self, llm_job, tmp_path):
+        """Parquet输入、JSONL输出时逐行写出读取的输入列和输出列"""
+        pq.write_table(make_table(5), str(tmp_path / "in.parquet"))
+        with MockLLMServer() as server:
+            llm_job.run(server.url, INPUT_PATH=str(tmp_path / "in.parquet"))
+        rows = llm_job.read()
+        assert len(rows) == 5
+        assert "blob" not in rows[0]
+
+    def test_slow_row_bounds_later_groups(self, llm_job, tmp_path):
+        """较早行组中的行很慢时，之后行组暂存的结果计入BATCH_SIZE，不再继续提交新行"""
+        slow = threading.Event()
+
+        def answer(model, prompt):
+            if "SLOW" in prompt:
+                slow.wait(5)
+            return "ans"
+
+        table = make_table(60)
+        table = table.set_column(2, "query", pa.array(["SLOW"] + ["q"] * 59))
+        pq.write_table(table, str(tmp_path / "in.parquet"), row_group_size=5)
+        with MockLLMServer(answer=answer) as server:
+            chat_llm = llm_job.build(server.url, INPUT_PATH=str(tmp_path / "in.parquet"),
+                                     OUTPUT_PATH=str(tmp_path / "out.parquet"), MAX_THREAD_NUM=8, BATCH_SIZE=8)
+            worker = threading.Thread(target=chat_llm.process_dataset)
+            worker.start()
+            time.sleep(1)
+            submitted = server.paths["/v1/chat/completions"]
+            slow.set()
+            worker.join(10)
+
+        assert submitted <= 5 + 8
+        assert pq.read_table(str(tmp_path / "out.parquet"))["id"].to_pylist() == list(range(60))
@@ -0,0 +1,87 @@
+import sys
+import json
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from chat_llm import ChatLLM
+from completion_batcher import CompletionBatcher
+from dataset_config import DatasetConfig
+import response_processor
+from mock_llm_server import MockLLMServer
+
+
+class TestCompletionBatcher:
+
+    def test_completions_backend(self, tmp_path):
+        """多行prompt合并为少量completions请求，结果分发回各自的行"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(40):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": f"q{i}"}, ensure_ascii=False) + "\n")
+        output_path = tmp_path / "out.jsonl"
+
+        with MockLLMServer(delay=0.05) as server:
+            dataset_config = DatasetConfig(
+                input_path=str(input_path),
+                output_path=str(output_path),
+                input_columns=["session", "query"],
+                output_column="answer",
+                output_prompt_column="prompt",
+                max_thread_num=40,
+            )
+            chat_llm = ChatLLM(server.url, "test1", response_processor.simple_response_processor,
+                               {"model": "mock", "max_tokens": 16}, dataset_config,
+                               backend="completions", completions_batch_size=8, completions_batch_wait=0.05)
+            chat_llm.process_dataset()
+            paths = dict(server.paths)
+
+        rows = [json.loads(line) for line in open(output_path, encoding="utf-8")]
+        assert len(rows) == 40
+        for row in rows:
+            assert row["answer"] == ("ans:" + row["prompt"]).strip()
+        assert "/v1/chat/completions" not in paths
+        assert paths["/v1/completions"] <= 10
+
+
+class FakeCompletions:
+    """记录每次completions请求的生成参数和prompt数"""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, prompt, **config):
+        self.calls.append((config.get("max_tokens"), len(prompt)))
+        return SimpleNamespace(choices=[SimpleNamespace(index=i, text=p) for i, p in enumerate(prompt)])
+
+
+class TestCompletionBatcherUnit:
+
+    def test_max_tokens_not_merged(self):
+        """max_tokens不同的prompt分别发送，不会被同一批中较小的max_tokens截断"""
+        client = SimpleNamespace(completions=FakeCompletions())
+        batcher = CompletionBatcher(client, batch_size=8, max_wait=0.2)
+        configs = [{"model": "m", "max_tokens": 100}] * 3 + [{"model": "m", "max_tokens": 10}]
+        threads = [threading.Thread(target=batcher.complete, args=(f"p{i}", config))
+                   for i, config in enumerate(configs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.close()
+        assert sorted(client.completions.calls) == [(10, 1), (100, 3)]
+
+    def test_close_and_restart(self):
+        """close停止后台线程，之后再提交时重新启动"""
+        client = SimpleNamespace(completions=FakeCompletions())
+        batcher = CompletionBatcher(client, batch_size=1)
+        assert batcher.complete("a", {"model": "m"}) == "a"
+        thread = batcher._thread
+        batcher.close()
+        assert not thread.is_alive() and batcher._thread is None
+        assert batcher.complete("b", {"model": "m"}) == "b"
+        batcher.close()
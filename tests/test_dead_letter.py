@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from dead_letter import DeadLetterWriter, RowStatus, default_dead_letter_path, iter_dead_letters
+from main import init_chat_llm
+from mock_llm_server import MockLLMServer
+
+
+class TestDeadLetter:
+
+    def test_default_path(self):
+        """默认死信文件保存在输出文件或输出目录旁"""
+        assert default_dead_letter_path('/data/out.jsonl') == '/data/out.dead_letter.jsonl'
+        assert default_dead_letter_path('/data/out_dir' + os.sep) == '/data/out_dir.dead_letter.jsonl'
+
+    def test_write_and_read(self, tmp_path):
+        """死信记录包含失败原因、累计调用次数和最后一次原始响应"""
+        path = str(tmp_path / 'dead.jsonl')
+        status = RowStatus()
+        status.attempts = 5
+        status.last_response = '<|wrong data|>'
+
+        writer = DeadLetterWriter(path)
+        writer.write({"query": "q"}, "wrong_data", status, '/data/out.jsonl', prior_attempts=3)
+        writer.close()
+
+        records = [record for record, _ in iter_dead_letters(path)]
+        assert records == [{
+            "reason": "wrong_data",
+            "attempts": 8,
+            "last_response": '<|wrong data|>',
+            "output_path": '/data/out.jsonl',
+            "row": {"query": "q"},
+        }]
+        assert writer.reasons["wrong_data"] == 1
+
+    def test_no_failures_no_file(self, tmp_path):
+        """没有失败行时不创建死信文件"""
+        path = str(tmp_path / 'dead.jsonl')
+        DeadLetterWriter(path).close()
+        assert not os.path.exists(path)
+
+    def test_retry_keeps_unretried_records(self, tmp_path):
+        """受max_rows限制未重跑的死信记录原样保留"""
+        dead_letter_path = tmp_path / 'out.dead_letter.jsonl'
+        records = [{"reason": "wrong_data", "attempts": 5, "last_response": f"resp{i}",
+                    "output_path": str(tmp_path / 'out.jsonl'), "row": {"session": f"s{i}", "query": "q"},
+                    "extra": i} for i in range(3)]
+        lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+        dead_letter_path.write_text("".join(lines), encoding="utf-8")
+
+        with MockLLMServer() as server:
+            init_chat_llm({
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                "OUTPUT_PATH": str(tmp_path / 'out.jsonl'), "MAX_ROWS": 1,
+            }).retry_dead_letter()
+
+        assert dead_letter_path.read_text(encoding="utf-8") == "".join(lines[1:])
+        assert len((tmp_path / 'out.jsonl').read_text(encoding="utf-8").splitlines()) == 1
@@ -0,0 +1,79 @@
+import sys
+import json
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from mock_llm_server import MockLLMServer
+
+
+class TestDeadlines:
+
+    def test_run_deadline(self, llm_job):
+        """到达运行截止时间后停止读取输入，在途的行写入死信文件，未读取的行记录断点而不写入死信文件"""
+        llm_job.write_rows(40)
+        with MockLLMServer(delay=0.2) as server:
+            chat_llm = llm_job.build(server.url, BATCH_SIZE=4, RUN_DEADLINE=0.5)
+            start = time.monotonic()
+            chat_llm.process_dataset()
+            elapsed = time.monotonic() - start
+
+        done = llm_job.read()
+        dead = llm_job.read(llm_job.dead_letter_path)
+        assert 0 < len(done) < 40
+        assert len(done) + len(dead) < 40
+        assert {record["reason"] for record in dead} <= {"deadline"}
+        assert elapsed < 2
+
+        with open(llm_job.tmp_path / "out.dead_letter.resume.json", encoding="utf-8") as f:
+            [point] = json.load(f)["files"]
+        assert point["rows_done"] == len(done) + len(dead)
+        assert point["complete"] is False
+
+    def test_resume_after_run_deadline(self, llm_job):
+        """RESUME从断点继续，跳过已读取的行，输出和死信追加到已有文件"""
+        llm_job.write_rows(40)
+        with MockLLMServer(delay=0.2) as server:
+            llm_job.run(server.url, BATCH_SIZE=4, RUN_DEADLINE=0.5)
+        first_done = llm_job.read()
+        first_dead = llm_job.read(llm_job.dead_letter_path)
+
+        with MockLLMServer(delay=0.01) as server:
+            llm_job.build(server.url).process_dataset(resume=True)
+
+        done = llm_job.read()
+        dead = llm_job.read(llm_job.dead_letter_path)
+        assert done[:len(first_done)] == first_done
+        assert dead[:len(first_dead)] == first_dead
+        assert sorted([row["id"] for row in done] + [record["row"]["id"] for record in dead]) == list(range(40))
+        assert not (llm_job.tmp_path / "out.dead_letter.resume.json").exists()
+
+    def test_row_deadline(self, llm_job):
+        """单行截止时间覆盖所有重试"""
+        llm_job.write_rows(4)
+        with MockLLMServer(delay=1.0) as server:
+            start = time.monotonic()
+            llm_job.run(server.url, ROW_DEADLINE=0.3)
+            elapsed = time.monotonic() - start
+
+        dead = llm_job.read(llm_job.dead_letter_path)
+        assert len(dead) == 4
+        assert {record["reason"] for record in dead} == {"deadline"}
+        assert elapsed < 1
+
+    def test_row_deadline_retries_with_backoff(self, llm_job):
+        """设置截止时间时，失败的请求按指数退避重试到截止时间，而不是只重试固定次数"""
+        llm_job.write_rows(1)
+        with MockLLMServer(fail_rate=1.0) as server:
+            start = time.monotonic()
+            llm_job.run(server.url, ROW_DEADLINE=2)
+            elapsed = time.monotonic() - start
+            requests = server.requests
+
+        dead = llm_job.read(llm_job.dead_letter_path)
+        assert [record["reason"] for record in dead] == ["deadline"]
+        assert requests > 5
+        assert 1.5 < elapsed < 3
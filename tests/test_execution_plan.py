@@ -0,0 +1,144 @@
+import sys
+import pickle
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from execution_plan import ColumnGetter, compile_plan, count_placeholders
+import response_processor
+from mock_llm_server import MockLLMServer
+
+
+class TestExecutionPlan:
+
+    def test_count_placeholders(self):
+        """位置占位符计数，转义的大括号不计入"""
+        assert count_placeholders('k', 'a {0} b {1} {{json}}') == 2
+        assert count_placeholders('k', '{} and {}') == 2
+        with pytest.raises(ValueError):
+            count_placeholders('k', '输出 {"a": 1}')
+        with pytest.raises(ValueError):
+            count_placeholders('k', '{0} {2}')
+
+    def test_column_getter(self):
+        """单列与多列都返回元组，且可被pickle"""
+        row = {"a": 1, "b": 2}
+        assert ColumnGetter(['a'])(row) == (1,)
+        getter = pickle.loads(pickle.dumps(ColumnGetter(['b', 'a'])))
+        assert getter(row) == (2, 1)
+        with pytest.raises(KeyError):
+            ColumnGetter(['c'])(row)
+
+    def test_single_prompt_multi_outputs(self):
+        """模式二：单个prompt对应多个输出"""
+        plan = compile_plan(['test1'],
+                            [response_processor.simple_response_processor,
+                             response_processor.test_111_response_processor1],
+                            ['a', 'b'], ['session', 'query'], ['p'])
+        node, = plan.nodes
+        assert node.prompt_column == 'p'
+        assert not node.retry_on_reject
+        assert plan.output_columns == ['a', 'b']
+
+    def test_multi_prompt_shared_processor(self):
+        """模式三：单个处理器复制到所有prompt"""
+        plan = compile_plan(['test1', 'test2'], [response_processor.simple_response_processor],
+                            ['a', 'b'], ['session', 'query'])
+        assert [node.outputs[0][1] for node in plan.nodes] == ['a', 'b']
+        assert all(node.retry_on_reject and node.prompt_column is None for node in plan.nodes)
+
+    def test_grouped(self):
+        """模式四：每个prompt一组输出"""
+        proc = response_processor.simple_response_processor
+        plan = compile_plan(['test1', 'test2'], [[proc, proc], [proc]],
+                            [['a', 'b'], ['c']], ['session', 'query'], grouped=True)
+        assert plan.output_columns == ['a', 'b', 'c']
+        with pytest.raises(ValueError):
+            compile_plan(['test1', 'test2'], [[proc], [proc]], [['a', 'b'], ['c']],
+                         ['session', 'query'], grouped=True)
+
+    def test_invalid_config(self):
+        """未知prompt、输入列数量不符时启动即报错"""
+        proc = response_processor.simple_response_processor
+        with pytest.raises(ValueError):
+            compile_plan(['missing'], [proc], ['a'], ['session', 'query'])
+        with pytest.raises(ValueError):
+            compile_plan(['test1'], [proc], ['a'], ['query'])
+
+    def test_chained_stages(self):
+        """下游prompt的输入列引用上游的输出列时，按依赖关系排序"""
+        proc = response_processor.simple_response_processor
+        plan = compile_plan(['test2', 'test1'], [proc], ['critique', 'answer'], [],
+                            prompt_input_columns=[['query', 'answer'], ['session', 'query']])
+        assert plan.prompt_keys == ['test1', 'test2']
+        assert plan.nodes[1].depends_on == ('test1',)
+        assert plan.nodes[1].upstream_columns == frozenset(['answer'])
+        assert plan.source_columns == ['session', 'query']
+
+    def test_cyclic_stages(self):
+        """循环依赖在启动时报错"""
+        proc = response_processor.simple_response_processor
+        with pytest.raises(ValueError):
+            compile_plan(['test1', 'test2'], [proc], ['a', 'b'], [],
+                         prompt_input_columns=[['query', 'b'], ['query', 'a']])
+
+
+class TestChainedStagesEndToEnd:
+    """PROMPT_INPUT_COLUMNS串联的多阶段prompt在ChatLLM中端到端运行"""
+
+    @staticmethod
+    def _answer(prompt):
+        # test2的输入为 (query, answer)，test1的输入为 (session, query)
+        if "请生成回答" in prompt:
+            return "critique"
+        query = prompt.split("用户查询(query)**：")[1].split("\n")[0]
+        if query == "fail":
+            return ""
+        if query == "long":
+            return "长" * 3000
+        return f"answer-{query}"
+
+    def _run(self, llm_job, queries, **config):
+        llm_job.write_rows(len(queries), lambda i: {"id": i, "session": f"s{i}", "query": queries[i]})
+        prompts = []
+
+        def record(model, prompt):
+            prompts.append(prompt)
+            return self._answer(prompt)
+
+        with MockLLMServer(answer=record) as server:
+            llm_job.run(server.url, PROMPT_KEY="test1,test2", OUTPUT_COLUMN="answer,critique", INPUT_COLUMNS=None,
+                        PROMPT_INPUT_COLUMNS="[session,query],[query,answer]", MAX_TOKENS=256,
+                        OVERSIZE_PATH=str(llm_job.tmp_path / "oversize.jsonl"), **config)
+        oversize = llm_job.read(llm_job.tmp_path / "oversize.jsonl")
+        return llm_job.read(), llm_job.read(llm_job.dead_letter_path), oversize, prompts
+
+    def test_upstream_output_feeds_downstream(self, llm_job):
+        """下游prompt渲染时读取上游刚写入的输出列"""
+        done, dead, _, prompts = self._run(llm_job, ["q0", "q1"])
+        assert sorted((row["answer"], row["critique"]) for row in done) == [
+            ("answer-q0", "critique"), ("answer-q1", "critique")]
+        assert dead == []
+        downstream = [prompt for prompt in prompts if "请生成回答" in prompt]
+        assert sorted(prompt.split("用户查询(query)**：")[1].split("\n")[0] for prompt in downstream) == [
+            "answer-q0", "answer-q1"]
+
+    def test_upstream_failure_skips_downstream(self, llm_job):
+        """上游阶段失败时不发送下游请求，该行写入死信文件"""
+        done, dead, _, prompts = self._run(llm_job, ["q0", "fail"])
+        assert [row["id"] for row in done] == [0]
+        assert [(record["row"]["id"], record["reason"]) for record in dead] == [(1, "processor_rejected")]
+        assert len([prompt for prompt in prompts if "请生成回答" in prompt]) == 1
+
+    def test_oversized_downstream_prompt(self, llm_job):
+        """上游输出使下游prompt超出上下文时，不发送下游请求，该行写入超长文件而不写入输出"""
+        done, dead, oversize, prompts = self._run(llm_job, ["q0", "long"],
+                                                  MODEL_CONTEXT_LENGTH=2000, MIN_OUTPUT_TOKENS=64)
+        assert [row["id"] for row in done] == [0]
+        assert dead == []
+        assert [(record["row"]["id"], record["oversized_prompt_keys"]) for record in oversize] == [(1, ["test2"])]
+        assert len(prompts) == 3
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import chat_llm as chat_llm_module
+from dataset_config import DatasetConfig
+from file_tasks import FileTask, interleave_rows
+from mock_llm_server import MockLLMServer
+
+
+def _write_jsonl(path, num_rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_rows):
+            f.write(json.dumps({"id": i}) + "\n")
+
+
+def _read_rows(path):
+    with open(path, 'rb') as f:
+        for line in f:
+            yield json.loads(line), len(line)
+
+
+class TestFileTasks:
+
+    def test_resolve_directory(self, tmp_path):
+        """输入为目录时递归查找jsonl文件，输出保持相对路径"""
+        _write_jsonl(str(tmp_path / 'in' / 'a' / 'part-0.jsonl'), 2)
+        _write_jsonl(str(tmp_path / 'in' / 'b' / 'part-1.jsonl'), 2)
+        config = DatasetConfig(str(tmp_path / 'in'), str(tmp_path / 'out'), ['id'], 'answer')
+
+        pairs = config.resolve_input_files()
+        assert [os.path.relpath(o, tmp_path) for _, o in pairs] == [
+            os.path.join('out', 'a', 'part-0.jsonl'),
+            os.path.join('out', 'b', 'part-1.jsonl'),
+        ]
+
+    def test_resolve_glob(self, tmp_path):
+        """输入为glob模式时以通配符之前的目录为根目录"""
+        _write_jsonl(str(tmp_path / 'in' / 'a' / 'part-0.jsonl'), 1)
+        _write_jsonl(str(tmp_path / 'in' / 'a' / 'other.jsonl'), 1)
+        config = DatasetConfig(str(tmp_path / 'in' / '*' / 'part-*.jsonl'), str(tmp_path / 'out'), ['id'], 'answer')
+
+        pairs = config.resolve_input_files()
+        assert len(pairs) == 1
+        assert pairs[0][1] == os.path.join(str(tmp_path / 'out'), 'a', 'part-0.jsonl')
+
+    def test_interleave_rows(self, tmp_path):
+        """多个文件的数据行轮流读取，max_rows为合计行数"""
+        tasks = []
+        for name, num_rows in (('a', 3), ('b', 1)):
+            _write_jsonl(str(tmp_path / f'{name}.jsonl'), num_rows)
+            tasks.append(FileTask(str(tmp_path / f'{name}.jsonl'), str(tmp_path / 'out' / f'{name}.jsonl')))
+
+        order = [task.input_path[-7] for _, _, task in interleave_rows(tasks, _read_rows, max_open_files=2)]
+        assert order == ['a', 'b', 'a', 'a']
+        assert all(task.exhausted for task in tasks)
+
+        for task in tasks:
+            task.abort()
+        limited = list(interleave_rows([FileTask(t.input_path, t.output_path) for t in tasks], _read_rows, max_rows=2))
+        assert len(limited) == 2
+
+
+class TestMultiFileProcessing:
+    """输入为目录或glob模式时，process_dataset的端到端行为"""
+
+    @staticmethod
+    def _write_inputs(llm_job, num_files, num_rows):
+        os.makedirs(llm_job.tmp_path / 'in', exist_ok=True)
+        for f in range(num_files):
+            llm_job.write_rows(num_rows, lambda i: {"file": f, "id": i, "session": "", "query": f"f{f}-q{i}"},
+                               path=llm_job.tmp_path / 'in' / f'part-{f}.jsonl')
+
+    @staticmethod
+    def _run(llm_job, monkeypatch, input_path, answer=None, **config):
+        pools = []
+
+        class CountingExecutor(chat_llm_module.ThreadPoolExecutor):
+            def __init__(self, *args, **kw):
+                pools.append(self)
+                super().__init__(*args, **kw)
+
+        monkeypatch.setattr(chat_llm_module, "ThreadPoolExecutor", CountingExecutor)
+        with MockLLMServer(delay=0.02, answer=answer) as server:
+            llm_job.run(server.url, INPUT_PATH=str(input_path), OUTPUT_PATH=str(llm_job.tmp_path / 'out'), **config)
+            return pools, server.requests
+
+    def test_directory_shares_one_pool(self, llm_job, monkeypatch):
+        """目录下的所有文件共用一个线程池，每个输入文件写出一个对应的输出文件"""
+        self._write_inputs(llm_job, 3, 5)
+        pools, requests = self._run(llm_job, monkeypatch, llm_job.tmp_path / 'in')
+
+        assert len(pools) == 1
+        assert requests == 15
+        for f in range(3):
+            rows = llm_job.read(llm_job.tmp_path / 'out' / f'part-{f}.jsonl')
+            assert sorted(row["id"] for row in rows) == list(range(5))
+            assert {row["file"] for row in rows} == {f}
+            assert all(row["answer"] for row in rows)
+
+    def test_glob_max_rows(self, llm_job, monkeypatch):
+        """MAX_ROWS为所有文件合计的行数，各文件轮流读取"""
+        self._write_inputs(llm_job, 3, 5)
+        pools, requests = self._run(llm_job, monkeypatch, llm_job.tmp_path / 'in' / 'part-*.jsonl', MAX_ROWS=6)
+
+        assert len(pools) == 1
+        assert requests == 6
+        for f in range(3):
+            rows = llm_job.read(llm_job.tmp_path / 'out' / f'part-{f}.jsonl')
+            assert sorted(row["id"] for row in rows) == [0, 1]
+
+    def test_dead_letter_records_output_file(self, llm_job, monkeypatch):
+        """失败的行写入同一个死信文件，每条记录指向该行所属的输出文件"""
+        self._write_inputs(llm_job, 2, 3)
+
+        def answer(model, prompt):
+            return "" if "f1-q2" in prompt else "ok"
+
+        self._run(llm_job, monkeypatch, llm_job.tmp_path / 'in', answer=answer)
+
+        assert len(llm_job.read(llm_job.tmp_path / 'out' / 'part-0.jsonl')) == 3
+        assert sorted(row["id"] for row in llm_job.read(llm_job.tmp_path / 'out' / 'part-1.jsonl')) == [0, 1]
+        dead = llm_job.read(llm_job.tmp_path / 'out.dead_letter.jsonl')
+        assert [(record["row"]["file"], record["row"]["id"]) for record in dead] == [(1, 2)]
+        assert dead[0]["output_path"] == str(llm_job.tmp_path / 'out' / 'part-1.jsonl')
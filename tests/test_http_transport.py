@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from http_transport import HttpTimingStats, build_http_client
+
+
+class TestHttpTransport:
+
+    def test_pool_sized_to_concurrency(self):
+        """未配置连接池大小时，连接池大小与并发数相同"""
+        client = build_http_client({}, default_pool_size=64)
+        pool = client._transport._pool
+        assert pool._max_connections == 64
+        assert pool._max_keepalive_connections == 64
+
+    def test_pool_size_override(self):
+        """显式配置的连接池大小优先"""
+        client = build_http_client({"max_connections": 16, "keepalive_expiry": 5}, default_pool_size=64)
+        pool = client._transport._pool
+        assert pool._max_connections == 16
+        assert pool._keepalive_expiry == 5
+
+    def test_timing_stats_split(self):
+        """trace事件被拆分为连接池等待、建连和服务端耗时"""
+        stats = HttpTimingStats()
+
+        class FakeRequest:
+            extensions = {}
+
+        request = FakeRequest()
+        stats.on_request(request)
+        trace = request.extensions["trace"]
+        trace("connection.connect_tcp.started", {})
+        trace("connection.connect_tcp.complete", {})
+        trace("http11.send_request_headers.started", {})
+        trace("http11.receive_response_headers.complete", {})
+
+        summary = stats.summary()
+        assert summary["requests"] == 1
+        assert summary["new_connections"] == 1
+        assert summary["server"]["mean"] >= 0
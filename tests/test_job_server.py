@@ -0,0 +1,131 @@
+import sys
+import json
+import time
+import threading
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from job_server import FairShareLimiter, JobServer, JOB_DONE
+from main import init_chat_llm, run_job
+from mock_llm_server import MockLLMServer
+
+
+def contend(limiter, jobs, total, threads_per_job=4, hold=0.002):
+    """每个任务用多个线程持续请求名额，返回前total次分配给各任务的顺序"""
+    grants = []
+    lock = threading.Lock()
+
+    def worker(job_id):
+        while True:
+            with limiter.gate(job_id):
+                with lock:
+                    if len(grants) >= total:
+                        return
+                    grants.append(job_id)
+                time.sleep(hold)
+
+    threads = [threading.Thread(target=worker, args=(job_id,)) for job_id in jobs for _ in range(threads_per_job)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return grants
+
+
+class TestFairShareLimiter:
+
+    def test_weighted_share(self):
+        """同一优先级内，请求份额与权重成正比"""
+        limiter = FairShareLimiter(1)
+        limiter.register("a", weight=3)
+        limiter.register("b", weight=1)
+        counts = Counter(contend(limiter, ["a", "b"], 200))
+        assert 0.65 < counts["a"] / 200 < 0.85
+        assert limiter.in_flight == 0
+
+    def test_priority(self):
+        """高优先级任务有等待的请求时优先分配"""
+        limiter = FairShareLimiter(1)
+        limiter.register("low", priority=0)
+        limiter.register("high", priority=1)
+        grants = contend(limiter, ["high", "low"], 100)
+        assert Counter(grants[:90])["low"] <= 2
+
+
+class TestJobServer:
+
+    def test_jobs_over_http(self, tmp_path):
+        """通过HTTP提交多个任务，共享客户端，查询进度"""
+        with MockLLMServer(delay=0.01) as llm:
+            server = JobServer(init_chat_llm, run_job, max_concurrency=4)
+            httpd = server.serve(port=0, block=False)
+            base = f"http://127.0.0.1:{httpd.server_address[1]}"
+            try:
+                job_ids = []
+                for name, weight in (("a", 2), ("b", 1)):
+                    input_path = tmp_path / f"{name}.jsonl"
+                    with open(input_path, "w", encoding="utf-8") as f:
+                        for i in range(30):
+                            f.write(json.dumps({"session": f"{name}{i}", "query": "q"}) + "\n")
+                    spec = {"weight": weight, "config": {
+                        "LLM_URL": llm.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                        "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                        "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / f"{name}.out.jsonl"),
+                    }}
+                    request = urllib.request.Request(f"{base}/jobs", data=json.dumps(spec).encode("utf-8"),
+                                                     headers={"Content-Type": "application/json"})
+                    with urllib.request.urlopen(request) as response:
+                        assert response.status == 201
+                        job_ids.append(json.loads(response.read())["job_id"])
+
+                for job_id in job_ids:
+                    assert server.wait(job_id, timeout=30)
+                with urllib.request.urlopen(f"{base}/jobs/{job_ids[0]}") as response:
+                    status = json.loads(response.read())
+                assert status["state"] == JOB_DONE
+                assert status["rows_done"] == status["rows_total"] == 30
+                assert status["requests"] == 30
+                # 结束的任务已从限流器中注销
+                assert not server.limiter._shares
+
+                bad = urllib.request.Request(f"{base}/jobs", data=b'{"config": {}}')
+                try:
+                    urllib.request.urlopen(bad)
+                    assert False, "缺少LLM_URL的任务应被拒绝"
+                except urllib.error.HTTPError as e:
+                    assert e.code == 400
+            finally:
+                server.shutdown()
+
+        assert len(server._clients) == 1
+        for name in ("a", "b"):
+            with open(tmp_path / f"{name}.out.jsonl", encoding="utf-8") as f:
+                assert len(f.readlines()) == 30
+
+    def test_submit_errors_return_json(self, tmp_path):
+        """请求体有误时返回400，创建任务时的其他异常返回500，服务继续可用"""
+        def build(config, **kwargs):
+            raise RuntimeError("无法加载输出解析器")
+
+        server = JobServer(build, run_job, max_concurrency=4)
+        httpd = server.serve(port=0, block=False)
+        base = f"http://127.0.0.1:{httpd.server_address[1]}"
+        try:
+            for body, code in ((b'not json', 400), (b'[]', 400),
+                               (json.dumps({"config": {"LLM_URL": "http://127.0.0.1:1/v1"}}).encode("utf-8"), 500)):
+                try:
+                    urllib.request.urlopen(urllib.request.Request(f"{base}/jobs", data=body))
+                    assert False, "提交失败时应返回错误状态码"
+                except urllib.error.HTTPError as e:
+                    assert e.code == code
+                    assert "error" in json.loads(e.read())
+            assert not server.limiter._shares
+            with urllib.request.urlopen(f"{base}/jobs") as response:
+                assert json.loads(response.read()) == []
+        finally:
+            server.shutdown()
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from lease_queue import LeaseQueue
+from main import init_chat_llm, run_job
+from mock_llm_server import MockLLMServer
+
+WORKER_SCRIPT = """
+import sys, json
+sys.path.insert(0, sys.argv[1])
+from main import init_chat_llm, run_job
+config = json.loads(sys.argv[2])
+run_job(init_chat_llm(config), config)
+"""
+
+
+class TestLeaseQueue:
+
+    def test_claim_and_takeover(self, tmp_path):
+        """同一任务只能被一个节点领取；租约过期后被下一代接管，原持有者失去租约"""
+        first = LeaseQueue(str(tmp_path), "w1", ttl=0.3)
+        second = LeaseQueue(str(tmp_path), "w2", ttl=0.3)
+        lease = first.try_claim("0")
+        assert lease is not None and lease.generation == 0
+        assert second.try_claim("0") is None
+        assert first.renew(lease)
+
+        time.sleep(0.4)
+        takeover = second.try_claim("0")
+        assert takeover is not None and takeover.generation == 1
+        assert not first.holds(lease) and not first.renew(lease)
+
+        second.mark_done("0")
+        second.release(takeover)
+        assert first.try_claim("0") is None
+
+
+class TestLeasedWorkers:
+
+    def test_multiple_processes(self, tmp_path):
+        """多个进程共同处理一个文件，接管崩溃节点的过期租约，最后合并输出"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(95):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": "q"}) + "\n")
+        lease_dir = tmp_path / "leases"
+
+        # 模拟已崩溃的节点：块0的租约很久没有续约
+        LeaseQueue(str(lease_dir), "crashed", ttl=1)
+        stale = lease_dir / "leases" / "0.0.lease"
+        stale.write_text('{"worker": "crashed"}')
+        os.utime(stale, (time.time() - 60, time.time() - 60))
+
+        with MockLLMServer(delay=0.01) as server:
+            config = {
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16, "MAX_THREAD_NUM": 4,
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"),
+                "LEASE_DIR": str(lease_dir), "LEASE_CHUNK_ROWS": 10, "LEASE_TTL": 1,
+            }
+            workers = [subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, str(project_root),
+                                         json.dumps(dict(config, WORKER_ID=f"w{i}"))]) for i in range(3)]
+            for worker in workers:
+                assert worker.wait(timeout=60) == 0
+            assert server.requests == 95
+
+        with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        ids = [row["id"] for row in rows]
+        assert sorted(ids) == list(range(95))
+        # 按块号顺序合并
+        assert [i // 10 for i in ids] == sorted(i // 10 for i in ids)
+        assert len(os.listdir(lease_dir / "done")) == 11
+        assert not os.listdir(lease_dir / "leases")
+
+    def test_max_rows(self, tmp_path):
+        """设置MAX_ROWS时只切分并处理前MAX_ROWS行，最后一块不足LEASE_CHUNK_ROWS行"""
+        input_path = tmp_path / "in.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(95):
+                f.write(json.dumps({"id": i, "session": f"s{i}", "query": "q"}) + "\n")
+        lease_dir = tmp_path / "leases"
+
+        with MockLLMServer(delay=0.01) as server:
+            config = {
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16, "MAX_THREAD_NUM": 4,
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"), "MAX_ROWS": 25,
+                "LEASE_DIR": str(lease_dir), "LEASE_CHUNK_ROWS": 10, "LEASE_TTL": 5,
+            }
+            run_job(init_chat_llm(config), config)
+            assert server.requests == 25
+
+        with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+            assert sorted(json.loads(line)["id"] for line in f) == list(range(25))
+        assert len(os.listdir(lease_dir / "done")) == 4
@@ -0,0 +1,117 @@
+import sys
+import time
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from chat_llm import FAILURE_REASON_COLUMN
+from mock_llm_server import MockLLMServer
+
+
+# map不读写数据文件
+MAP_CONFIG = {"INPUT_PATH": None, "OUTPUT_PATH": None, "BATCH_SIZE": 8}
+
+
+class TestMapApi:
+
+    def test_config_without_env(self, llm_job, monkeypatch):
+        """传入配置映射时不读取环境变量"""
+        monkeypatch.setenv("MAX_THREAD_NUM", "999")
+        chat_llm = llm_job.build("http://127.0.0.1:1/v1", LLM_BACKEND="chat", NEAR_DUP=False, **MAP_CONFIG)
+        assert chat_llm.dataset_config.max_thread_num == 4
+        assert chat_llm.dataset_config.input_path is None
+        assert chat_llm.near_dup is None
+
+    def test_map(self, llm_job):
+        """流式返回处理结果，不修改输入的字典"""
+        rows = llm_job.rows(20)
+        with MockLLMServer(delay=0.01) as server:
+            chat_llm = llm_job.build(server.url, **MAP_CONFIG)
+            results = list(chat_llm.map(iter(rows)))
+        assert sorted(row["id"] for row in results) == list(range(20))
+        assert all(row["answer"] for row in results)
+        assert all("answer" not in row for row in rows)
+
+    def test_map_ordered_and_failed(self, llm_job):
+        """按输入顺序返回，失败的行带失败原因"""
+        rows = llm_job.rows(20)
+        del rows[5]["query"]
+        with MockLLMServer(delay=0.01) as server:
+            chat_llm = llm_job.build(server.url, **MAP_CONFIG)
+            results = list(chat_llm.map(rows, ordered=True, include_failed=True))
+            skipped = list(chat_llm.map(rows, ordered=True))
+        assert [row["id"] for row in results] == list(range(20))
+        assert results[5][FAILURE_REASON_COLUMN] == "invalid_fields"
+        assert [row["id"] for row in skipped] == [i for i in range(20) if i != 5]
+
+    def test_amap(self, llm_job):
+        """异步迭代，输入可以是异步可迭代对象；提前停止时不再提交新行"""
+        async def source(num_rows):
+            for row in llm_job.rows(num_rows):
+                await asyncio.sleep(0)
+                yield row
+
+        async def collect(chat_llm, limit=None):
+            results = []
+            async for row in chat_llm.amap(source(200), ordered=True):
+                results.append(row)
+                if limit and len(results) >= limit:
+                    break
+            return results
+
+        with MockLLMServer(delay=0.01) as server:
+            chat_llm = llm_job.build(server.url, **MAP_CONFIG)
+            results = asyncio.run(collect(chat_llm))
+            assert [row["id"] for row in results] == list(range(200))
+
+            before = server.requests
+            partial = asyncio.run(collect(chat_llm, limit=3))
+            assert [row["id"] for row in partial] == [0, 1, 2]
+            assert server.requests - before < 200
+
+    def test_concurrent_map(self, llm_job):
+        """并发的map调用共享原始响应存储，先结束的调用不关闭其他调用仍在使用的存储"""
+        store_path = str(llm_job.tmp_path / "raw.sqlite")
+        short_rows = llm_job.rows(5)
+        long_rows = [{"id": i, "session": f"t{i}", "query": f"q{i}"} for i in range(60)]
+        with MockLLMServer(delay=0.02) as server:
+            chat_llm = llm_job.build(server.url, RAW_STORE_PATH=store_path, RUN_DEADLINE=60, **MAP_CONFIG)
+            results = {}
+            long_run = threading.Thread(target=lambda: results.update(long=list(chat_llm.map(long_rows))))
+            long_run.start()
+            results["short"] = list(chat_llm.map(short_rows))
+            long_run.join(30)
+            assert chat_llm.raw_store is None
+
+        assert len(results["short"]) == 5
+        assert len(results["long"]) == 60
+        with sqlite3.connect(store_path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 65
+
+    def test_ordered_map_bounds_window(self, llm_job):
+        """按序返回时，等待较早行的结果计入BATCH_SIZE，队首的行很慢时不再继续提交新行"""
+        slow = threading.Event()
+
+        def answer(model, prompt):
+            if "SLOW" in prompt:
+                slow.wait(5)
+            return "ans"
+
+        rows = [{"id": i, "session": f"s{i}", "query": "SLOW" if i == 0 else "q"} for i in range(40)]
+        with MockLLMServer(answer=answer) as server:
+            chat_llm = llm_job.build(server.url, **MAP_CONFIG)
+            results = []
+            worker = threading.Thread(target=lambda: results.extend(chat_llm.map(rows, ordered=True)))
+            worker.start()
+            time.sleep(1)
+            submitted = server.paths["/v1/chat/completions"]
+            slow.set()
+            worker.join(10)
+
+        assert submitted <= 8
+        assert [row["id"] for row in results] == list(range(40))
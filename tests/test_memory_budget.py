@@ -0,0 +1,69 @@
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from memory_budget import InflightBudget, parse_size
+from mock_llm_server import MockLLMServer
+
+
+class TestMemoryBudget:
+
+    def test_parse_size(self):
+        """支持带单位的字节数"""
+        assert parse_size('1024') == 1024
+        assert parse_size('2K') == 2048
+        assert parse_size('1.5M') == int(1.5 * 1024 ** 2)
+        assert parse_size('2GB') == 2 * 1024 ** 3
+        assert parse_size('') is None
+        assert parse_size(None) is None
+
+    def test_budget_exceeded_and_released(self):
+        """超过预算后释放在途数据即可恢复"""
+        budget = InflightBudget(max_bytes=100)
+        cost = budget.charge(60)
+        assert not budget.exceeded()
+        cost2 = budget.charge(60)
+        assert budget.exceeded()
+        budget.release(cost)
+        budget.release(cost2)
+        assert budget.inflight_bytes == 0
+        assert budget.peak_bytes == 120
+
+    def test_growth_factor(self):
+        """结果膨胀系数按已写出的结果估计"""
+        budget = InflightBudget(max_bytes=1000)
+        budget.observe(100, 300)
+        assert budget.growth == 3.0
+        assert budget.charge(10) == 30
+
+    def test_unlimited(self):
+        """未设置预算时永不超限"""
+        budget = InflightBudget()
+        budget.charge(10 ** 12)
+        assert not budget.exceeded()
+
+
+class TestInflightLimit:
+    """process_dataset按内存预算限制同时在途的行数"""
+
+    @staticmethod
+    def _run(llm_job, max_inflight_rows):
+        llm_job.write_rows(20, lambda i: {"id": i, "session": "", "query": f"{i:04d}" + "x" * 200})
+        row_bytes = llm_job.input_path.stat().st_size // 20
+        with MockLLMServer(delay=0.1) as server:
+            llm_job.run(server.url, MAX_THREAD_NUM=16,
+                        MAX_INFLIGHT_BYTES=max_inflight_rows and max_inflight_rows * row_bytes)
+            max_active = server.max_active
+        assert len(llm_job.read()) == 20
+        return max_active
+
+    def test_budget_limits_rows_in_flight(self, llm_job):
+        """预算只够3行时，同时在途的请求不超过3个，而不是线程数"""
+        assert 1 <= self._run(llm_job, 3) <= 3
+
+    def test_without_budget_uses_all_threads(self, llm_job):
+        """未设置预算时在途行数只受线程数和batch_size限制"""
+        assert self._run(llm_job, None) > 3
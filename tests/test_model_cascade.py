@@ -0,0 +1,78 @@
+import re
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from mock_llm_server import MockLLMServer
+from model_cascade import parse_cascade, parse_tier
+
+
+def answer(model: str, prompt: str) -> str:
+    """小模型只能回答偶数行，奇数行输出无法解析的文本"""
+    row_id = int(re.search(r"\(session\)\*\*：s(\d+)", prompt).group(1))
+    if model == "small" and row_id % 2:
+        return "not sure"
+    return json.dumps({"id": row_id, "model": model})
+
+
+class TestParseCascade:
+
+    def test_parse(self):
+        """解析统一配置、分组配置和带服务地址的级联"""
+        assert parse_cascade("small, large", ["a", "b"], None) == {"a": ["small", "large"], "b": ["small", "large"]}
+        assert parse_cascade("", ["a"], None) == {}
+        assert parse_cascade("[small,large],[large]", ["a", "b"], [["small", "large"], ["large"]]) == {
+            "a": ["small", "large"], "b": ["large"]}
+        assert parse_tier("small@http://host:8000/v1") == ("small", "http://host:8000/v1")
+        with pytest.raises(ValueError):
+            parse_cascade("[small,large]", ["a", "b"], [["small", "large"]])
+
+
+class TestModelCascade:
+
+    def _run(self, llm_job, server, **config):
+        llm_job.write_rows(20)
+        chat_llm = llm_job.run(server.url, RESPONSE_PROCESSOR="json_load_response_processor", **config)
+        return chat_llm, sorted(llm_job.read(), key=lambda row: row["id"])
+
+    def test_escalate_rejected_rows(self, llm_job):
+        """只有被输出解析器拒绝的行升级到大模型，统计按级记录"""
+        with MockLLMServer(answer=answer) as server:
+            chat_llm, rows = self._run(llm_job, server, MODEL_CASCADE="small,large")
+            models = dict(server.models)
+
+        assert [row["answer"]["id"] for row in rows] == list(range(20))
+        assert all(row["answer"]["model"] == ("large" if row["id"] % 2 else "small") for row in rows)
+        assert models == {"small": 20, "large": 10}
+
+        small, large = chat_llm.cascade.tiers("test1")
+        assert (small.rows, small.accepted, small.calls) == (20, 10, 20)
+        assert (large.rows, large.accepted, large.calls) == (10, 10, 10)
+        assert small.completion_tokens > 0
+
+    def test_confidence_check(self, llm_job, monkeypatch):
+        """置信度检查不通过的输出同样升级"""
+        import response_processor
+        monkeypatch.setattr(response_processor, "reject_small_model",
+                            lambda raw, outputs: outputs["answer"]["id"] >= 5, raising=False)
+        with MockLLMServer(answer=answer) as server:
+            _, rows = self._run(llm_job, server, MODEL_CASCADE="[small,large]",
+                                CASCADE_CONFIDENCE_CHECK="reject_small_model")
+            models = dict(server.models)
+
+        assert [row["answer"]["model"] for row in rows[:6]] == ["large", "large", "large", "large", "large", "large"]
+        assert models == {"small": 20, "large": 13}
+
+    def test_tier_url(self, llm_job):
+        """级联中的模型可以使用单独的服务地址"""
+        with MockLLMServer(answer=answer) as small_server, MockLLMServer(answer=answer) as large_server:
+            _, rows = self._run(llm_job, large_server, MODEL_CASCADE=f"small@{small_server.url},large")
+            assert dict(small_server.models) == {"small": 20}
+            assert dict(large_server.models) == {"large": 10}
+        assert len(rows) == 20
@@ -0,0 +1,93 @@
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import pytest
+
+from near_dup import NearDupIndex, choose_bands, normalize
+from mock_llm_server import MockLLMServer
+
+BASE = "请根据以下用户对话总结用户的核心诉求，并给出后续跟进建议。用户说：我的订单{}一直没有发货，已经等了一周了"
+
+
+class TestNearDupIndex:
+
+    def test_normalize(self):
+        """忽略大小写、空白和标点"""
+        assert normalize("Hello, World！ 你好。") == normalize("hello world你好")
+
+    def test_choose_bands(self):
+        """候选阈值接近相似度阈值"""
+        bands, rows = choose_bands(64, 0.8)
+        assert bands * rows == 64
+        assert abs((1 / bands) ** (1 / rows) - 0.8) < 0.1
+
+    def test_similar_and_distinct(self):
+        """相似文本命中代表行，不相似的文本成为新的代表行"""
+        index = NearDupIndex(threshold=0.7)
+        sig = index.signature(BASE.format("A123"))
+        entry, _, band_keys = index.find(sig)
+        assert entry is None
+        rep = index.add(sig, "rep", band_keys)
+
+        entry, sim, _ = index.find(index.signature(BASE.format("A123") + "!!"))
+        assert entry is rep and sim == 1.0
+        entry, sim, _ = index.find(index.signature(BASE.format("A124")))
+        assert entry is rep and sim >= 0.7
+        entry, _, _ = index.find(index.signature("完全不同的另一段文本，讨论的是天气和出行计划"))
+        assert entry is None
+        assert index.signature(" ，。") is None
+
+    def test_bounded_and_discard(self):
+        """代表行数不超过上限；移除的代表行不再命中"""
+        index = NearDupIndex(max_entries=2)
+        entries = []
+        for text in ("第一段完全独立的文本内容", "second unrelated text here", "第三段又是别的内容了吧"):
+            sig = index.signature(text)
+            entries.append(index.add(sig, text, index.find(sig)[2]))
+        assert index.find(entries[0].signature)[0] is None
+        assert index.find(entries[2].signature)[0] is entries[2]
+        index.discard(entries[2])
+        assert index.find(entries[2].signature)[0] is None
+
+    def test_invalid_threshold(self):
+        with pytest.raises(ValueError):
+            NearDupIndex(threshold=1.5)
+
+
+class TestNearDupProcessing:
+
+    def test_duplicates_copy_results(self, llm_job):
+        """相似的行只调用一次LLM，其余行复制结果并记录来源"""
+        texts = [BASE.format("A123"), BASE.format("A123") + "。", BASE.format("a123"),
+                 "今天天气怎么样，适合去公园散步吗", "今天天气怎么样？适合去公园散步吗！"]
+        llm_job.write_rows(len(texts), lambda i: {"id": i, "session": "", "query": texts[i]})
+        with MockLLMServer(delay=0.05) as server:
+            llm_job.run(server.url, NEAR_DUP=True, NEAR_DUP_THRESHOLD=0.8)
+            assert server.requests == 2
+
+        rows = sorted(llm_job.read(), key=lambda row: row["id"])
+        assert [row["id"] for row in rows] == [0, 1, 2, 3, 4]
+        assert "near_dup_of" not in rows[0] and "near_dup_of" not in rows[3]
+        assert rows[1]["answer"] == rows[2]["answer"] == rows[0]["answer"]
+        assert rows[4]["answer"] == rows[3]["answer"]
+        assert rows[1]["near_dup_of"]["key"] == rows[2]["near_dup_of"]["key"]
+        assert rows[4]["near_dup_of"]["key"] != rows[1]["near_dup_of"]["key"]
+
+    def test_duplicates_reprocess_from_raw_store(self, llm_job):
+        """复制结果的行也保存原始响应，REPROCESS_ONLY时不会因缺少原始响应写入死信文件"""
+        texts = [BASE.format("A123"), BASE.format("A123") + "。", BASE.format("a123")]
+        llm_job.write_rows(len(texts), lambda i: {"id": i, "session": "", "query": texts[i]})
+        with MockLLMServer(delay=0.05) as server:
+            chat_llm = llm_job.run(server.url, NEAR_DUP=True, NEAR_DUP_THRESHOLD=0.8,
+                                   RAW_STORE_PATH=str(llm_job.tmp_path / "raw.sqlite"))
+            assert server.requests == 1
+
+        chat_llm.reprocess_dataset(num_workers=1)
+        rows = sorted(llm_job.read(), key=lambda row: row["id"])
+        assert [row["id"] for row in rows] == [0, 1, 2]
+        assert rows[1]["answer"] == rows[2]["answer"] == rows[0]["answer"]
+        assert not llm_job.dead_letter_path.exists()
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from preflight import CharTokenEstimator, DryRunReport, Preflight, build_token_estimator
+from mock_llm_server import MockLLMServer
+
+
+class TestPreflight:
+
+    def test_char_estimator_cjk(self):
+        """中文字符按约1字符/token估计，英文按约4字符/token估计"""
+        estimator = CharTokenEstimator()
+        assert estimator.count('你' * 100) >= 100
+        assert estimator.count('a' * 400) <= 110
+
+    def test_fit_max_tokens(self):
+        """max_tokens按剩余上下文调小，剩余不足时视为超长"""
+        preflight = Preflight(CharTokenEstimator(), context_length=1000, max_tokens=800, min_output_tokens=100)
+        assert preflight.fit_max_tokens('你' * 10) == 800
+        assert preflight.fit_max_tokens('你' * 500) < 800
+        assert preflight.fit_max_tokens('你' * 950) is None
+
+    def test_no_context_length(self):
+        """未设置上下文长度时不做检查"""
+        preflight = Preflight(CharTokenEstimator(), context_length=None, max_tokens=800)
+        assert preflight.fit_max_tokens('你' * 100000) == 800
+
+    def test_calibration(self):
+        """根据服务端返回的token数校准估计值"""
+        preflight = Preflight(CharTokenEstimator(), context_length=None, max_tokens=800)
+        before = preflight.prompt_tokens('hello world ' * 100)
+        for _ in range(50):
+            preflight.observe('hello world ' * 100, before * 2)
+        assert preflight.prompt_tokens('hello world ' * 100) > before * 1.5
+
+    def test_dry_run_report(self):
+        """dry-run统计重复prompt与超长prompt"""
+        preflight = Preflight(build_token_estimator('char'), context_length=1000, max_tokens=500)
+        report = DryRunReport(preflight, max_thread_num=10, avg_latency=10)
+        for prompt in ['a', 'a', 'b', '你' * 2000]:
+            report.add(prompt)
+        summary = report.summary()
+        assert summary['requests'] == 4
+        assert summary['duplicates'] == 1
+        assert summary['oversized'] == 1
+        assert summary['projected_seconds'] == 3
+
+
+class TestPreflightProcessing:
+    """process_dataset中的token预检：超长的行不发送请求，max_tokens按剩余上下文调小"""
+
+    QUERIES = ["短问题", "你" * 1000, "你" * 3000]
+
+    def _run(self, llm_job, **config):
+        llm_job.write_rows(len(self.QUERIES), lambda i: {"id": i, "session": "", "query": self.QUERIES[i]})
+        with MockLLMServer() as server:
+            llm_job.run(server.url, MAX_TOKENS=800, MODEL_CONTEXT_LENGTH=2000, MIN_OUTPUT_TOKENS=100,
+                        MAX_THREAD_NUM=1, **config)
+            return llm_job.read(), server.requests, server.max_tokens
+
+    def test_oversized_routed_and_max_tokens_clamped(self, llm_job):
+        """超长的行写入OVERSIZE_PATH且不发送请求，其余请求的max_tokens不超过剩余上下文"""
+        oversize_path = llm_job.tmp_path / "oversize.jsonl"
+        done, requests, max_tokens = self._run(llm_job, OVERSIZE_PATH=str(oversize_path))
+
+        assert requests == 2
+        assert [row["id"] for row in done] == [0, 1]
+        # 第二行的prompt约占上下文的一半以上，max_tokens调小到剩余的上下文（预检按服务端返回的token数校准，只检查范围）
+        assert max_tokens[0] == 800
+        assert 100 <= max_tokens[1] < 800
+        records = llm_job.read(oversize_path)
+        assert [(record["row"]["id"], record["oversized_prompt_keys"]) for record in records] == [(2, ["test1"])]
+        assert not llm_job.dead_letter_path.exists()
+
+    def test_oversized_skipped_to_dead_letter(self, llm_job):
+        """未设置OVERSIZE_PATH时超长的行以oversized原因写入死信文件"""
+        done, requests, _ = self._run(llm_job)
+
+        assert requests == 2
+        assert [row["id"] for row in done] == [0, 1]
+        dead = llm_job.read(llm_job.dead_letter_path)
+        assert [(record["row"]["id"], record["reason"]) for record in dead] == [(2, "oversized")]
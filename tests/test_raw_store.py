@@ -0,0 +1,69 @@
+import sys
+import json
+from pathlib import Path
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from execution_plan import compile_plan
+from main import init_chat_llm
+from raw_store import RawResponseStore, reprocess_chunk, row_key, REASON_MISSING_RAW
+import response_processor
+
+
+class TestRawStore:
+
+    def test_row_key_stable(self):
+        """行键只与输入列的值有关"""
+        assert row_key({"q": "a", "other": 1}, ["q"]) == row_key({"q": "a", "other": 2}, ["q"])
+        assert row_key({"q": "a"}, ["q"]) != row_key({"q": "b"}, ["q"])
+
+    def test_put_get(self, tmp_path):
+        """按行键读取所有prompt的原始响应，重复写入会覆盖"""
+        store = RawResponseStore(str(tmp_path / 'raw.db'), commit_every=1)
+        store.put('k1', 'test1', 'old')
+        store.put('k1', 'test1', ' answer ', reasoning='think', usage={"total_tokens": 3})
+        store.put('k1', 'test2', 'other')
+        raws = store.get('k1')
+        store.close()
+
+        assert raws['test1'] == {"response": ' answer ', "reasoning": 'think', "usage": {"total_tokens": 3}}
+        assert raws['test2']['response'] == 'other'
+
+    def test_reprocess_chunk(self):
+        """用原始响应重新运行输出解析器，缺少原始响应的行返回失败原因"""
+        plan = compile_plan(['test1'],
+                            [response_processor.simple_response_processor,
+                             response_processor.test_111_response_processor1],
+                            ['a', 'b'], ['session', 'query'], ['p'])
+        template = plan.nodes[0].template
+        chunk = [
+            ({"session": "s", "query": "x"}, {'test1': {"response": ' hi '}}),
+            ({"session": "s", "query": "y"}, {}),
+        ]
+        results = reprocess_chunk(chunk, plan.nodes)
+        assert results[0] == ({"session": "s", "query": "x", "a": "hi", "b": "111",
+                               "p": template.format("s", "x")}, None)
+        assert results[1] == ({"session": "s", "query": "y"}, REASON_MISSING_RAW)
+
+    def test_reprocess_removes_stale_dead_letter(self, tmp_path):
+        """重新处理前删除上次运行留下的死信文件"""
+        input_path = tmp_path / 'in.jsonl'
+        rows = [{"session": f"s{i}", "query": "q"} for i in range(3)]
+        input_path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+        store = RawResponseStore(str(tmp_path / 'raw.db'))
+        for row in rows:
+            store.put(row_key(row, ['session', 'query']), 'test1', 'answer')
+        store.close()
+        dead_letter_path = tmp_path / 'out.dead_letter.jsonl'
+        dead_letter_path.write_text('{"reason": "llm_failed", "row": {}}\n', encoding="utf-8")
+
+        init_chat_llm({
+            "LLM_URL": "http://127.0.0.1:1/v1", "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+            "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "INPUT_PATH": str(input_path),
+            "OUTPUT_PATH": str(tmp_path / 'out.jsonl'), "RAW_STORE_PATH": str(tmp_path / 'raw.db'),
+        }).reprocess_dataset(num_workers=1)
+
+        assert not dead_letter_path.exists()
+        assert len((tmp_path / 'out.jsonl').read_text(encoding="utf-8").splitlines()) == 3
@@ -0,0 +1,90 @@
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径，以便导入项目模块
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from main import init_chat_llm
+from mock_llm_server import MockLLMServer
+from scheduler import LengthAwareScheduler, ReorderBuffer
+
+
+class TestScheduler:
+
+    def test_longest_first(self):
+        """窗口内按成本从大到小提交"""
+        scheduler = LengthAwareScheduler('longest_first', window=10)
+        order = [row for _, row in scheduler.order([1, 5, 3, 9, 2], cost_of=float)]
+        assert order == [9, 5, 3, 2, 1]
+
+    def test_shortest_first_keeps_sequence(self):
+        """返回每行在输入中的序号"""
+        scheduler = LengthAwareScheduler('shortest_first', window=10)
+        assert list(scheduler.order([3, 1, 2], cost_of=float)) == [(1, 1), (2, 2), (0, 3)]
+
+    def test_bounded_overtaking(self):
+        """一行最多被window行插队"""
+        scheduler = LengthAwareScheduler('longest_first', window=3)
+        rows = [0] + list(range(10, 30))
+        order = [seq for seq, _ in scheduler.order(rows, cost_of=float)]
+        assert sorted(order) == list(range(len(rows)))
+        assert order.index(0) <= 3
+
+    def test_cost_uses_output_history(self):
+        """成本包含该prompt的历史平均输出token数"""
+        scheduler = LengthAwareScheduler('longest_first')
+        base = scheduler.cost([('test1', 'abcd')])
+        scheduler.observe('test1', 100)
+        assert scheduler.cost([('test1', 'abcd')]) == base + 100
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            LengthAwareScheduler('random')
+
+    def test_reorder_buffer(self):
+        """乱序完成的结果按序号输出"""
+        buffer = ReorderBuffer()
+        assert buffer.push(2, 'c') == []
+        assert buffer.push(1, 'b') == []
+        assert buffer.push(0, 'a') == ['a', 'b', 'c']
+        assert len(buffer) == 0
+
+
+class TestScheduledDataset:
+
+    def test_slow_head_row_bounds_window(self, tmp_path):
+        """队首的行很慢时，已完成、等待按序写出的行也计入BATCH_SIZE，不再继续提交新行"""
+        slow = threading.Event()
+
+        def answer(model, prompt):
+            if "SLOW" in prompt:
+                slow.wait(5)
+            return "ans"
+
+        input_path = tmp_path / "in.jsonl"
+        lines = [{"session": "s0", "query": "SLOW " + "long " * 50}]
+        lines += [{"session": f"s{i}", "query": "q"} for i in range(1, 40)]
+        input_path.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+        with MockLLMServer(answer=answer) as server:
+            chat_llm = init_chat_llm({
+                "LLM_URL": server.url, "PROMPT_KEY": "test1", "RESPONSE_PROCESSOR": "simple_response_processor",
+                "INPUT_COLUMNS": "session,query", "OUTPUT_COLUMN": "answer", "MAX_TOKENS": 16,
+                "MAX_THREAD_NUM": 8, "BATCH_SIZE": 8, "SCHEDULE_POLICY": "longest_first",
+                "INPUT_PATH": str(input_path), "OUTPUT_PATH": str(tmp_path / "out.jsonl"),
+            })
+            worker = threading.Thread(target=chat_llm.process_dataset)
+            worker.start()
+            time.sleep(1)
+            submitted = server.paths["/v1/chat/completions"]
+            slow.set()
+            worker.join(10)
+
+        assert submitted <= 8
+        lines = (tmp_path / "out.jsonl").read_text(encoding="utf-8").splitlines()
+        assert [json.loads(line)["session"] for line in lines] == [f"s{i}" for i in range(40)]